@@ -0,0 +1,26 @@
+'''
+Lazy imports of the ml backends of data_utils. A data_utils object only checks that its backend is installed
+when it is created, and the backend is imported the first time it is used (e.g. by load_ncdata_with_generator),
+so that creating or unpickling data_utils objects in every DDP rank and DataLoader worker does not import tensorflow.
+'''
+
+import importlib
+import importlib.util
+
+# module and display name of every ml_backend
+BACKEND_MODULES = {'tensorflow': ('tensorflow', 'Tensorflow'),
+                   'pytorch': ('torch', 'PyTorch')}
+
+def check_backend(ml_backend):
+    '''
+    Raises an ImportError if the module of ml_backend is not installed, without importing it.
+    '''
+    module, name = BACKEND_MODULES[ml_backend]
+    if importlib.util.find_spec(module) is None:
+        raise ImportError(f'{name} is not installed.')
+
+def import_backend(ml_backend):
+    '''
+    Returns the module of ml_backend, importing it on the first call.
+    '''
+    return importlib.import_module(BACKEND_MODULES[ml_backend][0])
@@ -0,0 +1,121 @@
+'''
+Registry of the variables that data_utils derives when they are not in a file (e.g. state_rh in v2_rh and
+state_qn in v5). Every derived variable declares the variables it is computed from, which are read or derived
+first, once per file. New derived variables are added with the derived_variable decorator, without changing
+the readers:
+
+    @derived_variable('state_qv_dyn', ['state_q0_dyn', 'state_qn'])
+    def state_qv_dyn(state_q0_dyn, state_qn):
+        ...
+
+The functions take and return NumPy arrays of shape (lev, ncol) or (ncol,).
+'''
+
+import numpy as np
+
+DERIVED_VARIABLES = {}
+
+def derived_variable(name, dependencies):
+    '''
+    Decorator registering func(*dependency_arrays) as the derivation of the variable name.
+    '''
+    def register(func):
+        DERIVED_VARIABLES[name] = (list(dependencies), func)
+        return func
+    return register
+
+def resolve_variable(var, arrays, read, available):
+    '''
+    Returns var, read from the file with read(var) if it is in available, or derived from its dependencies otherwise.
+    Every variable read or derived on the way is memoised in the dictionary arrays.
+    '''
+    if var in arrays:
+        return arrays[var]
+    if var in available:
+        arrays[var] = read(var)
+    elif var in DERIVED_VARIABLES:
+        dependencies, func = DERIVED_VARIABLES[var]
+        arrays[var] = func(*[resolve_variable(dependency, arrays, read, available) for dependency in dependencies])
+    else:
+        raise KeyError(f'{var} is not available and cannot be derived.')
+    return arrays[var]
+
+def derived_dims(var, dims):
+    '''
+    Returns the dimensions of a derived variable, those of its first dependency, given a function dims(var)
+    that returns the dimensions of the variables in the file.
+    '''
+    dependency = DERIVED_VARIABLES[var][0][0]
+    if dependency in DERIVED_VARIABLES:
+        return derived_dims(dependency, dims)
+    return dims(dependency)
+
+def eliq(T):
+    """
+    Function taking temperature (in K) and outputting liquid saturation
+    pressure (in hPa) using a polynomial fit
+    """
+    a_liq = np.array([-0.976195544e-15,-0.952447341e-13,0.640689451e-10,
+                              0.206739458e-7,0.302950461e-5,0.264847430e-3,
+                              0.142986287e-1,0.443987641,6.11239921]);
+    c_liq = -80
+    T0 = 273.16
+    return 100*np.polyval(a_liq,np.maximum(c_liq,T-T0))
+
+def eice(T):
+    """
+    Function taking temperature (in K) and outputting ice saturation
+    pressure (in hPa) using a polynomial fit
+    Each branch of the fit is only evaluated on the temperatures it applies to.
+    """
+    a_ice = np.array([0.252751365e-14,0.146898966e-11,0.385852041e-9,
+                      0.602588177e-7,0.615021634e-5,0.420895665e-3,
+                      0.188439774e-1,0.503160820,6.11147274]);
+    c_ice = np.array([273.15,185,-100,0.00763685,0.000151069,7.48215e-07])
+    T0 = 273.16
+    T = np.asarray(T)
+    warm = T > c_ice[0]
+    cold = T <= c_ice[1]
+    mid = ~warm & ~cold & (T <= c_ice[0])
+    esat = np.full(T.shape, np.nan, dtype = np.result_type(T, a_ice))
+    esat[warm] = eliq(T[warm])
+    esat[mid] = 100*np.polyval(a_ice,T[mid]-T0)
+    T_cold = np.maximum(c_ice[2],T[cold]-T0)
+    esat[cold] = 100*(c_ice[3]+T_cold*(c_ice[4]+T_cold*c_ice[5]))
+    return esat
+
+@derived_variable('liq_partition', ['state_t'])
+def liq_partition(tair):
+    # liquid fraction, ramping from 0 below T00 to 1 above T0; stays in the dtype of state_t
+    T0 = 273.16 # Freezing temperature in standard conditions
+    T00 = 253.16 # Temperature below which we use e_ice
+    liq_partition = (tair - T00) / (T0 - T00)
+    return np.maximum( 0, np.minimum( 1, liq_partition ))
+
+@derived_variable('state_rh', ['state_t', 'state_q0001', 'state_pmid', 'liq_partition'])
+def state_rh(tair, state_q0001, state_pmid, omega):
+    # relative humidity, with the saturation pressure blended between liquid and ice by liq_partition
+    esat =  omega * eliq(tair) + (1-omega) * eice(tair)
+    Rd = 287 # Specific gas constant for dry air
+    Rv = 461 # Specific gas constant for water vapor
+    qvs = (Rd*esat)/(Rv*state_pmid)
+    return state_q0001/qvs
+
+@derived_variable('icol', ['lat'])
+def icol(lat):
+    # 1-based column index
+    icol = np.empty_like(lat)
+    icol[...] = np.arange(1, lat.shape[-1] + 1)
+    return icol
+
+@derived_variable('state_qn', ['state_q0002', 'state_q0003'])
+def state_qn(state_q0002, state_q0003):
+    return state_q0002 + state_q0003
+
+@derived_variable('state_qn_prvphy', ['state_q0002_prvphy', 'state_q0003_prvphy'])
+def state_qn_prvphy(state_q0002_prvphy, state_q0003_prvphy):
+    return state_q0002_prvphy + state_q0003_prvphy
+
+@derived_variable('tm_state_qn_prvphy', ['tm_state_q0002_prvphy', 'tm_state_q0003_prvphy'])
+def tm_state_qn_prvphy(tm_state_q0002_prvphy, tm_state_q0003_prvphy):
+    return tm_state_q0002_prvphy + tm_state_q0003_prvphy
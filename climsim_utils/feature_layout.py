@@ -0,0 +1,108 @@
+import numpy as np
+
+
+class FeatureLayout:
+    '''
+    Column layout of a flat feature vector (e.g. an input or target row) built from an ordered list of
+    variables and their number of levels (data_utils.var_lens).
+    Slices and index arrays are computed once here so that transforms can gather from and scatter into
+    (..., feature_len) arrays in a single vectorized operation instead of re-deriving offsets.
+    '''
+    def __init__(self, var_list, var_lens):
+        self.var_list = list(var_list)
+        self.var_lens = {var: var_lens[var] for var in self.var_list}
+        self.offsets = {}
+        self.slices = {}
+        offset = 0
+        for var in self.var_list:
+            self.offsets[var] = offset
+            self.slices[var] = slice(offset, offset + self.var_lens[var])
+            offset += self.var_lens[var]
+        self.feature_len = offset
+        self.profile_vars = [var for var in self.var_list if self.var_lens[var] > 1]
+        self.scalar_vars = [var for var in self.var_list if self.var_lens[var] == 1]
+        # variable number and level of every column
+        self.var_index = np.repeat(np.arange(len(self.var_list)), [self.var_lens[var] for var in self.var_list])
+        self.level_index = np.concatenate([np.arange(self.var_lens[var]) for var in self.var_list]) if self.var_list else np.zeros(0, dtype = int)
+        self.is_profile = np.repeat([self.var_lens[var] > 1 for var in self.var_list], [self.var_lens[var] for var in self.var_list])
+
+    def __len__(self):
+        return self.feature_len
+
+    def __contains__(self, var):
+        return var in self.slices
+
+    def __repr__(self):
+        return f'FeatureLayout({len(self.var_list)} variables, {self.feature_len} features)'
+
+    def slice(self, var):
+        '''
+        Returns the slice of the columns of var.
+        '''
+        return self.slices[var]
+
+    def index(self, var, level = 0):
+        '''
+        Returns the column of var at the given level (scalars only have level 0).
+        '''
+        assert 0 <= level < self.var_lens[var], f'{var} has {self.var_lens[var]} levels.'
+        return self.offsets[var] + level
+
+    def indices(self, spec):
+        '''
+        Returns a sorted integer array with the columns described by spec, which is either
+        a variable name, a (variable, levels) tuple where levels is an int, slice or iterable of levels,
+        or a list of those.
+        '''
+        if isinstance(spec, str) or isinstance(spec, tuple):
+            spec = [spec]
+        columns = [np.zeros(0, dtype = np.int64)]
+        for item in spec:
+            if isinstance(item, str):
+                var, levels = item, slice(None)
+            else:
+                var, levels = item
+            level_ids = np.arange(self.var_lens[var])[levels]
+            columns.append(self.offsets[var] + np.atleast_1d(level_ids).astype(np.int64))
+        return np.unique(np.concatenate(columns))
+
+    def mask(self, spec):
+        '''
+        Returns a boolean mask of length feature_len that is True on the columns described by spec.
+        '''
+        mask = np.zeros(self.feature_len, dtype = bool)
+        mask[self.indices(spec)] = True
+        return mask
+
+    def gather(self, x, spec):
+        '''
+        Returns x[..., columns] for the columns described by spec.
+        '''
+        return x[..., self.indices(spec)]
+
+    def scatter(self, x, spec, values):
+        '''
+        Sets x[..., columns] = values for the columns described by spec, in place, and returns x.
+        '''
+        x[..., self.indices(spec)] = values
+        return x
+
+    def split(self, x, axis = -1):
+        '''
+        Returns a dictionary of views of x, one per variable, with shape (..., levels) for
+        vertically-resolved variables and (...) for scalars, where the feature axis is axis.
+        '''
+        axis = axis % x.ndim
+        before = (slice(None),)*axis
+        return {var: x[before + (self.slices[var],)] if self.var_lens[var] > 1 else x[before + (self.offsets[var],)] for var in self.var_list}
+
+    def per_variable(self, values):
+        '''
+        Expands a dictionary of per-variable values (scalars or arrays of length levels) into a
+        vector of length feature_len. Variables missing from values get 1.
+        '''
+        out = np.ones(self.feature_len)
+        for var, value in values.items():
+            if var in self.slices:
+                out[self.slices[var]] = value
+        return out
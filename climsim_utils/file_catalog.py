@@ -0,0 +1,139 @@
+import os
+import re
+import sqlite3
+
+
+class FileCatalog:
+    '''
+    On-disk SQLite catalog of the E3SM-MMF input files under data_path (data_path/<yyyy-mm>/<case>.mli.<yyyy-mm-dd-sssss>.nc),
+    with the model date and time of day parsed from every filename and the matching output file, if it exists.
+    refresh only rescans the month directories whose modification time changed since the last refresh, and
+    query answers the same regexps/start_idx/end_idx/stride selection as data_utils.set_filelist, optionally
+    restricted to a range of model dates, without listing the directories again.
+    Only input files are cataloged, so regexps can only select input files.
+    '''
+    def __init__(self, db_path, data_path, input_abbrev = 'mli', output_abbrev = 'mlo'):
+        '''
+        Args:
+            db_path (str): Path of the SQLite database, created if it does not exist.
+            data_path (str): Directory with one subdirectory of files per month.
+            input_abbrev, output_abbrev (str): Abbreviations of the input and output files in the filenames.
+        '''
+        self.db_path = db_path
+        self.data_path = data_path
+        self.input_abbrev = input_abbrev
+        self.output_abbrev = output_abbrev
+        self.filename_regex = re.compile(r'^(.*)\.' + re.escape(input_abbrev) + r'\.(\d{4})-(\d{2})-(\d{2})-(\d{5})\.nc$')
+        self.connection = sqlite3.connect(db_path)
+        self.connection.executescript('''
+            CREATE TABLE IF NOT EXISTS directories (
+                directory TEXT PRIMARY KEY,
+                mtime_ns INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                directory TEXT NOT NULL,
+                name TEXT NOT NULL,
+                timestamp TEXT NOT NULL,
+                year INTEGER NOT NULL,
+                month INTEGER NOT NULL,
+                day INTEGER NOT NULL,
+                seconds INTEGER NOT NULL,
+                output_path TEXT
+            );
+            CREATE INDEX IF NOT EXISTS files_directory ON files (directory);
+            CREATE INDEX IF NOT EXISTS files_timestamp ON files (timestamp);
+        ''')
+
+    def close(self):
+        self.connection.close()
+
+    def __len__(self):
+        return self.connection.execute('SELECT COUNT(*) FROM files').fetchone()[0]
+
+    def parse_filename(self, name):
+        '''
+        Returns (timestamp, year, month, day, seconds) of an input filename, or None if name is not an input file.
+        '''
+        match = self.filename_regex.match(name)
+        if match is None:
+            return None
+        year, month, day, seconds = match.group(2, 3, 4, 5)
+        return f'{year}-{month}-{day}-{seconds}', int(year), int(month), int(day), int(seconds)
+
+    def scan_directory(self, directory):
+        '''
+        Returns the rows of the files table for one month directory.
+        '''
+        rows = []
+        with os.scandir(os.path.join(self.data_path, directory)) as entries:
+            names = {entry.name for entry in entries if entry.is_file()}
+        for name in names:
+            parsed = self.parse_filename(name)
+            if parsed is None:
+                continue
+            output_name = name.replace(f'.{self.input_abbrev}.', f'.{self.output_abbrev}.')
+            output_path = f'{directory}/{output_name}' if output_name in names else None
+            rows.append((f'{directory}/{name}', directory, name) + parsed + (output_path,))
+        return rows
+
+    def refresh(self):
+        '''
+        Updates the catalog with the files on disk. Returns the number of rescanned directories.
+        '''
+        with os.scandir(self.data_path) as entries:
+            mtimes = {entry.name: entry.stat().st_mtime_ns for entry in entries if entry.is_dir()}
+        cataloged = dict(self.connection.execute('SELECT directory, mtime_ns FROM directories'))
+        changed = [directory for directory, mtime_ns in mtimes.items() if cataloged.get(directory) != mtime_ns]
+        removed = [directory for directory in cataloged if directory not in mtimes]
+        with self.connection:
+            for directory in removed + changed:
+                self.connection.execute('DELETE FROM files WHERE directory = ?', (directory,))
+                self.connection.execute('DELETE FROM directories WHERE directory = ?', (directory,))
+            for directory in changed:
+                self.connection.executemany('INSERT INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', self.scan_directory(directory))
+                self.connection.execute('INSERT INTO directories VALUES (?, ?)', (directory, mtimes[directory]))
+        return len(changed)
+
+    def query(self, regexps = None, start_idx = 0, end_idx = None, stride_sample = 1,
+              start_date = None, end_date = None, paired_only = False, outputs = False):
+        '''
+        Returns the sorted paths, relative to data_path, of the input files whose name matches any of the glob
+        patterns in regexps (all files if None) and whose timestamp is within [start_date, end_date], sliced
+        with [start_idx:end_idx:stride_sample] like data_utils.set_filelist.
+        Dates are prefixes of the yyyy-mm-dd-sssss timestamp, e.g. '0001-02' or '0001-02-01-01200', and end_date
+        includes every timestamp it is a prefix of. If paired_only, files without an output file are skipped.
+        If outputs, (input path, output path) tuples are returned instead.
+        '''
+        conditions = []
+        params = []
+        if regexps is not None:
+            conditions.append('(' + ' OR '.join(['name GLOB ?']*len(regexps)) + ')')
+            params.extend(regexps)
+        if start_date is not None:
+            conditions.append('timestamp >= ?')
+            params.append(start_date)
+        if end_date is not None:
+            # '~' sorts after the digits and '-', so every timestamp starting with end_date is included
+            conditions.append('timestamp <= ?')
+            params.append(end_date + '~')
+        if paired_only:
+            conditions.append('output_path IS NOT NULL')
+        where = ('WHERE ' + ' AND '.join(conditions)) if conditions else ''
+        num_files = self.connection.execute(f'SELECT COUNT(*) FROM files {where}', params).fetchone()[0]
+        selected = range(num_files)[start_idx:end_idx:stride_sample]
+        if len(selected) == 0:
+            return []
+        # slice with the row number in path order, so only the selected rows leave SQLite
+        order = 'ASC' if selected.step > 0 else 'DESC'
+        first, step = min(selected[0], selected[-1]), abs(selected.step)
+        rows = self.connection.execute(f'''
+            SELECT path, output_path FROM (
+                SELECT path, output_path, ROW_NUMBER() OVER (ORDER BY path) - 1 AS row_idx FROM files {where}
+            )
+            WHERE row_idx BETWEEN ? AND ? AND (row_idx - ?) % ? = 0
+            ORDER BY row_idx {order}
+        ''', params + [first, max(selected[0], selected[-1]), first, step]).fetchall()
+        if outputs:
+            return rows
+        return [path for path, _ in rows]
@@ -0,0 +1,505 @@
+'''
+Pressure weighting of the targets and the metrics of the predictions (MAE, RMSE, R2, bias and CRPS per
+variable and per level) as the methods of WeightingMetricsMixin. data_utils inherits them, so they use the
+target layout, grid and loaded target/prediction arrays of the data_utils object.
+'''
+
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+from .metrics_accumulator import MetricsAccumulator
+from . import pressure
+from .zonal_mean import ZonalMean
+
+class WeightingMetricsMixin:
+    '''
+    Output weighting and metrics methods of data_utils.
+    '''
+    def set_pressure_grid(self, data_split):
+        '''
+        This function sets the pressure weighting for metrics.
+        dp is taken from self.pressure_cache if the surface pressure of data_split has not changed.
+        '''
+        assert data_split in ['train', 'val', 'scoring', 'test'], 'Provided data_split is not valid. Available options are train, val, scoring, and test.'
+
+        if data_split == 'train':
+            assert self.input_train is not None
+            self.dp_train = self.calc_dp(self.input_train, data_split)
+        elif data_split == 'val':
+            assert self.input_val is not None
+            self.dp_val = self.calc_dp(self.input_val, data_split)
+        elif data_split == 'scoring':
+            assert self.input_scoring is not None
+            self.dp_scoring = self.calc_dp(self.input_scoring, data_split)
+        elif data_split == 'test':
+            assert self.input_test is not None
+            self.dp_test = self.calc_dp(self.input_test, data_split)
+
+    def calc_dp(self, npy_input, data_split = None):
+        '''
+        Returns the float32 pressure thickness of every level, of shape (time, num_latlon, 60), for input rows of
+        the current variable set. Any chunk of whole timesteps can be passed, with data_split the result is cached
+        in self.pressure_cache.
+        '''
+        state_ps = np.asarray(npy_input[:,self.ps_index], dtype = np.float64)
+        if self.normalize:
+            state_ps = state_ps*(self.input_max['state_ps'].values - self.input_min['state_ps'].values) + self.input_mean['state_ps'].values
+        state_ps = np.reshape(state_ps, (-1, self.num_latlon))
+        p0 = float(self.grid_info['P0'])
+        if data_split is None:
+            return pressure.calc_dp(state_ps, self.grid_info['hyai'].values, self.grid_info['hybi'].values, p0)
+        return self.pressure_cache.get_dp(data_split, state_ps, self.grid_info['hyai'].values, self.grid_info['hybi'].values, p0)
+
+    def get_pressure_grid_plotting(self, data_split):
+        '''
+        This function creates the temporally and zonally averaged pressure grid corresponding to a given data split.
+        '''
+        filelist = self.get_filelist(data_split)
+        ps = np.concatenate([self.get_xrdata(file, ['state_ps'])['state_ps'].values[np.newaxis, :] for file in tqdm(filelist)], axis = 0)
+        pressures = np.mean(pressure.calc_pressure(ps, self.hyam, self.hybm, self.p0, dtype = np.float64), axis = 0)
+        pressure_grid_plotting = self.zonal_mean(pressures, axis = 0).T
+        return pressure_grid_plotting
+
+    def get_output_weights(self):
+        '''
+        Returns the time-independent part of output_weighting as a (num_latlon, target_feature_len) array:
+        the inverse output scaling (if normalize), the area weight of every grid cell and the unit conversion
+        of every target variable. The conversion of ptend_u and ptend_v depends on the wind of each sample
+        and is applied in output_weighting.
+        '''
+        layout = self.target_layout
+        column_weights = np.ones(layout.feature_len)
+        for var in layout.var_list:
+            if self.normalize:
+                column_weights[layout.slice(var)] /= self.output_scale[var].values
+            if var not in ['ptend_u', 'ptend_v']:
+                column_weights[layout.slice(var)] *= self.target_energy_conv[var]
+        return self.area_wgt[:, np.newaxis] * column_weights[np.newaxis, :]
+
+    def get_dp(self, data_split, dp = None):
+        '''
+        Returns dp if it is given, otherwise the dp of data_split set by set_pressure_grid.
+        '''
+        if dp is not None:
+            pass
+        elif data_split == 'train':
+            dp = self.dp_train
+        elif data_split == 'val':
+            dp = self.dp_val
+        elif data_split == 'scoring':
+            dp = self.dp_scoring
+        elif data_split == 'test':
+            dp = self.dp_test
+        assert dp is not None
+        return dp
+
+    def output_weighting(self, output, data_split, just_weights = False, dp = None, in_place = False):
+        '''
+        This function does four transformations for the current target variables (any of the v1 to v5 sets):
+        [0] Undos the output scaling
+        [1] Weight vertical levels by dp/g
+        [2] Weight horizontal area of each grid cell by a[x]/mean(a[x])
+        [3] Unit conversion to a common energy unit
+        [0], [2] and [3] are one precomputed weight per grid cell and column (get_output_weights), applied in a
+        single broadcasted multiply, then the vertically-resolved variables are multiplied by dp/g.
+        ptend_u and ptend_v are converted with the wind speed of output before its scaling is undone.
+        Returns a dictionary of (time, grid, level) and (time, grid) views of the weighted output, or the
+        (num_samples, target_feature_len) weights themselves if just_weights.
+        If in_place, output (e.g. a float32 array) is overwritten with the weighted output instead of
+        allocating a new array.
+        dp defaults to the dp of data_split set by set_pressure_grid, pass the dp of output (see calc_dp)
+        when output is only a chunk of the data split.
+        '''
+        assert data_split in ['train', 'val', 'scoring', 'test'], 'Provided data_split is not valid. Available options are train, val, scoring, and test.'
+        layout = self.target_layout
+        num_samples = output.shape[0]
+        assert output.shape[1] == layout.feature_len, f'Expected {layout.feature_len} output columns, got {output.shape[1]}.'
+        assert num_samples % self.num_latlon == 0, 'output must consist of whole timesteps.'
+        if in_place:
+            assert isinstance(output, np.ndarray) and output.flags.c_contiguous and np.issubdtype(output.dtype, np.floating), \
+                'in_place needs a C-contiguous float array.'
+        output = output.reshape((num_samples//self.num_latlon, self.num_latlon, layout.feature_len))
+
+        dp = self.get_dp(data_split, dp)
+
+        state_wind = None
+        if 'ptend_u' in layout and 'ptend_v' in layout:
+            state_wind = np.sqrt(output[..., layout.slice('ptend_u')]**2 + output[..., layout.slice('ptend_v')]**2)
+
+        # [0], [2], [3]
+        if just_weights:
+            weighted = np.broadcast_to(self.get_output_weights(), output.shape).copy()
+        elif in_place:
+            weighted = output
+            weighted *= self.get_output_weights()
+        else:
+            weighted = output*self.get_output_weights()
+
+        # [1] dp/g = -\rho * dz, only for vertically-resolved variables
+        dp_g = np.asarray(dp, dtype = weighted.dtype)/self.grav
+        for var in layout.profile_vars:
+            weighted[..., layout.slice(var)] *= dp_g
+        if state_wind is not None:
+            weighted[..., layout.slice('ptend_u')] *= state_wind
+            weighted[..., layout.slice('ptend_v')] *= state_wind
+
+        if just_weights:
+            return weighted.reshape((num_samples, layout.feature_len))
+        return layout.split(weighted)
+
+    def output_weighting_CRPS(self, samplepreds, data_split, dp = None, in_place = False):
+        '''
+        This function applies output_weighting to an ensemble of predictions with shape
+        (num_samples, target_feature_len, num_crps_samples). The scaling, dp/g, area and energy weights
+        of every sample are computed once and broadcast over the ensemble members, and ptend_u and ptend_v
+        are converted with the wind speed of each member.
+        Returns a dictionary of (time, grid, level, num_crps_samples) and (time, grid, num_crps_samples)
+        views of the weighted ensemble, as expected by calc_CRPS.
+        If in_place, samplepreds is overwritten with the weighted ensemble instead of allocating a new array.
+        '''
+        assert data_split in ['train', 'val', 'scoring', 'test'], 'Provided data_split is not valid. Available options are train, val, scoring, and test.'
+        layout = self.target_layout
+        num_samples, feature_len, num_crps = samplepreds.shape
+        assert feature_len == layout.feature_len, f'Expected {layout.feature_len} output columns, got {feature_len}.'
+        assert num_samples % self.num_latlon == 0, 'samplepreds must consist of whole timesteps.'
+        if in_place:
+            assert isinstance(samplepreds, np.ndarray) and samplepreds.flags.c_contiguous and np.issubdtype(samplepreds.dtype, np.floating), \
+                'in_place needs a C-contiguous float array.'
+        samplepreds = samplepreds.reshape((num_samples//self.num_latlon, self.num_latlon, feature_len, num_crps))
+        dp = self.get_dp(data_split, dp)
+
+        state_wind = None
+        if 'ptend_u' in layout and 'ptend_v' in layout:
+            state_wind = np.sqrt(samplepreds[:, :, layout.slice('ptend_u')]**2 + samplepreds[:, :, layout.slice('ptend_v')]**2)
+
+        # [0], [2], [3] and [1] of output_weighting, shared by all members
+        weights = np.broadcast_to(self.get_output_weights().astype(samplepreds.dtype), samplepreds.shape[:3]).copy()
+        dp_g = np.asarray(dp, dtype = weights.dtype)/self.grav
+        for var in layout.profile_vars:
+            weights[..., layout.slice(var)] *= dp_g
+        if in_place:
+            weighted = samplepreds
+            weighted *= weights[..., np.newaxis]
+        else:
+            weighted = samplepreds*weights[..., np.newaxis]
+        if state_wind is not None:
+            weighted[:, :, layout.slice('ptend_u')] *= state_wind
+            weighted[:, :, layout.slice('ptend_v')] *= state_wind
+        return layout.split(weighted, axis = 2)
+
+    def reweight_target(self, data_split):
+        '''
+        data_split should be train, val, scoring, or test
+        weights target variables assuming V1 outputs using the output_weighting function
+        '''
+        assert data_split in ['train', 'val', 'scoring', 'test'], 'Provided data_split is not valid. Available options are train, val, scoring, and test.'
+        if data_split == 'train':
+            assert self.target_train is not None
+            self.target_weighted_train = self.output_weighting(self.target_train, data_split)
+        elif data_split == 'val':
+            assert self.target_val is not None
+            self.target_weighted_val = self.output_weighting(self.target_val, data_split)
+        elif data_split == 'scoring':
+            assert self.target_scoring is not None
+            self.target_weighted_scoring = self.output_weighting(self.target_scoring, data_split)
+        elif data_split == 'test':
+            assert self.target_test is not None
+            self.target_weighted_test = self.output_weighting(self.target_test, data_split)
+
+    def reweight_preds(self, data_split):
+        '''
+        weights predictions assuming V1 outputs using the output_weighting function
+        '''
+        assert data_split in ['train', 'val', 'scoring', 'test'], 'Provided data_split is not valid. Available options are train, val, scoring, and test.'
+        assert self.model_names is not None
+
+        if data_split == 'train':
+            assert self.preds_train is not None
+            for model_name in self.model_names:
+                self.preds_weighted_train[model_name] = self.output_weighting(self.preds_train[model_name], data_split)
+        elif data_split == 'val':
+            assert self.preds_val is not None
+            for model_name in self.model_names:
+                self.preds_weighted_val[model_name] = self.output_weighting(self.preds_val[model_name], data_split)
+        elif data_split == 'scoring':
+            assert self.preds_scoring is not None
+            for model_name in self.model_names:
+                self.preds_weighted_scoring[model_name] = self.output_weighting(self.preds_scoring[model_name], data_split)
+        elif data_split == 'test':
+            assert self.preds_test is not None
+            for model_name in self.model_names:
+                self.preds_weighted_test[model_name] = self.output_weighting(self.preds_test[model_name], data_split)
+
+    def reweight_samplepreds(self, data_split):
+        '''
+        weights ensemble predictions (num_samples x features x num_crps_samples) using the output_weighting_CRPS function
+        '''
+        assert data_split in ['train', 'val', 'scoring', 'test'], 'Provided data_split is not valid. Available options are train, val, scoring, and test.'
+        assert self.model_names is not None
+
+        if data_split == 'train':
+            assert self.samplepreds_train is not None
+            for model_name in self.model_names:
+                self.samplepreds_weighted_train[model_name] = self.output_weighting_CRPS(self.samplepreds_train[model_name], data_split)
+        elif data_split == 'val':
+            assert self.samplepreds_val is not None
+            for model_name in self.model_names:
+                self.samplepreds_weighted_val[model_name] = self.output_weighting_CRPS(self.samplepreds_val[model_name], data_split)
+        elif data_split == 'scoring':
+            assert self.samplepreds_scoring is not None
+            for model_name in self.model_names:
+                self.samplepreds_weighted_scoring[model_name] = self.output_weighting_CRPS(self.samplepreds_scoring[model_name], data_split)
+        elif data_split == 'test':
+            assert self.samplepreds_test is not None
+            for model_name in self.model_names:
+                self.samplepreds_weighted_test[model_name] = self.output_weighting_CRPS(self.samplepreds_test[model_name], data_split)
+
+    def calc_MAE(self, pred, target, avg_grid = True):
+        '''
+        calculate 'globally averaged' mean absolute error 
+        for vertically-resolved variables, shape should be time x grid x level
+        for scalars, shape should be time x grid
+
+        returns vector of length level or 1
+        '''
+        assert pred.shape[1] == self.num_latlon
+        assert pred.shape == target.shape
+        mae = np.abs(pred - target).mean(axis = 0)
+        if avg_grid:
+            return mae.mean(axis = 0) # we decided to average globally at end
+        else:
+            return mae
+
+    def calc_RMSE(self, pred, target, avg_grid = True):
+        '''
+        calculate 'globally averaged' root mean squared error 
+        for vertically-resolved variables, shape should be time x grid x level
+        for scalars, shape should be time x grid
+
+        returns vector of length level or 1
+        '''
+        assert pred.shape[1] == self.num_latlon
+        assert pred.shape == target.shape
+        sq_diff = (pred - target)**2
+        rmse = np.sqrt(sq_diff.mean(axis = 0)) # mean over time
+        if avg_grid:
+            return rmse.mean(axis = 0) # we decided to separately average globally at end
+        else:
+            return rmse
+
+    def calc_R2(self, pred, target, avg_grid = True):
+        '''
+        calculate 'globally averaged' R-squared
+        for vertically-resolved variables, input shape should be time x grid x level
+        for scalars, input shape should be time x grid
+
+        returns vector of length level or 1
+        '''
+        assert pred.shape[1] == self.num_latlon
+        assert pred.shape == target.shape
+        sq_diff = (pred - target)**2
+        tss_time = (target - target.mean(axis = 0)[np.newaxis, ...])**2 # mean over time
+        r_squared = 1 - sq_diff.sum(axis = 0)/tss_time.sum(axis = 0) # sum over time
+        if avg_grid:
+            return r_squared.mean(axis = 0) # we decided to separately average globally at end
+        else:
+            return r_squared
+
+    def calc_bias(self, pred, target, avg_grid = True):
+        '''
+        calculate bias
+        for vertically-resolved variables, input shape should be time x grid x level
+        for scalars, input shape should be time x grid
+
+        returns vector of length level or 1
+        '''
+        assert pred.shape[1] == self.num_latlon
+        assert pred.shape == target.shape
+        bias = pred.mean(axis = 0) - target.mean(axis = 0)
+        if avg_grid:
+            return bias.mean(axis = 0) # we decided to separately average globally at end
+        else:
+            return bias
+
+    def calc_CRPS(self, samplepreds, target, avg_grid = True, chunk_size = 24):
+        '''
+        calculate 'globally averaged' continuous ranked probability score
+        for vertically-resolved variables, input shape should be time x grid x level x num_crps_samples
+        for scalars, input shape should be time x grid x num_crps_samples
+
+        chunk_size timesteps are scored at a time and summed over time in float64, so only one chunk
+        of the ensemble is sorted and held in memory at once.
+
+        returns vector of length level or 1
+        '''
+        assert samplepreds.shape[1] == self.num_latlon
+        assert len(samplepreds.shape) == len(target.shape) + 1
+        assert len(samplepreds.shape) == 3 or len(samplepreds.shape) == 4
+        num_time = samplepreds.shape[0]
+        num_crps = samplepreds.shape[-1]
+        # sum over member pairs of |x_j - x_i| from the sorted members: x_(k) has 2k - num_crps - 1 more smaller than larger members
+        # (the pairs are not counted twice, so no need to divide by two)
+        rank_weights = 2*np.arange(1, num_crps + 1) - num_crps - 1
+        mae_sum = 0
+        spread_sum = 0
+        for start in range(0, num_time, chunk_size):
+            chunk = np.asarray(samplepreds[start:start + chunk_size])
+            chunk_target = np.asarray(target[start:start + chunk_size])
+            mae_sum = mae_sum + np.abs(chunk - chunk_target[..., np.newaxis]).sum(axis = (0, -1), dtype = np.float64) # sum over time and crps samples
+            chunk = np.sort(chunk, axis = -1)
+            spread_sum = spread_sum + (chunk @ rank_weights.astype(chunk.dtype)).sum(axis = 0, dtype = np.float64) # sum over crps samples and time
+        crps = mae_sum/(num_time*num_crps) - spread_sum/(num_time*num_crps*(num_crps-1))
+        if avg_grid:
+            return crps.mean(axis = 0) # we decided to separately average globally at end
+        else:
+            return crps
+
+    def create_metrics_df(self, data_split):
+        '''
+        creates a dataframe of metrics for each model
+        '''
+        assert data_split in ['train', 'val', 'scoring', 'test'], \
+            'Provided data_split is not valid. Available options are train, val, scoring, and test.'
+        assert len(self.model_names) != 0
+        assert len(self.metrics_names) != 0
+        assert len(self.target_vars) != 0
+        assert self.target_feature_len is not None
+
+        if data_split == 'train':
+            assert len(self.preds_weighted_train) != 0
+            assert len(self.target_weighted_train) != 0
+            for model_name in self.model_names:
+                df_var = pd.DataFrame(columns = self.metrics_names, index = self.target_vars)
+                df_var.index.name = 'variable'
+                df_idx = pd.DataFrame(columns = self.metrics_names, index = range(self.target_feature_len))
+                df_idx.index.name = 'output_idx'
+                for metric_name in self.metrics_names:
+                    current_idx = 0
+                    for target_var in self.target_vars:
+                        preds_weighted = self.samplepreds_weighted_train if metric_name == 'CRPS' else self.preds_weighted_train
+                        metric = self.metrics_dict[metric_name](preds_weighted[model_name][target_var], self.target_weighted_train[target_var])
+                        df_var.loc[target_var, metric_name] = np.mean(metric)
+                        df_idx.loc[current_idx:current_idx + self.var_lens[target_var] - 1, metric_name] = np.atleast_1d(metric)
+                        current_idx += self.var_lens[target_var]
+                self.metrics_var_train[model_name] = df_var
+                self.metrics_idx_train[model_name] = df_idx
+
+        elif data_split == 'val':
+            assert len(self.preds_weighted_val) != 0
+            assert len(self.target_weighted_val) != 0
+            for model_name in self.model_names:
+                df_var = pd.DataFrame(columns = self.metrics_names, index = self.target_vars)
+                df_var.index.name = 'variable'
+                df_idx = pd.DataFrame(columns = self.metrics_names, index = range(self.target_feature_len))
+                df_idx.index.name = 'output_idx'
+                for metric_name in self.metrics_names:
+                    current_idx = 0
+                    for target_var in self.target_vars:
+                        preds_weighted = self.samplepreds_weighted_val if metric_name == 'CRPS' else self.preds_weighted_val
+                        metric = self.metrics_dict[metric_name](preds_weighted[model_name][target_var], self.target_weighted_val[target_var])
+                        df_var.loc[target_var, metric_name] = np.mean(metric)
+                        df_idx.loc[current_idx:current_idx + self.var_lens[target_var] - 1, metric_name] = np.atleast_1d(metric)
+                        current_idx += self.var_lens[target_var]
+                self.metrics_var_val[model_name] = df_var
+                self.metrics_idx_val[model_name] = df_idx
+
+        elif data_split == 'scoring':
+            assert len(self.preds_weighted_scoring) != 0
+            assert len(self.target_weighted_scoring) != 0
+            for model_name in self.model_names:
+                df_var = pd.DataFrame(columns = self.metrics_names, index = self.target_vars)
+                df_var.index.name = 'variable'
+                df_idx = pd.DataFrame(columns = self.metrics_names, index = range(self.target_feature_len))
+                df_idx.index.name = 'output_idx'
+                for metric_name in self.metrics_names:
+                    current_idx = 0
+                    for target_var in self.target_vars:
+                        preds_weighted = self.samplepreds_weighted_scoring if metric_name == 'CRPS' else self.preds_weighted_scoring
+                        metric = self.metrics_dict[metric_name](preds_weighted[model_name][target_var], self.target_weighted_scoring[target_var])
+                        df_var.loc[target_var, metric_name] = np.mean(metric)
+                        df_idx.loc[current_idx:current_idx + self.var_lens[target_var] - 1, metric_name] = np.atleast_1d(metric)
+                        current_idx += self.var_lens[target_var]
+                self.metrics_var_scoring[model_name] = df_var
+                self.metrics_idx_scoring[model_name] = df_idx
+
+        elif data_split == 'test':
+            assert len(self.preds_weighted_test) != 0
+            assert len(self.target_weighted_test) != 0
+            for model_name in self.model_names:
+                df_var = pd.DataFrame(columns = self.metrics_names, index = self.target_vars)
+                df_var.index.name = 'variable'
+                df_idx = pd.DataFrame(columns = self.metrics_names, index = range(self.target_feature_len))
+                df_idx.index.name = 'output_idx'
+                for metric_name in self.metrics_names:
+                    current_idx = 0
+                    for target_var in self.target_vars:
+                        preds_weighted = self.samplepreds_weighted_test if metric_name == 'CRPS' else self.preds_weighted_test
+                        metric = self.metrics_dict[metric_name](preds_weighted[model_name][target_var], self.target_weighted_test[target_var])
+                        df_var.loc[target_var, metric_name] = np.mean(metric)
+                        df_idx.loc[current_idx:current_idx + self.var_lens[target_var] - 1, metric_name] = np.atleast_1d(metric)
+                        current_idx += self.var_lens[target_var]
+                self.metrics_var_test[model_name] = df_var
+                self.metrics_idx_test[model_name] = df_idx
+
+    def accumulate_metrics(self, npy_input, target, preds, data_split, chunk_size = 72):
+        '''
+        Weights target and the predictions of every model with output_weighting, chunk_size timesteps at a time,
+        and accumulates them into a MetricsAccumulator per model, which is returned as a dictionary.
+        npy_input, target and preds[model_name] are arrays of whole timesteps (e.g. memory-mapped .npy files, see
+        load_npy_file), only one chunk of them is weighted and held in memory at once.
+        Disjoint ranges of timesteps can be accumulated in parallel and combined with MetricsAccumulator.merge.
+        '''
+        chunk_rows = chunk_size*self.num_latlon
+        num_rows = target.shape[0]
+        assert num_rows % self.num_latlon == 0, 'Data must consist of whole timesteps.'
+        accumulators = {model_name: MetricsAccumulator(self.target_vars, self.var_lens, self.num_latlon) for model_name in self.model_names}
+        for start in range(0, num_rows, chunk_rows):
+            dp = self.calc_dp(np.asarray(npy_input[start:start + chunk_rows]))
+            target_weighted = self.output_weighting(np.asarray(target[start:start + chunk_rows]), data_split, dp = dp)
+            target_weighted = accumulators[self.model_names[0]].to_array(target_weighted)
+            for model_name in self.model_names:
+                preds_weighted = self.output_weighting(np.asarray(preds[model_name][start:start + chunk_rows]), data_split, dp = dp)
+                accumulators[model_name].update(preds_weighted, target_weighted)
+        return accumulators
+
+    def create_metrics_df_streaming(self, data_split, chunk_size = 72):
+        '''
+        creates the same dataframes of metrics as reweight_target, reweight_preds and create_metrics_df
+        without holding the weighted data split in memory, see accumulate_metrics
+        CRPS is not supported
+        '''
+        assert data_split in ['train', 'val', 'scoring', 'test'], \
+            'Provided data_split is not valid. Available options are train, val, scoring, and test.'
+        assert len(self.model_names) != 0
+        assert len(self.metrics_names) != 0
+        assert len(self.target_vars) != 0
+
+        if data_split == 'train':
+            assert self.input_train is not None and self.target_train is not None and self.preds_train is not None
+            accumulators = self.accumulate_metrics(self.input_train, self.target_train, self.preds_train, data_split, chunk_size)
+            for model_name in self.model_names:
+                self.metrics_var_train[model_name], self.metrics_idx_train[model_name] = accumulators[model_name].metrics_dfs(self.metrics_names)
+        elif data_split == 'val':
+            assert self.input_val is not None and self.target_val is not None and self.preds_val is not None
+            accumulators = self.accumulate_metrics(self.input_val, self.target_val, self.preds_val, data_split, chunk_size)
+            for model_name in self.model_names:
+                self.metrics_var_val[model_name], self.metrics_idx_val[model_name] = accumulators[model_name].metrics_dfs(self.metrics_names)
+        elif data_split == 'scoring':
+            assert self.input_scoring is not None and self.target_scoring is not None and self.preds_scoring is not None
+            accumulators = self.accumulate_metrics(self.input_scoring, self.target_scoring, self.preds_scoring, data_split, chunk_size)
+            for model_name in self.model_names:
+                self.metrics_var_scoring[model_name], self.metrics_idx_scoring[model_name] = accumulators[model_name].metrics_dfs(self.metrics_names)
+        elif data_split == 'test':
+            assert self.input_test is not None and self.target_test is not None and self.preds_test is not None
+            accumulators = self.accumulate_metrics(self.input_test, self.target_test, self.preds_test, data_split, chunk_size)
+            for model_name in self.model_names:
+                self.metrics_var_test[model_name], self.metrics_idx_test[model_name] = accumulators[model_name].metrics_dfs(self.metrics_names)
+
+    def get_zonal_mean(self, area_weighted = False, bins = None):
+        '''
+        This function returns a ZonalMean operator over the grid columns, averaging over every latitude
+        (like self.zonal_mean) or over the latitude bands with edges bins, optionally weighted by column area.
+        '''
+        return ZonalMean(self.grid_info['lat'].values,
+                         weights = self.grid_info['area'].values if area_weighted else None,
+                         bins = bins)
@@ -0,0 +1,111 @@
+import numpy as np
+import pandas as pd
+from .feature_layout import FeatureLayout
+
+
+class MetricsAccumulator:
+    '''
+    Running sums for the MAE, RMSE, R2 and bias of data_utils, accumulated over chunks of timesteps.
+    For every (column, feature) it keeps the number of timesteps, the sums of |err|, err^2 and err, and the
+    running mean and sum of squared deviations of the target (merged with Chan et al.'s parallel update),
+    so metrics can be computed from data that never fits in memory at once. Accumulators of disjoint
+    chunks can be combined with merge.
+    '''
+    metric_names = ['MAE', 'RMSE', 'R2', 'bias']
+
+    def __init__(self, var_list, var_lens, num_latlon):
+        self.layout = FeatureLayout(var_list, var_lens)
+        self.num_latlon = num_latlon
+        self.num_timesteps = 0
+        shape = (num_latlon, self.layout.feature_len)
+        self.sum_abs_err = np.zeros(shape)
+        self.sum_sq_err = np.zeros(shape)
+        self.sum_err = np.zeros(shape)
+        self.target_mean = np.zeros(shape)
+        self.target_m2 = np.zeros(shape)
+
+    def to_array(self, values):
+        '''
+        Returns values as a (time, num_latlon, feature_len) array. values is either such an array or a dictionary
+        of (time, num_latlon, levels) and (time, num_latlon) arrays, as returned by data_utils.output_weighting.
+        '''
+        if isinstance(values, dict):
+            num_timesteps = values[self.layout.var_list[0]].shape[0]
+            values = np.concatenate([np.reshape(values[var], (num_timesteps, self.num_latlon, -1)) for var in self.layout.var_list], axis = -1)
+        assert values.shape[1:] == (self.num_latlon, self.layout.feature_len), f'Expected (time, {self.num_latlon}, {self.layout.feature_len}), got {values.shape}.'
+        return values
+
+    def update(self, pred, target):
+        '''
+        Adds a chunk of timesteps of (weighted) predictions and targets.
+        '''
+        pred = self.to_array(pred)
+        target = self.to_array(target)
+        assert pred.shape == target.shape
+        num_timesteps = target.shape[0]
+        if num_timesteps == 0:
+            return self
+        err = pred - target
+        self.sum_abs_err += np.abs(err).sum(axis = 0)
+        self.sum_sq_err += (err**2).sum(axis = 0)
+        self.sum_err += err.sum(axis = 0)
+        chunk_mean = target.mean(axis = 0)
+        chunk_m2 = ((target - chunk_mean[np.newaxis, ...])**2).sum(axis = 0)
+        self._merge_moments(num_timesteps, chunk_mean, chunk_m2)
+        return self
+
+    def merge(self, other):
+        '''
+        Adds the sums of another accumulator over a disjoint set of timesteps.
+        '''
+        assert self.layout.var_list == other.layout.var_list and self.num_latlon == other.num_latlon
+        if other.num_timesteps == 0:
+            return self
+        self.sum_abs_err += other.sum_abs_err
+        self.sum_sq_err += other.sum_sq_err
+        self.sum_err += other.sum_err
+        self._merge_moments(other.num_timesteps, other.target_mean, other.target_m2)
+        return self
+
+    def _merge_moments(self, num_timesteps, mean, m2):
+        total = self.num_timesteps + num_timesteps
+        delta = mean - self.target_mean
+        self.target_m2 += m2 + delta**2*(self.num_timesteps*num_timesteps/total)
+        self.target_mean += delta*(num_timesteps/total)
+        self.num_timesteps = total
+
+    def metric(self, metric_name, avg_grid = True):
+        '''
+        Returns the metric for every feature, of shape (feature_len) or (num_latlon, feature_len) if avg_grid is False.
+        Matches data_utils.calc_MAE, calc_RMSE, calc_R2 and calc_bias applied to all timesteps at once.
+        '''
+        assert self.num_timesteps > 0, 'No data has been accumulated.'
+        if metric_name == 'MAE':
+            metric = self.sum_abs_err/self.num_timesteps
+        elif metric_name == 'RMSE':
+            metric = np.sqrt(self.sum_sq_err/self.num_timesteps)
+        elif metric_name == 'R2':
+            metric = 1 - self.sum_sq_err/self.target_m2
+        elif metric_name == 'bias':
+            metric = self.sum_err/self.num_timesteps
+        else:
+            raise ValueError(f'{metric_name} cannot be accumulated, available metrics are {self.metric_names}.')
+        if avg_grid:
+            return metric.mean(axis = 0)
+        return metric
+
+    def metrics_dfs(self, metrics_names):
+        '''
+        Returns the per-variable and per-output-index dataframes of data_utils.create_metrics_df.
+        '''
+        df_var = pd.DataFrame(columns = metrics_names, index = self.layout.var_list)
+        df_var.index.name = 'variable'
+        df_idx = pd.DataFrame(columns = metrics_names, index = range(self.layout.feature_len))
+        df_idx.index.name = 'output_idx'
+        for metric_name in metrics_names:
+            metric = self.metric(metric_name)
+            for target_var in self.layout.var_list:
+                var_slice = self.layout.slice(target_var)
+                df_var.loc[target_var, metric_name] = np.mean(metric[var_slice])
+                df_idx.loc[var_slice.start:var_slice.stop - 1, metric_name] = metric[var_slice]
+        return df_var, df_idx
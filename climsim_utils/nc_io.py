@@ -0,0 +1,786 @@
+'''
+Reading of the E3SM-MMF input/output netCDF files into input and target arrays, and their conversion to
+.npy, .h5 and shard files, as the methods of NetCDFIOMixin. data_utils inherits them, so they use the variable
+lists, layouts, normalization and filelists of the data_utils object.
+'''
+
+# netCDF4 is imported before h5py (which is only imported when it is needed), see data_utils
+import netCDF4
+
+import concurrent.futures
+import json
+import os
+import numpy as np
+import xarray as xr
+from tqdm import tqdm
+from .sample_index import SampleIndex
+from .normalization_stats import NormalizationStats, EXP_LAMBDA_INPUTS
+from .derived_variables import DERIVED_VARIABLES, resolve_variable, derived_dims
+
+# data_utils instance used by the save_as_npy_streaming worker processes
+_convert_worker_data = None
+
+def _init_convert_worker(data):
+    global _convert_worker_data
+    _convert_worker_data = data
+
+def _convert_ncfile(data, file_idx, file):
+    """
+    Convert one input file into float32 input/target rows.
+    Returns (file_idx, input, target); data defaults to the worker's data_utils instance.
+    """
+    if data is None:
+        data = _convert_worker_data
+    npy_input, npy_target = data.load_ncfile(file)
+    if data.normalize:
+        # replace inf and nan with 0
+        npy_input[np.isinf(npy_input)] = 0
+        npy_input[np.isnan(npy_input)] = 0
+    return file_idx, np.float32(npy_input), np.float32(npy_target)
+
+def _convert_ncfile_subsets(data, file_idx, file, subset_specs):
+    """
+    Convert one input file into float32 input/target rows of every subset in subset_specs.
+    Returns (file_idx, {subset: (input, target)}); data defaults to the worker's data_utils instance.
+    """
+    if data is None:
+        data = _convert_worker_data
+    arrays = data.load_ncfile_subsets(file, subset_specs)
+    for subset, (npy_input, npy_target) in arrays.items():
+        if data.normalize:
+            # replace inf and nan with 0
+            npy_input[np.isinf(npy_input)] = 0
+            npy_input[np.isnan(npy_input)] = 0
+        arrays[subset] = (np.float32(npy_input), np.float32(npy_target))
+    return file_idx, arrays
+
+def _ncfile_norm_stats(data, file_idx, file):
+    """
+    Compute the NormalizationStats of the unnormalized inputs and targets of one input file.
+    Returns (file_idx, stats); data defaults to the worker's data_utils instance.
+    """
+    if data is None:
+        data = _convert_worker_data
+    stats = NormalizationStats(data.input_layout, data.target_layout, data.num_levels)
+    state_vars = ['state_t', 'state_q0001']
+    if data.full_vars or data.full_vars_v5:
+        state_vars = state_vars + ['state_q0002', 'state_q0003', 'state_u', 'state_v']
+    cloud_vars = list(EXP_LAMBDA_INPUTS.values())
+    arrays_input = data.read_ncvars(file, list(dict.fromkeys(data.input_vars + state_vars + cloud_vars)))
+    output_file = file.replace(f'.{data.input_abbrev}.', f'.{data.output_abbrev}.')
+    arrays_target = data.read_ncvars(output_file, state_vars + [var for var in data.target_vars if var not in data.ptend_sources])
+    num_cols = int(data.valid_cols.sum())
+    npy_input = data.fill_feature_array(arrays_input, data.input_vars, np.empty((num_cols, data.input_feature_len)))
+    npy_target = data.fill_target_array(arrays_input, arrays_target, data.target_vars, np.empty((num_cols, data.target_feature_len)))
+    cloud = {var: arrays_input[var][:, data.valid_cols].T for var in cloud_vars}
+    return file_idx, stats.update(npy_input, npy_target, cloud)
+
+class NetCDFIOMixin:
+    '''
+    netCDF reading and .npy/.h5/shard writing methods of data_utils.
+    '''
+    def get_xrdata(self, file, file_vars = None):
+        '''
+        This function reads in a file and returns an xarray dataset with the variables specified.
+        file_vars must be a list of strings.
+        '''
+        ds = xr.open_dataset(file, engine = 'netcdf4')
+        if file_vars is not None:
+            # add the derived variables in file_vars that are not in ds, see derived_variables
+            arrays = {}
+            for var in file_vars:
+                if var not in ds and var in DERIVED_VARIABLES:
+                    derived = resolve_variable(var, arrays, lambda var: ds[var].values, ds.variables)
+                    ds[var] = (derived_dims(var, lambda var: ds[var].dims), derived)
+
+        if file_vars is not None:
+            ds = ds[file_vars]
+        ds = ds.merge(self.grid_info[['lat','lon']])
+        ds = ds.where((ds['lat']>-999)*(ds['lat']<999), drop=True)
+        ds = ds.where((ds['lon']>-999)*(ds['lon']<999), drop=True)
+        return ds
+
+    def get_input(self, input_file):
+        '''
+        This function reads in a file and returns an xarray dataset with the input variables for the emulator.
+        '''
+        # read inputs
+        return self.get_xrdata(input_file, self.input_vars)
+
+    def get_target(self, input_file):
+        '''
+        This function reads in a file and returns an xarray dataset with the target variables for the emulator.
+        '''
+        tmp_input_vars = self.input_vars
+        if 'state_q0001' not in input_file: 
+            tmp_input_vars = tmp_input_vars + ['state_q0001']
+        if ('state_q0002' not in input_file) and (self.full_vars or self.full_vars_v5):
+            tmp_input_vars = tmp_input_vars + ['state_q0002']
+        if ('state_q0003' not in input_file) and (self.full_vars or self.full_vars_v5):
+            tmp_input_vars = tmp_input_vars + ['state_q0003']
+        ds_input = self.get_xrdata(input_file, tmp_input_vars)
+        
+        ds_target = self.get_xrdata(input_file.replace(f'.{self.input_abbrev}.',f'.{self.output_abbrev}.'))
+        # each timestep is 20 minutes which corresponds to 1200 seconds
+        ds_target['ptend_t'] = (ds_target['state_t'] - ds_input['state_t'])/1200 # T tendency [K/s]
+        ds_target['ptend_q0001'] = (ds_target['state_q0001'] - ds_input['state_q0001'])/1200 # Q1 tendency [kg/kg/s]
+        if self.full_vars:
+            ds_target['ptend_q0002'] = (ds_target['state_q0002'] - ds_input['state_q0002'])/1200 # Q2 tendency [kg/kg/s]
+            ds_target['ptend_q0003'] = (ds_target['state_q0003'] - ds_input['state_q0003'])/1200 # Q3 tendency [kg/kg/s]
+            ds_target['ptend_u'] = (ds_target['state_u'] - ds_input['state_u'])/1200 # U tendency [m/s/s]
+            ds_target['ptend_v'] = (ds_target['state_v'] - ds_input['state_v'])/1200 # V tendency [m/s/s]   
+        elif self.full_vars_v5:
+            ds_target['ptend_qn'] = (ds_target['state_q0002'] - ds_input['state_q0002'] + ds_target['state_q0003'] - ds_input['state_q0003'])/1200 # Qn=Q2+Q3 tendency [kg/kg/s]
+            ds_target['ptend_u'] = (ds_target['state_u'] - ds_input['state_u'])/1200 # U tendency [m/s/s]
+            ds_target['ptend_v'] = (ds_target['state_v'] - ds_input['state_v'])/1200 # V tendency [m/s/s]   
+        ds_target = ds_target[self.target_vars]
+        return ds_target
+
+    def read_ncvars(self, file, file_vars):
+        '''
+        This function reads the variables in file_vars from a file with netCDF4 and returns a dictionary of numpy arrays
+        with shape (lev, ncol) for vertically-resolved variables and (ncol,) for scalars.
+        Derived inputs that are not in the file are computed from the registry in derived_variables, like in get_xrdata.
+        '''
+        arrays = {}
+        with netCDF4.Dataset(file, 'r') as ds:
+            ds.set_always_mask(False)
+            def read(var):
+                if var not in arrays:
+                    nc_var = ds.variables[var]
+                    arr = nc_var[:]
+                    if np.ma.isMaskedArray(arr):
+                        arr = np.ma.filled(arr.astype(np.promote_types(arr.dtype, np.float32)), np.nan)
+                    dims = [dim for dim, size in zip(nc_var.dimensions, nc_var.shape) if dim in ('lev', 'ncol') or size != 1]
+                    arr = arr.reshape([size for dim, size in zip(nc_var.dimensions, nc_var.shape) if dim in dims])
+                    if dims == ['ncol', 'lev']:
+                        arr = arr.T
+                    arrays[var] = arr
+                return arrays[var]
+
+            for var in file_vars:
+                if var in ds.variables:
+                    read(var)
+                elif var in DERIVED_VARIABLES:
+                    resolve_variable(var, arrays, read, ds.variables)
+                else:
+                    raise KeyError(f'{var} is not in {file} and cannot be derived.')
+        return arrays
+
+    def fill_feature_array(self, arrays, var_list, out):
+        '''
+        This function writes the variables in var_list from a dictionary of (lev, ncol) or (ncol,) arrays
+        into the columns of a preallocated (ncol, features) array, following the var_lens layout.
+        '''
+        valid_cols = None if self.valid_cols.all() else self.valid_cols
+        current_idx = 0
+        for var in var_list:
+            var_len = self.var_lens[var]
+            arr = arrays[var]
+            if valid_cols is not None:
+                arr = arr[..., valid_cols]
+            if var_len == 1:
+                out[:, current_idx] = arr
+            else:
+                out[:, current_idx:current_idx + var_len] = arr.T
+            current_idx += var_len
+        return out
+
+    def get_input_array(self, input_file, out = None):
+        '''
+        This function reads in a file with netCDF4 and returns a (num_latlon, input_feature_len) array with the input variables for the emulator.
+        It produces the same (unnormalized) numbers as stacking get_input.
+        '''
+        if out is None:
+            out = np.empty((int(self.valid_cols.sum()), self.input_feature_len))
+        arrays = self.read_ncvars(input_file, self.input_vars)
+        return self.fill_feature_array(arrays, self.input_vars, out)
+
+    def get_target_array(self, input_file, out = None):
+        '''
+        This function reads in a file with netCDF4 and returns a (num_latlon, target_feature_len) array with the target variables for the emulator.
+        Tendencies are computed in place in the output array and match get_target.
+        '''
+        if out is None:
+            out = np.empty((int(self.valid_cols.sum()), self.target_feature_len))
+        state_vars = ['state_t', 'state_q0001']
+        if self.full_vars or self.full_vars_v5:
+            state_vars = state_vars + ['state_q0002', 'state_q0003', 'state_u', 'state_v']
+        arrays_input = self.read_ncvars(input_file, state_vars)
+        output_file = input_file.replace(f'.{self.input_abbrev}.',f'.{self.output_abbrev}.')
+        arrays_target = self.read_ncvars(output_file, state_vars + [var for var in self.target_vars if var not in self.ptend_sources])
+        return self.fill_target_array(arrays_input, arrays_target, self.target_vars, out)
+
+    def fill_target_array(self, arrays_input, arrays_target, target_vars, out):
+        '''
+        This function writes the variables in target_vars into the columns of a preallocated (ncol, features) array,
+        computing the tendencies from dictionaries of input and output file arrays (see read_ncvars).
+        '''
+        valid_cols = None if self.valid_cols.all() else self.valid_cols
+        current_idx = 0
+        for var in target_vars:
+            var_len = self.var_lens[var]
+            if var_len == 1:
+                view = out[:, current_idx]
+            else:
+                view = out[:, current_idx:current_idx + var_len].T
+            current_idx += var_len
+            if var not in self.ptend_sources:
+                arr = arrays_target[var]
+                view[...] = arr if valid_cols is None else arr[..., valid_cols]
+                continue
+            # each timestep is 20 minutes which corresponds to 1200 seconds
+            terms = []
+            for state_var in self.ptend_sources[var]:
+                arr_target = arrays_target[state_var]
+                arr_input = arrays_input[state_var]
+                if valid_cols is not None:
+                    arr_target = arr_target[..., valid_cols]
+                    arr_input = arr_input[..., valid_cols]
+                terms.append((arr_target, arr_input))
+            if all(arr.dtype == view.dtype for term in terms for arr in term):
+                np.subtract(terms[0][0], terms[0][1], out = view)
+                for arr_target, arr_input in terms[1:]:
+                    view += arr_target
+                    view -= arr_input
+                view /= 1200
+            else:
+                tendency = terms[0][0] - terms[0][1]
+                for arr_target, arr_input in terms[1:]:
+                    tendency = tendency + arr_target - arr_input
+                view[...] = tendency/1200
+        return out
+
+    def load_ncfile(self, file):
+        '''
+        This function reads one input file (and its matching output file) and returns the
+        normalized input and target arrays, with shapes (num_latlon, input_feature_len) and
+        (num_latlon, target_feature_len).
+        With nc_reader = 'netcdf4' the files are read with get_input_array and get_target_array instead of xarray.
+        '''
+        if self.nc_reader == 'netcdf4':
+            npy_input = self.get_input_array(file)
+            npy_target = self.get_target_array(file)
+            if self.normalize:
+                input_sub, input_div, out_scale = self.get_norm_arrays()
+                npy_input -= input_sub
+                npy_input /= input_div
+                npy_target *= out_scale
+            return (npy_input, npy_target)
+
+        # read inputs
+        ds_input = self.get_input(file)
+        # read targets
+        ds_target = self.get_target(file)
+        
+        # normalization, scaling
+        if self.normalize:
+            ds_input = (ds_input - self.input_mean)/(self.input_max - self.input_min)
+            ds_target = ds_target*self.output_scale
+        else:
+            ds_input = ds_input.drop(['lat','lon'])
+
+        # stack
+        # ds = ds.stack({'batch':{'sample','ncol'}})
+        ds_input = ds_input.stack({'batch':{'ncol'}})
+        ds_input = ds_input.to_stacked_array('mlvar', sample_dims=['batch'], name=self.input_abbrev)
+        # dso = dso.stack({'batch':{'sample','ncol'}})
+        ds_target = ds_target.stack({'batch':{'ncol'}})
+        ds_target = ds_target.to_stacked_array('mlvar', sample_dims=['batch'], name=self.output_abbrev)
+        return (ds_input.values, ds_target.values)
+
+    def load_ncfile_float32(self, file):
+        '''
+        This function returns the arrays of load_ncfile cast to float32, with inf and nan inputs set to 0 as in
+        save_as_npy when normalize is True (also those beyond the float32 range).
+        It is used by the datasets of load_ncdata_with_generator.
+        '''
+        npy_input, npy_target = self.load_ncfile(file)
+        with np.errstate(over = 'ignore'):
+            npy_input, npy_target = np.float32(npy_input), np.float32(npy_target)
+        if self.normalize:
+            # after the cast, so that inputs beyond the float32 range are also set to 0
+            npy_input[~np.isfinite(npy_input)] = 0
+        return npy_input, npy_target
+
+    def get_subset_specs(self, subsets):
+        '''
+        This function returns (subset, input_vars, target_vars, norm_arrays) for each subset name in subsets
+        (e.g. ['v2', 'v2_rh', 'v4', 'v5'], see the set_to_*_vars functions). The current variable subset is left unchanged.
+        If normalize is set, subsets can be a dict {subset: (input_mean, input_max, input_min, output_scale)} with the
+        normalization datasets of every subset, and norm_arrays are computed from them as in save_norm. A list of several
+        subsets is not allowed then, since different subsets usually need different normalization files.
+        A list of one subset is normalized with the datasets passed to the constructor. norm_arrays is None otherwise.
+        '''
+        if self.normalize and not isinstance(subsets, dict):
+            assert len(subsets) == 1, 'With normalize, pass the normalization datasets of every subset as a dict ' \
+                                      '{subset: (input_mean, input_max, input_min, output_scale)}.'
+        current = (self.input_vars, self.target_vars, self.full_vars, self.full_vars_v5)
+        current_norms = (self.input_mean, self.input_max, self.input_min, self.output_scale)
+        subset_specs = []
+        try:
+            for subset in subsets:
+                assert hasattr(self, f'set_to_{subset}_vars'), f'{subset} is not a known variable subset.'
+                self.full_vars_v5 = False
+                getattr(self, f'set_to_{subset}_vars')()
+                norm_arrays = None
+                if self.normalize and isinstance(subsets, dict):
+                    self.input_mean, self.input_max, self.input_min, self.output_scale = subsets[subset]
+                    norm_arrays = self.save_norm(write = False)
+                    self.input_mean, self.input_max, self.input_min, self.output_scale = current_norms
+                elif self.normalize:
+                    norm_arrays = self.get_norm_arrays()
+                subset_specs.append((subset, list(self.input_vars), list(self.target_vars), norm_arrays))
+        finally:
+            self.input_vars, self.target_vars, self.full_vars, self.full_vars_v5 = current
+            self.input_mean, self.input_max, self.input_min, self.output_scale = current_norms
+            if len(self.input_vars) != 0:
+                self.set_layouts()
+        return subset_specs
+
+    def load_ncfile_subsets(self, file, subset_specs):
+        '''
+        This function reads one input file and its output file once, for the union of the variables of all
+        subsets in subset_specs (see get_subset_specs), and returns {subset: (input, target)} with the same arrays
+        as load_ncfile with nc_reader = 'netcdf4' for each subset.
+        '''
+        input_vars = []
+        target_vars = []
+        for _, subset_input_vars, subset_target_vars, _ in subset_specs:
+            input_vars += [var for var in subset_input_vars if var not in input_vars]
+            target_vars += [var for var in subset_target_vars if var not in target_vars]
+        state_vars = []
+        for var in target_vars:
+            state_vars += [state_var for state_var in self.ptend_sources.get(var, []) if state_var not in state_vars]
+        arrays_input = self.read_ncvars(file, input_vars + [var for var in state_vars if var not in input_vars])
+        output_file = file.replace(f'.{self.input_abbrev}.',f'.{self.output_abbrev}.')
+        arrays_target = self.read_ncvars(output_file, state_vars + [var for var in target_vars if var not in self.ptend_sources])
+
+        num_cols = int(self.valid_cols.sum())
+        arrays = {}
+        for subset, subset_input_vars, subset_target_vars, norm_arrays in subset_specs:
+            npy_input = self.fill_feature_array(arrays_input, subset_input_vars, np.empty((num_cols, sum(self.var_lens[var] for var in subset_input_vars))))
+            npy_target = self.fill_target_array(arrays_input, arrays_target, subset_target_vars, np.empty((num_cols, sum(self.var_lens[var] for var in subset_target_vars))))
+            if norm_arrays is not None:
+                input_sub, input_div, out_scale = norm_arrays
+                npy_input -= input_sub
+                npy_input /= input_div
+                npy_target *= out_scale
+            arrays[subset] = (npy_input, npy_target)
+        return arrays
+
+    def load_ncdata_with_generator(self,
+                                   data_split,
+                                   shuffle = False,
+                                   shuffle_buffer_size = 0,
+                                   prefetch_files = 2,
+                                   seed = 0,
+                                   cache = None,
+                                   unbatch = True,
+                                   drop_last = False):
+        '''
+        This function works as a dataloader when training the emulator with raw netCDF files.
+        This can be used as a dataloader during training or it can be used to create entire datasets.
+        When used as a dataloader for training, I/O can slow down training considerably.
+        This function also normalizes the data and casts it to float32 (see load_ncfile_float32).
+        With ml_backend = "tensorflow", it returns a tf.data.Dataset (see tf_dataset.py) that decodes files in
+        parallel with interleave and yields single rows, or the rows of one file per element if unbatch is False;
+        decoded rows are cached in the file cache (or in memory if cache is '') if cache is not None.
+        With ml_backend = "pytorch", it returns a NetCDFIterableDataset (see torch_dataset.py) that splits the
+        filelist between DataLoader workers and DDP ranks, prefetches up to prefetch_files decoded files per worker
+        and yields float32 tensors. Every rank reads the same number of files, padding the filelist by repeating files
+        or, with drop_last, dropping the last ones.
+        shuffle, shuffle_buffer_size and seed apply to both backends, prefetch_files and drop_last only to pytorch and
+        cache and unbatch only to tensorflow.
+        '''
+        filelist = self.get_filelist(data_split)
+
+        if self.ml_backend == "tensorflow":
+            if self.successful_backend_import:
+                from .tf_dataset import netcdf_dataset
+                return netcdf_dataset(self,
+                                      filelist,
+                                      shuffle = shuffle,
+                                      shuffle_buffer_size = shuffle_buffer_size,
+                                      seed = seed,
+                                      cache = cache,
+                                      unbatch = unbatch)
+
+        elif self.ml_backend == "pytorch":
+            if self.successful_backend_import:
+                from .torch_dataset import NetCDFIterableDataset
+                return NetCDFIterableDataset(self,
+                                             filelist,
+                                             shuffle = shuffle,
+                                             shuffle_buffer_size = shuffle_buffer_size,
+                                             prefetch_files = prefetch_files,
+                                             seed = seed,
+                                             drop_last = drop_last)
+
+    def save_as_npy(self,
+                 data_split, 
+                 save_path = '',
+                 save_latlontime_dict = False,
+                 streaming = False,
+                 num_workers = None,
+                 max_files_in_flight = None):
+        '''
+        This function saves the training data as a .npy file (also with option to save .h5).
+        With streaming = True, files are converted by a pool of num_workers processes and each
+        file's rows are written straight into preallocated float32 outputs (see save_as_npy_streaming).
+        '''
+        import h5py
+        if streaming:
+            return self.save_as_npy_streaming(data_split,
+                                              save_path = save_path,
+                                              save_latlontime_dict = save_latlontime_dict,
+                                              num_workers = num_workers,
+                                              max_files_in_flight = max_files_in_flight)
+        npy_iterator = [self.load_ncfile(file) for file in self.get_filelist(data_split)]
+        npy_input = np.concatenate([npy_iterator[x][0] for x in range(len(npy_iterator))])
+        if self.normalize:
+            # replace inf and nan with 0
+            npy_input[np.isinf(npy_input)] = 0 
+            npy_input[np.isnan(npy_input)] = 0
+
+        save_path = self._prepare_save_path(save_path)
+
+        npy_input = np.float32(npy_input)
+        if self.save_npy:
+            with open(save_path + data_split + '_input.npy', 'wb') as f:
+                np.save(f, npy_input)
+        if self.save_h5:
+            h5_path = save_path + data_split + '_input.h5'
+            with h5py.File(h5_path, 'w') as hdf:
+                hdf.create_dataset('data', data=npy_input, dtype=npy_input.dtype)
+        del npy_input
+        
+        npy_target = np.concatenate([npy_iterator[x][1] for x in range(len(npy_iterator))])
+        npy_target = np.float32(npy_target)
+
+        if self.save_npy:
+            with open(save_path + data_split + '_target.npy', 'wb') as f:
+                np.save(f, npy_target)
+        if self.save_h5:
+            h5_path = save_path + data_split + '_target.h5'
+            with h5py.File(h5_path, 'w') as hdf:
+                hdf.create_dataset('data', data=npy_target, dtype=npy_target.dtype)
+
+        if save_latlontime_dict:
+            self.save_latlontime_dict(data_split, save_path, npy_target.shape[0])
+
+    def save_as_npy_streaming(self,
+                              data_split,
+                              save_path = '',
+                              save_latlontime_dict = False,
+                              num_workers = None,
+                              max_files_in_flight = None):
+        '''
+        This function saves the training data like save_as_npy, but without holding the split in memory.
+        The outputs are preallocated as memory-mapped float32 .npy files (and/or .h5 datasets)
+        and file i of the filelist is written at row offset i*num_latlon.
+        Files are converted by a pool of num_workers processes (num_workers = 0 converts in this process),
+        and at most max_files_in_flight converted files are held in memory at any time.
+        '''
+        import h5py
+        filelist = self.get_filelist(data_split)
+        save_path = self._prepare_save_path(save_path)
+        num_samples = len(filelist)*self.num_latlon
+        input_shape = (num_samples, self.input_feature_len)
+        target_shape = (num_samples, self.target_feature_len)
+
+        writers = []
+        h5_files = []
+        try:
+            if self.save_npy:
+                npy_input = np.lib.format.open_memmap(save_path + data_split + '_input.npy', mode = 'w+', dtype = np.float32, shape = input_shape)
+                npy_target = np.lib.format.open_memmap(save_path + data_split + '_target.npy', mode = 'w+', dtype = np.float32, shape = target_shape)
+                writers.append((npy_input, npy_target))
+            if self.save_h5:
+                h5_input = h5py.File(save_path + data_split + '_input.h5', 'w')
+                h5_files.append(h5_input)
+                h5_target = h5py.File(save_path + data_split + '_target.h5', 'w')
+                h5_files.append(h5_target)
+                writers.append((h5_input.create_dataset('data', shape = input_shape, dtype = np.float32),
+                                h5_target.create_dataset('data', shape = target_shape, dtype = np.float32)))
+
+            def write(file_idx, file_input, file_target):
+                assert file_input.shape == (self.num_latlon, self.input_feature_len), \
+                    f'{filelist[file_idx]} gave input of shape {file_input.shape}.'
+                assert file_target.shape == (self.num_latlon, self.target_feature_len), \
+                    f'{filelist[file_idx]} gave target of shape {file_target.shape}.'
+                offset = file_idx*self.num_latlon
+                for input_writer, target_writer in writers:
+                    input_writer[offset:offset + self.num_latlon] = file_input
+                    target_writer[offset:offset + self.num_latlon] = file_target
+
+            for file_idx, file_input, file_target in self.iter_converted_files(filelist, num_workers, max_files_in_flight):
+                write(file_idx, file_input, file_target)
+        finally:
+            for writer_pair in writers:
+                for writer in writer_pair:
+                    if isinstance(writer, np.memmap):
+                        writer.flush()
+            for h5_file in h5_files:
+                h5_file.close()
+            del writers
+
+        if save_latlontime_dict:
+            self.save_latlontime_dict(data_split, save_path, num_samples)
+
+    def save_subsets_as_npy(self,
+                            data_split,
+                            subsets,
+                            save_path = '',
+                            save_latlontime_dict = False,
+                            num_workers = None,
+                            max_files_in_flight = None):
+        '''
+        This function saves the training data of several variable subsets (e.g. ['v2', 'v2_rh', 'v4', 'v5'])
+        in one pass over the filelist: every file is read once for the union of the variables of all subsets
+        (see load_ncfile_subsets) and the arrays of subset are written to save_path/subset/ as in
+        save_as_npy_streaming. Files are always read with netCDF4.
+        If normalize is set, subsets is a dict with the normalization datasets of every subset (see get_subset_specs).
+        '''
+        import h5py
+        filelist = self.get_filelist(data_split)
+        save_path = self._prepare_save_path(save_path)
+        subset_specs = self.get_subset_specs(subsets)
+        num_samples = len(filelist)*self.num_latlon
+
+        writers = {}
+        h5_files = []
+        try:
+            for subset, subset_input_vars, subset_target_vars, _ in subset_specs:
+                subset_path = self._prepare_save_path(save_path + subset)
+                input_shape = (num_samples, sum(self.var_lens[var] for var in subset_input_vars))
+                target_shape = (num_samples, sum(self.var_lens[var] for var in subset_target_vars))
+                writers[subset] = []
+                if self.save_npy:
+                    writers[subset].append((np.lib.format.open_memmap(subset_path + data_split + '_input.npy', mode = 'w+', dtype = np.float32, shape = input_shape),
+                                            np.lib.format.open_memmap(subset_path + data_split + '_target.npy', mode = 'w+', dtype = np.float32, shape = target_shape)))
+                if self.save_h5:
+                    h5_input = h5py.File(subset_path + data_split + '_input.h5', 'w')
+                    h5_files.append(h5_input)
+                    h5_target = h5py.File(subset_path + data_split + '_target.h5', 'w')
+                    h5_files.append(h5_target)
+                    writers[subset].append((h5_input.create_dataset('data', shape = input_shape, dtype = np.float32),
+                                            h5_target.create_dataset('data', shape = target_shape, dtype = np.float32)))
+
+            for file_idx, arrays in self.iter_converted_files(filelist, num_workers, max_files_in_flight,
+                                                              convert = _convert_ncfile_subsets, convert_args = (subset_specs,)):
+                offset = file_idx*self.num_latlon
+                for subset, (file_input, file_target) in arrays.items():
+                    assert file_input.shape[0] == self.num_latlon, f'{filelist[file_idx]} gave input of shape {file_input.shape}.'
+                    for input_writer, target_writer in writers[subset]:
+                        input_writer[offset:offset + self.num_latlon] = file_input
+                        target_writer[offset:offset + self.num_latlon] = file_target
+        finally:
+            for subset_writers in writers.values():
+                for writer_pair in subset_writers:
+                    for writer in writer_pair:
+                        if isinstance(writer, np.memmap):
+                            writer.flush()
+            for h5_file in h5_files:
+                h5_file.close()
+            del writers
+
+        if save_latlontime_dict:
+            for subset in subsets:
+                self.save_latlontime_dict(data_split, save_path + subset + '/', num_samples)
+
+    def compute_norm_stats(self, data_split, num_workers = None, max_files_in_flight = None):
+        '''
+        This function computes the statistics of the unnormalized inputs and targets of the current variables
+        over the files of a data split, file by file in a pool of num_workers processes (see iter_converted_files),
+        and returns them as NormalizationStats, whose write method saves the input_*, output_scale and
+        exponential lambda files that the constructor and save_norm consume. Memory does not grow with the split.
+        '''
+        filelist = self.get_filelist(data_split)
+        stats = NormalizationStats(self.input_layout, self.target_layout, self.num_levels)
+        for _, file_stats in self.iter_converted_files(filelist, num_workers, max_files_in_flight, convert = _ncfile_norm_stats):
+            stats.merge(file_stats)
+        return stats
+
+    def iter_converted_files(self, filelist, num_workers = None, max_files_in_flight = None,
+                             convert = _convert_ncfile, convert_args = ()):
+        '''
+        This function converts the files of filelist into float32 (input, target) rows and yields
+        (file_idx, input, target) in order of completion.
+        Files are converted by a pool of num_workers processes (num_workers = 0 converts in this process),
+        and at most max_files_in_flight converted files are held in memory at any time.
+        convert(data, file_idx, file, *convert_args) is the module-level function that converts one file.
+        '''
+        if num_workers is None:
+            num_workers = os.cpu_count() or 1
+        if max_files_in_flight is None:
+            max_files_in_flight = 2*max(num_workers, 1)
+        assert max_files_in_flight >= 1, 'max_files_in_flight must be at least 1.'
+        if num_workers == 0:
+            for file_idx, file in enumerate(tqdm(filelist)):
+                yield convert(self, file_idx, file, *convert_args)
+            return
+        with concurrent.futures.ProcessPoolExecutor(max_workers = num_workers,
+                                                    initializer = _init_convert_worker,
+                                                    initargs = (self,)) as executor:
+            pending = set()
+            file_iter = iter(enumerate(filelist))
+            with tqdm(total = len(filelist)) as pbar:
+                while True:
+                    for file_idx, file in file_iter:
+                        pending.add(executor.submit(convert, None, file_idx, file, *convert_args))
+                        if len(pending) >= max_files_in_flight:
+                            break
+                    if not pending:
+                        break
+                    done, pending = concurrent.futures.wait(pending, return_when = concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+                        pbar.update(1)
+
+    def save_as_shards(self,
+                       data_split,
+                       save_path = '',
+                       shard_size = 2**16,
+                       chunk_rows = None,
+                       compression = None,
+                       compression_opts = None,
+                       num_workers = None,
+                       max_files_in_flight = None):
+        '''
+        This function saves the training data as fixed-size HDF5 shards for shuffled training.
+        Shard k is saved as {data_split}_shard_{k:05d}.h5 and holds rows k*shard_size to (k+1)*shard_size
+        (in filelist order) in the datasets "input" and "target", chunked along rows in blocks of chunk_rows
+        (default num_latlon) and optionally compressed (compression = "gzip" or "lzf").
+        A manifest, {data_split}_manifest.json, lists the shards and their row counts together with the
+        variable subset, so that readers do not need to open every shard.
+        Files are converted as in save_as_npy_streaming and every shard is closed as soon as it is complete.
+        '''
+        import h5py
+        filelist = self.get_filelist(data_split)
+        if chunk_rows is None:
+            chunk_rows = self.num_latlon
+        chunk_rows = min(chunk_rows, shard_size)
+        save_path = self._prepare_save_path(save_path)
+        num_samples = len(filelist)*self.num_latlon
+        num_shards = -(-num_samples//shard_size)
+        shard_rows = [min(shard_size, num_samples - k*shard_size) for k in range(num_shards)]
+        shard_files = [f'{data_split}_shard_{k:05d}.h5' for k in range(num_shards)]
+
+        open_shards = {}
+        rows_written = [0]*num_shards
+        def get_shard(k):
+            if k not in open_shards:
+                shard = h5py.File(save_path + shard_files[k], 'w')
+                for name, feature_len in [('input', self.input_feature_len), ('target', self.target_feature_len)]:
+                    shard.create_dataset(name,
+                                         shape = (shard_rows[k], feature_len),
+                                         dtype = np.float32,
+                                         chunks = (min(chunk_rows, shard_rows[k]), feature_len),
+                                         compression = compression,
+                                         compression_opts = compression_opts)
+                open_shards[k] = shard
+            return open_shards[k]
+
+        try:
+            for file_idx, file_input, file_target in self.iter_converted_files(filelist, num_workers, max_files_in_flight):
+                assert file_input.shape == (self.num_latlon, self.input_feature_len), \
+                    f'{filelist[file_idx]} gave input of shape {file_input.shape}.'
+                assert file_target.shape == (self.num_latlon, self.target_feature_len), \
+                    f'{filelist[file_idx]} gave target of shape {file_target.shape}.'
+                # the rows of a file can straddle two shards
+                start = file_idx*self.num_latlon
+                stop = start + self.num_latlon
+                while start < stop:
+                    k = start//shard_size
+                    shard_stop = min(stop, (k + 1)*shard_size)
+                    shard = get_shard(k)
+                    rows = slice(start - k*shard_size, shard_stop - k*shard_size)
+                    file_rows = slice(start - file_idx*self.num_latlon, shard_stop - file_idx*self.num_latlon)
+                    shard['input'][rows] = file_input[file_rows]
+                    shard['target'][rows] = file_target[file_rows]
+                    rows_written[k] += shard_stop - start
+                    if rows_written[k] == shard_rows[k]:
+                        open_shards.pop(k).close()
+                    start = shard_stop
+        finally:
+            for shard in open_shards.values():
+                shard.close()
+
+        manifest = {'data_split': data_split,
+                    'num_samples': num_samples,
+                    'shard_size': shard_size,
+                    'chunk_rows': chunk_rows,
+                    'compression': compression,
+                    'num_latlon': self.num_latlon,
+                    'normalize': self.normalize,
+                    'input_vars': list(self.input_vars),
+                    'target_vars': list(self.target_vars),
+                    'input_feature_len': self.input_feature_len,
+                    'target_feature_len': self.target_feature_len,
+                    'shards': [{'file': shard_file, 'num_rows': num_rows} for shard_file, num_rows in zip(shard_files, shard_rows)]}
+        with open(save_path + data_split + '_manifest.json', 'w') as f:
+            json.dump(manifest, f, indent = 1)
+        return manifest
+
+    @staticmethod
+    def _prepare_save_path(save_path):
+        '''
+        This function creates save_path if it does not exist and makes sure it ends with "/".
+        '''
+        # if save_path not exist, create it
+        if not os.path.exists(save_path):
+            os.makedirs(save_path)
+        # add "/" to the end of save_path if it does not exist
+        if save_path[-1] != '/':
+            save_path = save_path + '/'
+        return save_path
+
+    def get_sample_index(self, data_split, num_samples = None):
+        '''
+        This function returns the SampleIndex mapping every sample saved by save_as_npy for a data split
+        to its file, date, column, lat and lon.
+        '''
+        return SampleIndex.from_filelist(self.get_filelist(data_split),
+                                         self.grid_info['lat'].values,
+                                         self.grid_info['lon'].values,
+                                         columns = np.flatnonzero(self.valid_cols),
+                                         input_abbrev = self.input_abbrev,
+                                         num_samples = num_samples)
+
+    def save_latlontime_dict(self, data_split, save_path, num_samples):
+        '''
+        This function saves the index mapping each sample to its (lat, lon) and date as <data_split>_sample_index.npz.
+        Load it with SampleIndex.load, or convert it to the former indextolatlontime dictionary with SampleIndex.to_dict.
+        '''
+        self.get_sample_index(data_split, num_samples).save(save_path + data_split + '_sample_index.npz')
+
+    @staticmethod
+    def ls(dir_path = ''):
+        '''
+        You can treat this as a Python wrapper for the bash command "ls".
+        '''
+        return os.popen(' '.join(['ls', dir_path])).read().splitlines()
+
+    @staticmethod
+    def load_npy_file(load_path = '', mmap_mode = None):
+        '''
+        This function loads the prediction .npy file.
+        With mmap_mode = 'r' the array is memory-mapped read-only instead of read into memory,
+        so that processes loading the same file share it through the page cache.
+        '''
+        if mmap_mode is not None:
+            return np.load(load_path, mmap_mode = mmap_mode)
+        with open(load_path, 'rb') as f:
+            pred = np.load(f)
+        return pred
+
+    @staticmethod
+    def load_h5_file(load_path = ''):
+        '''
+        This function loads the prediction .h5 file.
+        '''
+        import h5py
+        hf = h5py.File(load_path, 'r')
+        pred = np.array(hf.get('pred'))
+        return pred
@@ -0,0 +1,170 @@
+'''
+Compiled normalization bundle of a variable subset: everything the training scripts, the datasets, loss_energy
+and the inference wrappers use from the grid file, the four normalization files and the qn lambdas, in one
+uncompressed, versioned .npz file. Compile it once (data_utils.save_norm_bundle or python -m climsim_utils.norm_bundle)
+and load it with NormBundle.load, which memory-maps the arrays instead of building a data_utils object in every process.
+'''
+
+import argparse
+import os
+import zipfile
+import numpy as np
+
+from .feature_layout import FeatureLayout
+
+# version of the bundle layout, increased whenever arrays are added, removed or change meaning
+NORM_BUNDLE_VERSION = 1
+
+def _mmap_npz(path):
+    '''
+    Returns the arrays of an uncompressed .npz file (as written by np.savez) as copy-on-write memory maps:
+    reads share the pages of the file, and writes (e.g. by consumers that normalize in place) stay private.
+    '''
+    arrays = {}
+    with zipfile.ZipFile(path) as archive, open(path, 'rb') as f:
+        for info in archive.infolist():
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise ValueError(f'{info.filename} in {path} is compressed and cannot be memory-mapped.')
+            # the .npy data follows the 30 byte local file header, the file name and the extra field
+            f.seek(info.header_offset + 26)
+            name_len, extra_len = np.frombuffer(f.read(4), dtype = '<u2')
+            f.seek(info.header_offset + 30 + int(name_len) + int(extra_len))
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+            assert not dtype.hasobject, f'{info.filename} in {path} holds python objects.'
+            name = info.filename[:-len('.npy')]
+            if int(np.prod(shape)) == 0:
+                arrays[name] = np.empty(shape, dtype = dtype)
+            else:
+                arrays[name] = np.memmap(path, dtype = dtype, mode = 'c', offset = f.tell(), shape = shape,
+                                         order = 'F' if fortran_order else 'C')
+    return arrays
+
+class NormBundle:
+    '''
+    Normalization of a variable subset, x -> (x - input_sub)/input_div for the inputs and y -> y*out_scale for the
+    targets (as data_utils.save_norm), with the qn lambdas of the exponential cloud transform (None if not given),
+    the hybrid coefficients hyai/hybi, the column area weights area_wgt and the input/target FeatureLayouts.
+    '''
+    def __init__(self, input_sub, input_div, out_scale, input_layout, target_layout, hyai, hybi, area_wgt,
+                 qn_lbd = None, variable_subset = ''):
+        self.input_sub = input_sub
+        self.input_div = input_div
+        self.out_scale = out_scale
+        self.input_layout = input_layout
+        self.target_layout = target_layout
+        self.hyai = hyai
+        self.hybi = hybi
+        self.area_wgt = area_wgt
+        self.qn_lbd = qn_lbd
+        self.variable_subset = variable_subset
+        assert len(input_sub) == len(input_div) == input_layout.feature_len
+        assert len(out_scale) == target_layout.feature_len
+
+    @property
+    def ps_index(self):
+        '''
+        Column of state_ps in the inputs, or None.
+        '''
+        return self.input_layout.index('state_ps') if 'state_ps' in self.input_layout else None
+
+    @classmethod
+    def from_data_utils(cls, data, qn_lbd = None, variable_subset = ''):
+        '''
+        Compiles the bundle of the variables currently set in a data_utils object.
+        '''
+        input_sub, input_div, out_scale = data.save_norm(write = False)
+        return cls(input_sub = input_sub,
+                   input_div = input_div,
+                   out_scale = out_scale,
+                   input_layout = data.input_layout,
+                   target_layout = data.target_layout,
+                   hyai = data.grid_info['hyai'].values,
+                   hybi = data.grid_info['hybi'].values,
+                   area_wgt = data.area_wgt,
+                   qn_lbd = None if qn_lbd is None else np.asarray(qn_lbd, dtype = np.float64).reshape(-1),
+                   variable_subset = variable_subset)
+
+    def save(self, path):
+        '''
+        Writes the bundle as an uncompressed .npz file at path, which is used as is (np.savez would append .npz).
+        '''
+        with open(path, 'wb') as f:
+            np.savez(f,
+                     version = np.array(NORM_BUNDLE_VERSION),
+                     variable_subset = np.array(self.variable_subset),
+                     input_sub = np.asarray(self.input_sub, dtype = np.float64),
+                     input_div = np.asarray(self.input_div, dtype = np.float64),
+                     out_scale = np.asarray(self.out_scale, dtype = np.float64),
+                     qn_lbd = np.zeros(0) if self.qn_lbd is None else np.asarray(self.qn_lbd, dtype = np.float64),
+                     hyai = np.asarray(self.hyai, dtype = np.float64),
+                     hybi = np.asarray(self.hybi, dtype = np.float64),
+                     area_wgt = np.asarray(self.area_wgt, dtype = np.float64),
+                     input_vars = np.array(self.input_layout.var_list),
+                     input_var_lens = np.array([self.input_layout.var_lens[var] for var in self.input_layout.var_list]),
+                     target_vars = np.array(self.target_layout.var_list),
+                     target_var_lens = np.array([self.target_layout.var_lens[var] for var in self.target_layout.var_list]))
+
+    @classmethod
+    def load(cls, path, mmap = True):
+        '''
+        Reads a bundle written by save. With mmap, the arrays are copy-on-write memory maps of the file.
+        '''
+        arrays = _mmap_npz(path) if mmap else dict(np.load(path))
+        if int(arrays['version']) != NORM_BUNDLE_VERSION:
+            raise ValueError(f'{path} is a version {int(arrays["version"])} normalization bundle, expected version {NORM_BUNDLE_VERSION}.')
+        layouts = []
+        for name in ['input', 'target']:
+            var_list = arrays[f'{name}_vars'].tolist()
+            layouts.append(FeatureLayout(var_list, dict(zip(var_list, arrays[f'{name}_var_lens'].tolist()))))
+        return cls(input_sub = arrays['input_sub'],
+                   input_div = arrays['input_div'],
+                   out_scale = arrays['out_scale'],
+                   input_layout = layouts[0],
+                   target_layout = layouts[1],
+                   hyai = arrays['hyai'],
+                   hybi = arrays['hybi'],
+                   area_wgt = arrays['area_wgt'],
+                   qn_lbd = arrays['qn_lbd'] if arrays['qn_lbd'].size > 0 else None,
+                   variable_subset = str(arrays['variable_subset']))
+
+    def save_norm(self, save_path):
+        '''
+        Writes inp_sub.txt, inp_div.txt and out_scale.txt under save_path, as data_utils.save_norm(save_path, write = True).
+        '''
+        fmt = '%.6e'
+        np.savetxt(save_path + '/inp_sub.txt', np.asarray(self.input_sub).reshape(1, -1), fmt = fmt, delimiter = ',')
+        np.savetxt(save_path + '/inp_div.txt', np.asarray(self.input_div).reshape(1, -1), fmt = fmt, delimiter = ',')
+        np.savetxt(save_path + '/out_scale.txt', np.asarray(self.out_scale).reshape(1, -1), fmt = fmt, delimiter = ',')
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Compile the normalization bundle of a variable subset.')
+    parser.add_argument('--climsim-path', required = True, help = 'Root of the ClimSim repository.')
+    parser.add_argument('--variable-subset', default = 'v5', help = 'Variable subset, e.g. v2 or v5 (data_utils.set_to_<subset>_vars).')
+    parser.add_argument('--input-mean', default = 'inputs/input_mean_v5_pervar.nc')
+    parser.add_argument('--input-max', default = 'inputs/input_max_v5_pervar.nc')
+    parser.add_argument('--input-min', default = 'inputs/input_min_v5_pervar.nc')
+    parser.add_argument('--output-scale', default = 'outputs/output_scale_std_lowerthred_v5.nc')
+    parser.add_argument('--qn-lbd', default = 'inputs/qn_exp_lambda_large.txt', help = 'qn lambdas, or an empty string for none.')
+    parser.add_argument('--output', required = True, help = 'Path of the .npz bundle.')
+    args = parser.parse_args()
+
+    import xarray as xr
+    from .data_utils import data_utils
+    norm_path = os.path.join(args.climsim_path, 'preprocessing', 'normalizations')
+    data = data_utils(grid_info = xr.open_dataset(os.path.join(args.climsim_path, 'grid_info', 'ClimSim_low-res_grid-info.nc')),
+                      input_mean = xr.open_dataset(os.path.join(norm_path, args.input_mean)),
+                      input_max = xr.open_dataset(os.path.join(norm_path, args.input_max)),
+                      input_min = xr.open_dataset(os.path.join(norm_path, args.input_min)),
+                      output_scale = xr.open_dataset(os.path.join(norm_path, args.output_scale)),
+                      ml_backend = None)
+    getattr(data, f'set_to_{args.variable_subset}_vars')()
+    data.save_norm_bundle(args.output,
+                          qn_lbd = np.loadtxt(os.path.join(norm_path, args.qn_lbd), delimiter = ',') if args.qn_lbd else None,
+                          variable_subset = args.variable_subset)
+
+if __name__ == '__main__':
+    main()
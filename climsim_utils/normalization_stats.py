@@ -0,0 +1,217 @@
+'''
+Streaming statistics of the inputs and targets of a data split, and the rules that turn them into the
+normalization files under preprocessing/normalizations (input_mean/max/min/std, output_scale and the
+qc/qi/qn exponential lambdas), which used to be computed in the notebooks of
+online_testing/data_preparation/normalization from the whole split held in memory.
+'''
+
+import os
+import numpy as np
+import xarray as xr
+
+# lower thresholds of the std of the tendencies, before taking 1/std as the output scale (output_scaling.ipynb)
+OUTPUT_STD_THRESHOLDS = {
+    'lowerthred_v5': {'ptend_q0001': 3e-10, 'ptend_q0002': 3e-10, 'ptend_q0003': 3e-10, 'ptend_qn': 3e-10,
+                      'ptend_u': 1e-6, 'ptend_v': 1e-6},
+    'nopenalty': {'ptend_q0001': 1e-12, 'ptend_q0002': 1e-12, 'ptend_q0003': 1e-12, 'ptend_qn': 1e-12,
+                  'ptend_u': 2e-7, 'ptend_v': 2e-7},
+}
+
+# inputs with a fixed (mean, max, min) instead of their statistics (input_scaling.ipynb)
+FIXED_INPUT_SCALING = {var: (0.0, 1.0, 0.0) for var in ['state_q0002', 'state_q0003', 'state_rh', 'state_qn', 'liq_partition',
+                                                         'cam_in_ICEFRAC', 'cam_in_LANDFRAC', 'cam_in_OCNFRAC',
+                                                         'clat', 'slat', 'icol']}
+
+# inputs scaled by their range with a zero mean
+ZERO_MEAN_INPUTS = ['state_t_dyn', 'state_q0_dyn', 'state_u_dyn', 'tm_state_t_dyn', 'tm_state_q0_dyn', 'tm_state_u_dyn',
+                    'pbuf_SOLIN', 'pbuf_LHFLX', 'pbuf_SHFLX', 'tm_pbuf_SOLIN', 'tm_pbuf_LHFLX', 'tm_pbuf_SHFLX']
+
+# tendencies of the previous physics step, scaled to mean 0, min 0 and max the std of the tendency with the
+# 'nopenalty' thresholds (input_scaling.ipynb uses output_scale_std_nopenalty.nc)
+PRVPHY_INPUT_TENDENCIES = {'state_t_prvphy': 'ptend_t',
+                           'state_q0001_prvphy': 'ptend_q0001',
+                           'state_q0002_prvphy': 'ptend_q0002',
+                           'state_q0003_prvphy': 'ptend_q0003',
+                           'state_qn_prvphy': 'ptend_qn',
+                           'state_u_prvphy': 'ptend_u',
+                           'tm_state_t_prvphy': 'ptend_t',
+                           'tm_state_q0001_prvphy': 'ptend_q0001',
+                           'tm_state_q0002_prvphy': 'ptend_q0002',
+                           'tm_state_q0003_prvphy': 'ptend_q0003',
+                           'tm_state_qn_prvphy': 'ptend_qn',
+                           'tm_state_u_prvphy': 'ptend_u'}
+
+# cloud inputs transformed with 1 - exp(-lambda*q), with lambda = 1/mean of the values above a threshold
+# (cloud_exponential_transformation.ipynb)
+EXP_LAMBDA_INPUTS = {'qc': 'state_q0002', 'qi': 'state_q0003', 'qn': 'state_qn'}
+
+
+class RunningStats:
+    '''
+    Count, mean, sum of squared deviations, min and max of every feature, updated with chunks of rows and
+    merged with Chan et al.'s parallel update, so the statistics of a split can be accumulated per file
+    by several workers and combined.
+    '''
+    def __init__(self, num_features):
+        self.count = 0
+        self.mean = np.zeros(num_features)
+        self.m2 = np.zeros(num_features)
+        self.min = np.full(num_features, np.inf)
+        self.max = np.full(num_features, -np.inf)
+
+    def update(self, x):
+        '''
+        Adds the rows of a (num_rows, num_features) array.
+        '''
+        x = np.asarray(x, dtype = np.float64)
+        if x.shape[0] == 0:
+            return self
+        chunk = RunningStats(x.shape[1])
+        chunk.count = x.shape[0]
+        chunk.mean = x.mean(axis = 0)
+        chunk.m2 = ((x - chunk.mean)**2).sum(axis = 0)
+        chunk.min = x.min(axis = 0)
+        chunk.max = x.max(axis = 0)
+        return self.merge(chunk)
+
+    def merge(self, other):
+        '''
+        Adds the statistics of another set of rows.
+        '''
+        if other.count == 0:
+            return self
+        total = self.count + other.count
+        delta = other.mean - self.mean
+        self.m2 = self.m2 + other.m2 + delta**2*(self.count*other.count/total)
+        self.mean = self.mean + delta*(other.count/total)
+        self.min = np.minimum(self.min, other.min)
+        self.max = np.maximum(self.max, other.max)
+        self.count = total
+        return self
+
+    @property
+    def std(self):
+        return np.sqrt(self.m2/self.count)
+
+
+class NormalizationStats:
+    '''
+    Statistics of the unnormalized inputs and targets of a data split (see data_utils.compute_norm_stats):
+    RunningStats of every input and target feature, of ptend_qn if the targets only have ptend_q0002 and
+    ptend_q0003, and the sums and counts of the cloud inputs above lambda_threshold for the exponential lambdas.
+    '''
+    def __init__(self, input_layout, target_layout, num_levels, lambda_threshold = 1e-7):
+        self.input_layout = input_layout
+        self.target_layout = target_layout
+        self.num_levels = num_levels
+        self.lambda_threshold = lambda_threshold
+        self.input = RunningStats(input_layout.feature_len)
+        self.target = RunningStats(target_layout.feature_len)
+        self.derive_qn = 'ptend_qn' not in target_layout and 'ptend_q0002' in target_layout and 'ptend_q0003' in target_layout
+        self.qn = RunningStats(num_levels)
+        self.lambda_sum = {name: np.zeros(num_levels) for name in EXP_LAMBDA_INPUTS}
+        self.lambda_count = {name: np.zeros(num_levels, dtype = np.int64) for name in EXP_LAMBDA_INPUTS}
+
+    def update(self, npy_input, npy_target, cloud = None):
+        '''
+        Adds the (num_rows, input_feature_len) inputs and (num_rows, target_feature_len) targets of one chunk
+        (e.g. one file), and the (num_rows, num_levels) cloud inputs of EXP_LAMBDA_INPUTS in the dictionary cloud.
+        '''
+        self.input.update(npy_input)
+        self.target.update(npy_target)
+        if self.derive_qn:
+            self.qn.update(npy_target[:, self.target_layout.slice('ptend_q0002')] + npy_target[:, self.target_layout.slice('ptend_q0003')])
+        for name, var in EXP_LAMBDA_INPUTS.items():
+            if cloud is not None and var in cloud:
+                above = cloud[var] > self.lambda_threshold
+                self.lambda_sum[name] += np.where(above, cloud[var], 0).sum(axis = 0)
+                self.lambda_count[name] += above.sum(axis = 0)
+        return self
+
+    def merge(self, other):
+        self.input.merge(other.input)
+        self.target.merge(other.target)
+        self.qn.merge(other.qn)
+        for name in EXP_LAMBDA_INPUTS:
+            self.lambda_sum[name] += other.lambda_sum[name]
+            self.lambda_count[name] += other.lambda_count[name]
+        return self
+
+    def _to_dataset(self, layout, values, coords = None):
+        return xr.Dataset({var: (('lev',) if var in layout.profile_vars else (), values[layout.slice(var)] if var in layout.profile_vars else values[layout.offsets[var]])
+                           for var in layout.var_list}, coords = coords)
+
+    def target_std(self):
+        '''
+        Returns the std of every target variable, with ptend_qn added if it is derived.
+        '''
+        std = self.target.std
+        target_std = {var: std[self.target_layout.slice(var)] if var in self.target_layout.profile_vars else std[self.target_layout.offsets[var]]
+                      for var in self.target_layout.var_list}
+        if self.derive_qn:
+            target_std['ptend_qn'] = self.qn.std
+        return target_std
+
+    def output_scale(self, thresholds = 'lowerthred_v5'):
+        '''
+        Returns the output_scale dataset, 1/std of every target variable, with the std of the variables in
+        OUTPUT_STD_THRESHOLDS[thresholds] raised to the threshold.
+        '''
+        lower = OUTPUT_STD_THRESHOLDS[thresholds]
+        output_scale = xr.Dataset(coords = {'lev': np.arange(self.num_levels)})
+        for var, std in self.target_std().items():
+            if var in lower:
+                std = np.where(std < lower[var], lower[var], std)
+            output_scale[var] = (('lev',) if np.ndim(std) == 1 else (), 1./std)
+        return output_scale
+
+    def input_scaling(self, output_scale = None):
+        '''
+        Returns the input_mean, input_max, input_min and input_std datasets, with the rules of FIXED_INPUT_SCALING,
+        ZERO_MEAN_INPUTS and, if output_scale is given, PRVPHY_INPUT_TENDENCIES applied.
+        '''
+        datasets = [self._to_dataset(self.input_layout, values) for values in
+                    (self.input.mean, self.input.max, self.input.min, self.input.std)]
+        input_mean, input_max, input_min, input_std = datasets
+        for var in self.input_layout.var_list:
+            if var in FIXED_INPUT_SCALING:
+                mean, max_value, min_value = FIXED_INPUT_SCALING[var]
+                input_mean[var][...] = mean
+                input_max[var][...] = max_value
+                input_min[var][...] = min_value
+            elif var in ZERO_MEAN_INPUTS:
+                input_mean[var][...] = 0.0
+            elif var in PRVPHY_INPUT_TENDENCIES and output_scale is not None and PRVPHY_INPUT_TENDENCIES[var] in output_scale:
+                input_mean[var][...] = 0.0
+                input_max[var][...] = 1./output_scale[PRVPHY_INPUT_TENDENCIES[var]].values
+                input_min[var][...] = 0.0
+        return input_mean, input_max, input_min, input_std
+
+    def exp_lambdas(self, fill = 1e7):
+        '''
+        Returns lambda = 1/mean of the cloud inputs above lambda_threshold for every level of qc, qi and qn,
+        or fill for the levels without such values.
+        '''
+        lambdas = {}
+        for name in EXP_LAMBDA_INPUTS:
+            with np.errstate(divide = 'ignore', invalid = 'ignore'):
+                lambdas[name] = self.lambda_count[name]/self.lambda_sum[name]
+            lambdas[name][self.lambda_count[name] == 0] = fill
+        return lambdas
+
+    def write(self, save_path, input_suffix = '', output_suffix = '', thresholds = 'lowerthred_v5'):
+        '''
+        Writes inputs/input_{mean,max,min,std}<input_suffix>.nc, outputs/output_scale<output_suffix>.nc and
+        inputs/{qc,qi,qn}_exp_lambda_large.txt under save_path, in the layout of preprocessing/normalizations,
+        e.g. with input_suffix = '_v5_pervar' and output_suffix = '_std_lowerthred_v5'.
+        thresholds only applies to the output_scale file; the prvphy inputs are always scaled with the 'nopenalty' std.
+        '''
+        os.makedirs(os.path.join(save_path, 'inputs'), exist_ok = True)
+        os.makedirs(os.path.join(save_path, 'outputs'), exist_ok = True)
+        output_scale = self.output_scale(thresholds)
+        output_scale.to_netcdf(os.path.join(save_path, 'outputs', f'output_scale{output_suffix}.nc'))
+        for name, ds in zip(['mean', 'max', 'min', 'std'], self.input_scaling(self.output_scale('nopenalty'))):
+            ds.to_netcdf(os.path.join(save_path, 'inputs', f'input_{name}{input_suffix}.nc'))
+        fmt = '%.6e'
+        for name, lambdas in self.exp_lambdas().items():
+            np.savetxt(os.path.join(save_path, 'inputs', f'{name}_exp_lambda_large.txt'), lambdas.reshape(1, -1), fmt = fmt, delimiter = ',')
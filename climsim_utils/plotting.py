@@ -0,0 +1,90 @@
+'''
+matplotlib figures of data_utils. This module is only imported by the plotting methods of data_utils,
+so that importing data_utils does not import matplotlib.
+'''
+
+import numpy as np
+import matplotlib.pyplot as plt
+
+def set_plot_params():
+    '''
+    This function sets the plot parameters for matplotlib.
+    '''
+    plt.close('all')
+    plt.rcParams.update(plt.rcParamsDefault)
+    plt.rc('font', family='sans')
+    plt.rcParams.update({'font.size': 32,
+                        'lines.linewidth': 2,
+                        'axes.labelsize': 32,
+                        'axes.titlesize': 32,
+                        'xtick.labelsize': 32,
+                        'ytick.labelsize': 32,
+                        'legend.fontsize': 32,
+                        'axes.linewidth': 2,
+                        "pgf.texsystem": "pdflatex"
+                        })
+    # %config InlineBackend.figure_format = 'retina'
+    # use the above line when working in a jupyter notebook
+
+def plot_r2_analysis(lats, sort_lat_key, model_names, test_daily_long, preds_daily_long, pressure_grid_plotting, save_path = ''):
+    '''
+    This function plots the R2 pressure latitude figure shown in the SI.
+    test_daily_long is the (ptend_t, ptend_q0001) pair of data_utils.reshape_daily of the target,
+    and preds_daily_long maps every model name to the pair of its predictions.
+    '''
+    set_plot_params()
+    n_model = len(model_names)
+    fig, ax = plt.subplots(2,n_model, figsize=(n_model*12,18))
+    y = np.array(range(60))
+    X, Y = np.meshgrid(np.sin(lats*np.pi/180), y)
+    Y = pressure_grid_plotting/100
+    test_heat_daily_long, test_moist_daily_long = test_daily_long
+    for i, model_name in enumerate(model_names):
+        pred_heat_daily_long, pred_moist_daily_long = preds_daily_long[model_name]
+        coeff = 1 - np.sum( (pred_heat_daily_long-test_heat_daily_long)**2, axis=1)/np.sum( (test_heat_daily_long-np.mean(test_heat_daily_long, axis=1)[:,None,:])**2, axis=1)
+        coeff = coeff[sort_lat_key,:]
+        coeff = coeff.T
+
+        contour_plot = ax[0,i].pcolor(X, Y, coeff,cmap='Blues', vmin = 0, vmax = 1) # pcolormesh
+        ax[0,i].contour(X, Y, coeff, [0.7], colors='orange', linewidths=[4])
+        ax[0,i].contour(X, Y, coeff, [0.9], colors='yellow', linewidths=[4])
+        ax[0,i].set_ylim(ax[0,i].get_ylim()[::-1])
+        ax[0,i].set_title(model_names[i] + " - ptend_t")
+        ax[0,i].set_xticks([])
+
+        coeff = 1 - np.sum( (pred_moist_daily_long-test_moist_daily_long)**2, axis=1)/np.sum( (test_moist_daily_long-np.mean(test_moist_daily_long, axis=1)[:,None,:])**2, axis=1)
+        coeff = coeff[sort_lat_key,:]
+        coeff = coeff.T
+
+        contour_plot = ax[1,i].pcolor(X, Y, coeff,cmap='Blues', vmin = 0, vmax = 1) # pcolormesh
+        ax[1,i].contour(X, Y, coeff, [0.7], colors='orange', linewidths=[4])
+        ax[1,i].contour(X, Y, coeff, [0.9], colors='yellow', linewidths=[4])
+        ax[1,i].set_ylim(ax[1,i].get_ylim()[::-1])
+        ax[1,i].set_title(model_names[i] + " - ptend_q0001")
+        ax[1,i].xaxis.set_ticks([np.sin(-50/180*np.pi), 0, np.sin(50/180*np.pi)])
+        ax[1,i].xaxis.set_ticklabels([r'50$^\circ$S', r'0$^\circ$', r'50$^\circ$N'])
+        ax[1,i].xaxis.set_tick_params(width = 2)
+
+        if i != 0:
+            ax[0,i].set_yticks([])
+            ax[1,i].set_yticks([])
+
+    # lines below for x and y label axes are valid if 3 models are considered
+    # we want to put only one label for each axis
+    # if nbr of models is different from 3 please adjust label location to center it
+
+    #ax[1,1].xaxis.set_label_coords(-0.10,-0.10)
+
+    ax[0,0].set_ylabel("Pressure [hPa]")
+    ax[0,0].yaxis.set_label_coords(-0.2,-0.09) # (-1.38,-0.09)
+    ax[0,0].yaxis.set_ticks([1000,800,600,400,200,0])
+    ax[1,0].yaxis.set_ticks([1000,800,600,400,200,0])
+
+    fig.subplots_adjust(right=0.8)
+    cbar_ax = fig.add_axes([0.82, 0.12, 0.02, 0.76])
+    cb = fig.colorbar(contour_plot, cax=cbar_ax)
+    cb.set_label("Skill Score "+r'$\left(\mathrm{R^{2}}\right)$',labelpad=50.1)
+    plt.suptitle("Baseline Models Skill for Vertically Resolved Tendencies", y = 0.97)
+    plt.subplots_adjust(hspace=0.13)
+    plt.show()
+    plt.savefig(save_path + 'press_lat_diff_models.png', bbox_inches='tight', pad_inches=0.1 , dpi = 300)
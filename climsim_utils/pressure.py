@@ -0,0 +1,92 @@
+'''
+Pressure of the hybrid sigma-pressure levels of E3SM, p = P0*hya + hyb*ps, and the pressure thickness of
+every level, dp = p[k+1] - p[k] at the interfaces. dp is computed directly from the differences of the
+interface coefficients, P0*(hyai[k+1] - hyai[k]) + (hybi[k+1] - hybi[k])*ps, without building the pressure of
+all 61 interfaces first. The NumPy and torch kernels compute the same thing.
+'''
+
+import hashlib
+import os
+import numpy as np
+
+def calc_pressure(ps, hya, hyb, p0 = 1e5, dtype = np.float32):
+    '''
+    Returns the pressure at the levels given by the coefficients hya and hyb (e.g. hyam and hybm for the
+    mid-levels), of shape ps.shape + (levels,).
+    '''
+    ps = np.asarray(ps)
+    hya = np.asarray(hya, dtype = np.float64)
+    hyb = np.asarray(hyb, dtype = np.float64)
+    return (p0*hya + hyb*ps[..., np.newaxis]).astype(dtype, copy = False)
+
+def calc_dp(ps, hyai, hybi, p0 = 1e5, dtype = np.float32):
+    '''
+    Returns the pressure thickness of every level, of shape ps.shape + (len(hyai) - 1,).
+    '''
+    ps = np.asarray(ps)
+    dhya = p0*np.diff(np.asarray(hyai, dtype = np.float64))
+    dhyb = np.diff(np.asarray(hybi, dtype = np.float64))
+    dp = np.empty(ps.shape + dhya.shape, dtype = dtype)
+    np.multiply(ps[..., np.newaxis], dhyb.astype(dtype), out = dp, casting = 'unsafe')
+    dp += dhya.astype(dtype)
+    return dp
+
+def calc_dp_torch(ps, hyai, hybi, p0 = 1e5):
+    '''
+    torch version of calc_dp, for a tensor ps. hyai and hybi are tensors or arrays, the result has the dtype
+    and device of ps.
+    '''
+    import torch
+    hyai = torch.as_tensor(hyai, dtype = torch.float64)
+    hybi = torch.as_tensor(hybi, dtype = torch.float64)
+    dhya = (p0*(hyai[1:] - hyai[:-1])).to(dtype = ps.dtype, device = ps.device)
+    dhyb = (hybi[1:] - hybi[:-1]).to(dtype = ps.dtype, device = ps.device)
+    return torch.addcmul(dhya, ps.unsqueeze(-1), dhyb)
+
+
+class PressureCache:
+    '''
+    Cache of calc_dp results keyed by data split and a hash of the surface pressure and the coefficients,
+    so evaluating the same data again does not recompute dp. With cache_dir, the results are also saved as
+    .npy files and memory-mapped when loaded, which lets later runs reuse them.
+    '''
+    def __init__(self, cache_dir = None):
+        self.cache_dir = cache_dir
+        self.cache = {}
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok = True)
+
+    @staticmethod
+    def key(ps, hyai, hybi, p0, dtype):
+        '''
+        Returns a hash of everything dp depends on.
+        '''
+        h = hashlib.sha1()
+        for values in [ps, hyai, hybi]:
+            values = np.ascontiguousarray(values)
+            h.update(str((values.shape, values.dtype.str)).encode())
+            h.update(values.tobytes())
+        h.update(str((float(p0), np.dtype(dtype).str)).encode())
+        return h.hexdigest()
+
+    def get_dp(self, data_split, ps, hyai, hybi, p0 = 1e5, dtype = np.float32):
+        '''
+        Returns calc_dp(ps, hyai, hybi, p0, dtype), from the cache if it has been computed before.
+        '''
+        key = (data_split, self.key(ps, hyai, hybi, p0, dtype))
+        if key in self.cache:
+            return self.cache[key]
+        cache_file = None
+        if self.cache_dir is not None:
+            cache_file = os.path.join(self.cache_dir, f'dp_{data_split}_{key[1]}.npy')
+        if cache_file is not None and os.path.exists(cache_file):
+            dp = np.load(cache_file, mmap_mode = 'r')
+        else:
+            dp = calc_dp(ps, hyai, hybi, p0, dtype)
+            if cache_file is not None:
+                np.save(cache_file, dp)
+        # only the latest dp of every split is kept in memory
+        for cached_key in [k for k in self.cache if k[0] == data_split]:
+            del self.cache[cached_key]
+        self.cache[key] = dp
+        return dp
@@ -0,0 +1,96 @@
+import re
+import numpy as np
+
+
+class SampleIndex:
+    '''
+    Compact index of the samples of a data split saved by data_utils.save_as_npy, where sample i is column
+    columns[i % len(columns)] of file i // len(columns). Only one date per file and the lat/lon of every
+    column are stored, so the index is built in O(n_files) and the lat, lon, date, file and column of any
+    array of sample indices are computed with integer arithmetic.
+    '''
+    def __init__(self, dates, columns, lat, lon, num_samples = None):
+        '''
+        Args:
+            dates (array-like of str): yyyy-mm-dd-sssss timestamp of every file of the split.
+            columns (array-like of int): Columns of the grid saved for every file, in order.
+            lat, lon (array-like): Latitude and longitude of every column of the grid.
+            num_samples (int): Number of samples, defaults to len(dates)*len(columns).
+        '''
+        self.dates = np.asarray(dates, dtype = str)
+        self.columns = np.asarray(columns, dtype = np.int64)
+        self.grid_lat = np.asarray(lat)
+        self.grid_lon = np.asarray(lon)
+        self.num_samples = len(self.dates)*len(self.columns) if num_samples is None else int(num_samples)
+        assert self.num_samples <= len(self.dates)*len(self.columns), 'More samples than files times columns.'
+
+    @classmethod
+    def from_filelist(cls, filelist, lat, lon, columns = None, input_abbrev = 'mli', num_samples = None):
+        '''
+        Builds the index of the files in filelist, with every column of the grid unless columns is given.
+        '''
+        dates = [re.sub('\\.nc$', '', re.sub(f'^.*{input_abbrev}\\.', '', file)) for file in filelist]
+        if columns is None:
+            columns = np.arange(len(lat))
+        return cls(dates, columns, lat, lon, num_samples)
+
+    def __len__(self):
+        return self.num_samples
+
+    def _check(self, idx):
+        idx = np.asarray(idx, dtype = np.int64)
+        if np.any((idx < -self.num_samples) | (idx >= self.num_samples)):
+            raise IndexError(f'Sample index out of range for {self.num_samples} samples.')
+        return np.where(idx < 0, idx + self.num_samples, idx)
+
+    def file(self, idx):
+        '''Index in the filelist of the file of every sample in idx.'''
+        return self._check(idx) // len(self.columns)
+
+    def column(self, idx):
+        '''Grid column of every sample in idx.'''
+        return self.columns[self._check(idx) % len(self.columns)]
+
+    def lat(self, idx):
+        return self.grid_lat[self.column(idx)]
+
+    def lon(self, idx):
+        return self.grid_lon[self.column(idx)]
+
+    def date(self, idx):
+        return self.dates[self.file(idx)]
+
+    def sample(self, file, column):
+        '''
+        Inverse of file and column: the sample index of grid column column in file file.
+        '''
+        file = np.asarray(file, dtype = np.int64)
+        column = np.asarray(column, dtype = np.int64)
+        position = np.searchsorted(self.columns, column)
+        position = np.minimum(position, len(self.columns) - 1)
+        if np.any(self.columns[position] != column):
+            raise KeyError('Column not saved in this split.')
+        idx = file*len(self.columns) + position
+        if np.any((file < 0) | (idx >= self.num_samples)):
+            raise IndexError(f'Sample index out of range for {self.num_samples} samples.')
+        return idx
+
+    def to_dict(self):
+        '''
+        Returns the {sample: [(lat, lon), date]} dictionary that used to be pickled as <split>_indextolatlontime.pkl.
+        '''
+        idx = np.arange(self.num_samples)
+        return {i: [(lat, lon), date] for i, lat, lon, date in zip(idx.tolist(), self.lat(idx), self.lon(idx), self.date(idx))}
+
+    def save(self, path):
+        '''
+        Saves the index to an uncompressed .npz file.
+        '''
+        with open(path, 'wb') as f:
+            np.savez(f, dates = self.dates, columns = self.columns, lat = self.grid_lat, lon = self.grid_lon,
+                     num_samples = np.int64(self.num_samples))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as index:
+            return cls(index['dates'], index['columns'], index['lat'], index['lon'], int(index['num_samples']))
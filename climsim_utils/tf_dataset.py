@@ -0,0 +1,48 @@
+'''
+tf.data pipeline over the netCDF files of a data split, returned by data_utils.load_ncdata_with_generator
+with ml_backend = "tensorflow". The dataset starts from the file paths, and files are decoded in parallel
+by interleave, cast to float32 and split into their num_latlon samples.
+'''
+
+import tensorflow as tf
+
+def netcdf_dataset(data,
+                   filelist,
+                   shuffle = False,
+                   shuffle_buffer_size = 0,
+                   seed = 0,
+                   cache = None,
+                   unbatch = True,
+                   num_parallel_calls = tf.data.AUTOTUNE):
+    '''
+    Returns a tf.data.Dataset of the float32 (input, target) rows of the files of filelist, converted as in
+    data_utils.load_ncfile_float32. With unbatch = False, every element holds the num_latlon rows of one file.
+    Files are decoded by num_parallel_calls parallel interleave calls; the order of the files is kept unless shuffle,
+    which reshuffles the file order every epoch and then the rows in a buffer of shuffle_buffer_size elements.
+    With cache, the decoded rows are cached in the file cache (or in memory if cache is ''),
+    so that later epochs do not read the netCDF files again.
+    '''
+    input_len, target_len = data.input_feature_len, data.target_feature_len
+
+    def decode(file):
+        return data.load_ncfile_float32(file.decode())
+
+    def file_rows(file):
+        npy_input, npy_target = tf.numpy_function(decode, [file], (tf.float32, tf.float32))
+        npy_input.set_shape([None, input_len])
+        npy_target.set_shape([None, target_len])
+        rows = tf.data.Dataset.from_tensors((npy_input, npy_target))
+        return rows.unbatch() if unbatch else rows
+
+    files = tf.data.Dataset.from_tensor_slices(tf.constant([str(file) for file in filelist], dtype = tf.string))
+    if shuffle and cache is None:
+        files = files.shuffle(len(filelist), seed = seed, reshuffle_each_iteration = True)
+    dataset = files.interleave(file_rows,
+                               num_parallel_calls = num_parallel_calls,
+                               deterministic = not shuffle)
+    if cache is not None:
+        # the cached rows are in file order, and only the rows are shuffled
+        dataset = dataset.cache(cache)
+    if shuffle and shuffle_buffer_size > 0:
+        dataset = dataset.shuffle(shuffle_buffer_size, seed = seed, reshuffle_each_iteration = True)
+    return dataset.prefetch(tf.data.AUTOTUNE)
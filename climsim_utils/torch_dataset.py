@@ -0,0 +1,137 @@
+'''
+PyTorch iterable dataset over the netCDF files of a data split, returned by data_utils.load_ncdata_with_generator
+with ml_backend = "pytorch". The filelist is partitioned between DDP ranks and DataLoader workers, so that every
+file is read by exactly one worker, and every worker decodes files in a background thread into a bounded queue.
+'''
+
+import queue
+import threading
+import numpy as np
+import torch
+
+class NetCDFIterableDataset(torch.utils.data.IterableDataset):
+    '''
+    Yields the float32 (input, target) tensors of the files of filelist, converted as in data_utils.load_ncfile_float32.
+    With shuffle_buffer_size = 0, every item holds the num_latlon rows of one file; otherwise single rows are
+    yielded in random order from a buffer of shuffle_buffer_size rows filled across files.
+    With shuffle, the file order is shuffled every epoch (set with set_epoch) with the same permutation on every rank.
+    Every worker keeps at most prefetch_files decoded files ahead of the consumer.
+    rank and world_size default to those of torch.distributed if it is initialized. As in DistributedSampler, every
+    rank gets the same number of files: the files of an epoch are padded by repeating the first ones, or the last
+    ones are dropped if drop_last, to a multiple of world_size, so that no rank stops iterating before the others.
+    '''
+    def __init__(self,
+                 data,
+                 filelist,
+                 shuffle = False,
+                 shuffle_buffer_size = 0,
+                 prefetch_files = 2,
+                 seed = 0,
+                 rank = None,
+                 world_size = None,
+                 drop_last = False):
+        assert prefetch_files >= 1, 'prefetch_files must be at least 1.'
+        self.data = data
+        self.filelist = list(filelist)
+        self.shuffle = shuffle
+        self.shuffle_buffer_size = shuffle_buffer_size
+        self.prefetch_files = prefetch_files
+        self.seed = seed
+        self.drop_last = drop_last
+        self.epoch = 0
+        if rank is None or world_size is None:
+            distributed = torch.distributed.is_available() and torch.distributed.is_initialized()
+            rank = torch.distributed.get_rank() if distributed else 0
+            world_size = torch.distributed.get_world_size() if distributed else 1
+        self.rank = rank
+        self.world_size = world_size
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def worker_files(self):
+        '''
+        Returns the files read by this DataLoader worker of this rank. The files of the epoch are split between
+        the ranks first, so that every rank has the same number of files, and then between the workers of the rank.
+        '''
+        worker_info = torch.utils.data.get_worker_info()
+        worker_id, num_workers = (0, 1) if worker_info is None else (worker_info.id, worker_info.num_workers)
+        order = np.arange(len(self.filelist))
+        if self.shuffle:
+            order = np.random.default_rng((self.seed, self.epoch)).permutation(order)
+        if self.drop_last:
+            order = order[:len(order) - len(order) % self.world_size]
+        else:
+            order = np.resize(order, -(-len(order) // self.world_size)*self.world_size)
+        rank_order = order[self.rank::self.world_size]
+        return [self.filelist[i] for i in rank_order[worker_id::num_workers]]
+
+    def _prefetch(self, files):
+        '''
+        Yields the converted files, decoded by a background thread at most prefetch_files ahead.
+        '''
+        converted = queue.Queue(maxsize = self.prefetch_files)
+        stop = threading.Event()
+        def put(item):
+            # returns False if the consumer stopped
+            while not stop.is_set():
+                try:
+                    converted.put(item, timeout = 0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+        def producer():
+            try:
+                for file in files:
+                    if not put(self.data.load_ncfile_float32(file)):
+                        return
+                put(None)
+            except BaseException as error:
+                put(error)
+        thread = threading.Thread(target = producer, daemon = True)
+        thread.start()
+        try:
+            while True:
+                item = converted.get()
+                if item is None:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+
+    def __iter__(self):
+        files = self.worker_files()
+        if self.shuffle_buffer_size <= 0:
+            for npy_input, npy_target in self._prefetch(files):
+                yield torch.from_numpy(npy_input), torch.from_numpy(npy_target)
+            return
+        worker_info = torch.utils.data.get_worker_info()
+        rng = np.random.default_rng((self.seed, self.epoch, self.rank, 0 if worker_info is None else worker_info.id))
+        buffer_input = np.empty((self.shuffle_buffer_size, self.data.input_feature_len), dtype = np.float32)
+        buffer_target = np.empty((self.shuffle_buffer_size, self.data.target_feature_len), dtype = np.float32)
+        filled = 0
+        for npy_input, npy_target in self._prefetch(files):
+            for row in range(npy_input.shape[0]):
+                if filled < self.shuffle_buffer_size:
+                    buffer_input[filled], buffer_target[filled] = npy_input[row], npy_target[row]
+                    filled += 1
+                    continue
+                # yield a random buffered row and put the new row in its place
+                i = rng.integers(self.shuffle_buffer_size)
+                yield torch.from_numpy(buffer_input[i].copy()), torch.from_numpy(buffer_target[i].copy())
+                buffer_input[i], buffer_target[i] = npy_input[row], npy_target[row]
+        for i in rng.permutation(filled):
+            yield torch.from_numpy(buffer_input[i].copy()), torch.from_numpy(buffer_target[i].copy())
+
+    def as_numpy_iterator(self):
+        '''
+        Yields the unconverted float64 (input, target) arrays of every file in filelist order.
+        '''
+        for file in self.filelist:
+            npy_input, npy_target = self.data.load_ncfile(file)
+            assert npy_input.shape[-1] == self.data.input_feature_len
+            assert npy_target.shape[-1] == self.data.target_feature_len
+            yield np.array(npy_input), np.array(npy_target)
@@ -0,0 +1,69 @@
+import numpy as np
+
+
+class ZonalMean:
+    '''
+    Precomputed (optionally area-weighted) mean of the columns of a grid over latitude bands. The columns are
+    permuted once so that every band is contiguous, and a call sums the bands with a single np.add.reduceat
+    along the column axis, which applies the sparse column-to-band averaging operator to arrays of any shape,
+    e.g. (time, ncol, lev), without a Python loop over latitudes.
+    '''
+    def __init__(self, lat, weights = None, bins = None):
+        '''
+        Args:
+            lat (array-like): Latitude of every column.
+            weights (array-like): Weight of every column, e.g. its area. Defaults to equal weights.
+            bins (array-like): Edges of the latitude bands, binned like np.digitize(lat, bins) - 1. Columns
+                outside the edges are ignored and empty bands are NaN. Defaults to one band per unique latitude.
+        '''
+        lat = np.asarray(lat)
+        if bins is None:
+            self.lats, band = np.unique(lat, return_inverse = True)
+        else:
+            bins = np.asarray(bins)
+            band = np.digitize(lat, bins) - 1
+            # the mid points of the bins are used as the representative latitudes
+            self.lats = (bins[:-1] + bins[1:])/2
+        self.num_cols = len(lat)
+        self.num_bands = len(self.lats)
+        in_band = (band >= 0) & (band < self.num_bands)
+        self.order = np.flatnonzero(in_band)[np.argsort(band[in_band], kind = 'stable')]
+        self.band_sizes = np.bincount(band[in_band], minlength = self.num_bands)
+        self.nonempty = self.band_sizes > 0
+        self.starts = (np.cumsum(self.band_sizes) - self.band_sizes)[self.nonempty]
+        if weights is None:
+            self.weights = None
+            self.band_weights = self.band_sizes[self.nonempty].astype(np.float64)
+        else:
+            self.weights = np.asarray(weights, dtype = np.float64)[self.order]
+            self.band_weights = np.add.reduceat(self.weights, self.starts)
+
+    def band_columns(self, band):
+        '''
+        Returns the columns of a band.
+        '''
+        start = np.sum(self.band_sizes[:band])
+        return self.order[start:start + self.band_sizes[band]]
+
+    def __call__(self, data, axis = 1):
+        '''
+        Returns the band means of data along the column axis, which is replaced by a band axis of length num_bands.
+        '''
+        data = np.asarray(data)
+        axis = axis % data.ndim
+        assert data.shape[axis] == self.num_cols, f'Expected {self.num_cols} columns along axis {axis}.'
+        shape = [1]*data.ndim
+        shape[axis] = -1
+        data = np.take(data, self.order, axis = axis)
+        if self.weights is not None:
+            data = data*self.weights.reshape(shape)
+        means = np.add.reduceat(data, self.starts, axis = axis)/self.band_weights.reshape(shape)
+        if self.nonempty.all():
+            return means
+        out_shape = list(means.shape)
+        out_shape[axis] = self.num_bands
+        out = np.full(out_shape, np.nan, dtype = means.dtype)
+        index = [slice(None)]*data.ndim
+        index[axis] = self.nonempty
+        out[tuple(index)] = means
+        return out
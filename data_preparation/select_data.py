@@ -126,11 +126,13 @@ def select_first_n_samples(data: tuple, n_samples: List[int]) -> tuple:
 
     Args:
         data: (tuple) datasets to select samples from, usually input and target data
-        n_samples: (int) number of samples to select
+        n_samples: (int or List[int]) number of samples to select, for all datasets or per dataset
 
     Returns:
-        tuple: the selected samples from the data
+        tuple: the selected samples from the data, as views (memory-mapped data is not read)
     """
+    if isinstance(n_samples, int):
+        return tuple(d[:n_samples] for d in data)
     if len(n_samples) == 1:
         return tuple(d[:n_samples[0]] for d in data)
     else:
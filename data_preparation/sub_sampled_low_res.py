@@ -4,6 +4,7 @@ Script to build pytorch dataset for the subsampled low resolution data
 
 from pathlib import Path
 from torch.utils.data import Dataset
+import numpy as np
 import xarray as xr
 from climsim_utils.data_utils import *
 from omegaconf import DictConfig
@@ -23,6 +24,8 @@ class SubSampledLowResDataset(Dataset):
 
         self.mode = mode
         self.dataset_testing_type = dataset_testing_type
+        # memory-map the .npy files (e.g. 'r') so that DataLoader workers and ranks share them through the page cache
+        self.mmap_mode = dataset_config.get("mmap_mode", None)
         if dataset_testing_type == "quick":
             base_dir = Path(__file__).resolve().parents[1]
             self.data_path = os.path.join(base_dir, dataset_config.precomputed_quick_data_path)
@@ -70,26 +73,26 @@ class SubSampledLowResDataset(Dataset):
             train_input_path = self.data_path + "train_input.npy"
             train_target_path = self.data_path + "train_target.npy"
             self.data_class.input_train = self.data_class.load_npy_file(
-                train_input_path
+                train_input_path, mmap_mode=self.mmap_mode
             )
             self.data_class.target_train = self.data_class.load_npy_file(
-                train_target_path
+                train_target_path, mmap_mode=self.mmap_mode
             )
             return self.data_class.input_train, self.data_class.target_train
 
         elif self.mode == "val":
             val_input_path = self.data_path + "val_input.npy"
             val_target_path = self.data_path + "val_target.npy"
-            self.data_class.input_val = self.data_class.load_npy_file(val_input_path)
-            self.data_class.target_val = self.data_class.load_npy_file(val_target_path)
+            self.data_class.input_val = self.data_class.load_npy_file(val_input_path, mmap_mode=self.mmap_mode)
+            self.data_class.target_val = self.data_class.load_npy_file(val_target_path, mmap_mode=self.mmap_mode)
             return self.data_class.input_val, self.data_class.target_val
 
         elif self.mode == "test":
             test_input_path = self.data_path + "scoring_input.npy"
             test_target_path = self.data_path + "scoring_target.npy"
-            self.data_class.input_test = self.data_class.load_npy_file(test_input_path)
+            self.data_class.input_test = self.data_class.load_npy_file(test_input_path, mmap_mode=self.mmap_mode)
             self.data_class.target_test = self.data_class.load_npy_file(
-                test_target_path
+                test_target_path, mmap_mode=self.mmap_mode
             )
             return self.data_class.input_test, self.data_class.target_test
 
@@ -97,4 +100,7 @@ class SubSampledLowResDataset(Dataset):
         return len(self.input)
 
     def __getitem__(self, idx):
+        if self.mmap_mode is not None:
+            # copy only the requested row out of the read-only memory map
+            return np.array(self.input[idx]), np.array(self.target[idx])
         return self.input[idx], self.target[idx]
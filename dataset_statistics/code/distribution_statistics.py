@@ -0,0 +1,300 @@
+#!/usr/bin/env python
+"""
+One-pass distribution statistics of E3SM-MMF variables, per vertical level.
+
+Every input (mli) and output (mlo) file is read once, by a pool of worker processes, and every
+requested variable and level is summarised in a DistributionSketch: mergeable moments (mean, std,
+skewness, kurtosis), the min and max, and a relative-error quantile sketch from which the median,
+the 25%/75% quantiles and the 100-bin histogram are computed. The sketches of the workers are merged
+and written as the per-level tables of input2D/input3D/output2D/output3D (and optional histogram figures).
+This replaces generating tendency_vvvv_llll.py per variable and level, which loaded the whole record
+of one variable and level into memory and made a separate pass per statistic.
+
+Example:
+    python distribution_statistics.py --data-path /path/to/E3SM-MMF_ne4/train/ \
+        --mli-vars state_t pbuf_CH4 cam_in_ALDIF --mlo-vars state_t cam_out_PRECC \
+        --tend-vars state_t state_q0001 --save-path stats/ --num-workers 16
+"""
+
+import argparse
+import concurrent.futures
+import glob
+import os
+
+import netCDF4
+import numpy as np
+
+
+class DistributionSketch:
+    """
+    Mergeable summary of a stream of values: count, mean and central moments M2, M3 and M4 (merged with
+    Pebay's formulas), min and max, and a quantile sketch that counts the values in logarithmic buckets
+    (gamma^(k-1), gamma^k] of their magnitude, so any quantile is known within relative_accuracy.
+    NaNs are counted and otherwise ignored, like the nan* functions.
+    """
+    def __init__(self, relative_accuracy=1e-3, min_magnitude=1e-300):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = np.log(self.gamma)
+        self.min_magnitude = min_magnitude
+        self.count = 0
+        self.num_nan = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.m3 = 0.0
+        self.m4 = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+        self.num_zero = 0
+        self.positive = {}
+        self.negative = {}
+
+    def _add_buckets(self, buckets, keys, counts):
+        for key, count in zip(keys.tolist(), counts.tolist()):
+            buckets[key] = buckets.get(key, 0) + count
+
+    def update(self, values):
+        """
+        Adds an array of values.
+        """
+        values = np.asarray(values, dtype=np.float64).ravel()
+        nan = np.isnan(values)
+        self.num_nan += int(nan.sum())
+        values = values[~nan]
+        if values.size == 0:
+            return self
+        chunk = DistributionSketch(self.relative_accuracy, self.min_magnitude)
+        chunk.count = values.size
+        chunk.mean = values.mean()
+        deviation = values - chunk.mean
+        chunk.m2 = np.sum(deviation**2)
+        chunk.m3 = np.sum(deviation**3)
+        chunk.m4 = np.sum(deviation**4)
+        chunk.min = values.min()
+        chunk.max = values.max()
+        magnitude = np.abs(values)
+        zero = magnitude <= self.min_magnitude
+        chunk.num_zero = int(zero.sum())
+        keys = np.ceil(np.log(magnitude[~zero]) / self.log_gamma).astype(np.int64)
+        positive = values[~zero] > 0
+        self._add_buckets(chunk.positive, *np.unique(keys[positive], return_counts=True))
+        self._add_buckets(chunk.negative, *np.unique(keys[~positive], return_counts=True))
+        return self.merge(chunk)
+
+    def merge(self, other):
+        """
+        Adds the values summarised by another sketch with the same relative_accuracy.
+        """
+        assert other.gamma == self.gamma, "Sketches with different relative accuracies cannot be merged."
+        self.num_nan += other.num_nan
+        if other.count == 0:
+            return self
+        na, nb = self.count, other.count
+        n = na + nb
+        delta = other.mean - self.mean
+        m2 = self.m2 + other.m2 + delta**2 * na * nb / n
+        m3 = self.m3 + other.m3 + delta**3 * na * nb * (na - nb) / n**2 \
+            + 3 * delta * (na * other.m2 - nb * self.m2) / n
+        m4 = self.m4 + other.m4 + delta**4 * na * nb * (na**2 - na * nb + nb**2) / n**3 \
+            + 6 * delta**2 * (na**2 * other.m2 + nb**2 * self.m2) / n**2 \
+            + 4 * delta * (na * other.m3 - nb * self.m3) / n
+        self.mean = self.mean + delta * nb / n
+        self.m2, self.m3, self.m4 = m2, m3, m4
+        self.count = n
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.num_zero += other.num_zero
+        self._add_buckets(self.positive, np.array(list(other.positive.keys()), dtype=np.int64), np.array(list(other.positive.values())))
+        self._add_buckets(self.negative, np.array(list(other.negative.keys()), dtype=np.int64), np.array(list(other.negative.values())))
+        return self
+
+    @property
+    def std(self):
+        return np.sqrt(self.m2 / self.count)
+
+    @property
+    def skewness(self):
+        # biased sample skewness, as scipy.stats.skew
+        return np.sqrt(self.count) * self.m3 / self.m2**1.5 if self.m2 > 0 else np.nan
+
+    @property
+    def kurtosis(self):
+        # biased Fisher kurtosis, as scipy.stats.kurtosis
+        return self.count * self.m4 / self.m2**2 - 3 if self.m2 > 0 else np.nan
+
+    def buckets(self):
+        """
+        Returns the sorted representative values of the non-empty buckets and their counts.
+        """
+        negative_keys = np.array(sorted(self.negative, reverse=True), dtype=np.int64)
+        positive_keys = np.array(sorted(self.positive), dtype=np.int64)
+        # the value within relative_accuracy of every magnitude in (gamma^(k-1), gamma^k]
+        negative_values = -2 * self.gamma**negative_keys / (self.gamma + 1)
+        positive_values = 2 * self.gamma**positive_keys / (self.gamma + 1)
+        values = np.concatenate([negative_values, [0.0] if self.num_zero else [], positive_values])
+        counts = np.concatenate([[self.negative[key] for key in negative_keys.tolist()],
+                                 [self.num_zero] if self.num_zero else [],
+                                 [self.positive[key] for key in positive_keys.tolist()]])
+        return np.clip(values, self.min, self.max), counts
+
+    def quantile(self, q):
+        """
+        Returns the q-quantiles (q in [0, 1]) of the values, within relative_accuracy.
+        """
+        values, counts = self.buckets()
+        ranks = np.asarray(q) * (self.count - 1)
+        return values[np.searchsorted(np.cumsum(counts), ranks, side="right")]
+
+    def histogram(self, bins=100):
+        """
+        Returns the frequencies and edges of a histogram with bins equal bins between the min and max,
+        where the values of every bucket of the sketch are counted in the bin of its representative value.
+        """
+        values, counts = self.buckets()
+        return np.histogram(values, bins=bins, range=(self.min, self.max), weights=counts)
+
+
+def _sketch_files(files, variables, relative_accuracy):
+    """
+    Sketches every (kind, var, level) of variables over a list of input files.
+    variables maps 'mli', 'mlo' and 'tend' to lists of variables; tendencies are (mlo - mli)/1200
+    like the ptend_* targets of data_utils. Levels are 1-based, and None for variables without levels.
+    """
+    sketches = {}
+
+    def add(kind, var, values):
+        # values are (lev, ncol) or (ncol,)
+        levels = [(None, values)] if values.ndim == 1 else [(lev + 1, values[lev]) for lev in range(values.shape[0])]
+        for level, level_values in levels:
+            key = (kind, var, level)
+            if key not in sketches:
+                sketches[key] = DistributionSketch(relative_accuracy)
+            sketches[key].update(level_values)
+
+    def read(ds, var):
+        nc_var = ds.variables[var]
+        values = np.ma.filled(nc_var[:].astype(np.float64), np.nan)
+        values = values.reshape([size for dim, size in zip(nc_var.dimensions, nc_var.shape) if dim in ("lev", "ncol")])
+        if [dim for dim in nc_var.dimensions if dim in ("lev", "ncol")] == ["ncol", "lev"]:
+            values = values.T
+        return values
+
+    for file in files:
+        mlo_file = file.replace(".mli.", ".mlo.")
+        needs_mlo = variables["mlo"] or variables["tend"]
+        with netCDF4.Dataset(file, "r") as ds_mli:
+            mli = {var: read(ds_mli, var) for var in dict.fromkeys(variables["mli"] + variables["tend"])}
+        mlo = {}
+        if needs_mlo:
+            with netCDF4.Dataset(mlo_file, "r") as ds_mlo:
+                mlo = {var: read(ds_mlo, var) for var in dict.fromkeys(variables["mlo"] + variables["tend"])}
+        for var in variables["mli"]:
+            add("mli", var, mli[var])
+        for var in variables["mlo"]:
+            add("mlo", var, mlo[var])
+        for var in variables["tend"]:
+            add("tend", var, (mlo[var] - mli[var]) / 1200)
+    return sketches
+
+
+def sketch_dataset(files, variables, relative_accuracy=1e-3, num_workers=None, files_per_task=16):
+    """
+    Sketches every (kind, var, level) of variables over files, in a pool of num_workers processes
+    (num_workers = 0 runs in this process), and returns the merged sketches.
+    """
+    tasks = [files[i:i + files_per_task] for i in range(0, len(files), files_per_task)]
+    sketches = {}
+
+    def merge(task_sketches):
+        for key, sketch in task_sketches.items():
+            if key in sketches:
+                sketches[key].merge(sketch)
+            else:
+                sketches[key] = sketch
+
+    if num_workers == 0:
+        for task in tasks:
+            merge(_sketch_files(task, variables, relative_accuracy))
+        return sketches
+    with concurrent.futures.ProcessPoolExecutor(max_workers=num_workers) as executor:
+        futures = [executor.submit(_sketch_files, task, variables, relative_accuracy) for task in tasks]
+        for future in concurrent.futures.as_completed(futures):
+            merge(future.result())
+    return sketches
+
+
+def table_name(kind, var, level):
+    """
+    Returns the file name (without extension) of a table, e.g. mli_pbuf_CH4lev_01 or mlo_cam_out_PRECC.
+    """
+    return f"{kind}_{var}" + ("" if level is None else f"lev_{level:02d}")
+
+
+def write_table(path, sketch, bins=100):
+    """
+    Writes the summary table of a sketch in the format of the tables in input2D/input3D/output2D/output3D.
+    """
+    hist, bin_edges = sketch.histogram(bins)
+    with open(path, "w") as file:
+        file.write("Standard Deviation: " + str(sketch.std) + "\n")
+        file.write("Skewness: " + str(sketch.skewness) + "\n")
+        file.write("Kurtosis: " + str(sketch.kurtosis) + "\n")
+        file.write("Median: " + str(sketch.quantile(0.5)) + "\n")
+        file.write("Mean: " + str(sketch.mean) + "\n")
+        file.write("Deciles: " + str(sketch.quantile([0.25, 0.75])) + "\n")
+        file.write("Minimum: " + str(sketch.min) + "\n")
+        file.write("Maximum: " + str(sketch.max) + "\n")
+        file.write("Bin Edges: " + str(bin_edges) + "\n")
+        file.write("Frequencies: " + str(hist.astype(np.float64)) + "\n")
+
+
+def plot_histogram(path, sketch, label, bins=100):
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    hist, bin_edges = sketch.histogram(bins)
+    fig, ax = plt.subplots()
+    ax.stairs(hist, bin_edges, fill=True, edgecolor="black")
+    ax.set_xlabel(label)
+    ax.set_ylabel("Frequency")
+    ax.set_title("Histogram")
+    fig.savefig(path)
+    plt.close(fig)
+
+
+def write_tables(sketches, save_path, bins=100, plot=False):
+    """
+    Writes the table (and the histogram figure if plot) of every sketch under save_path.
+    """
+    os.makedirs(save_path, exist_ok=True)
+    for (kind, var, level), sketch in sorted(sketches.items(), key=lambda item: (item[0][0], item[0][1], item[0][2] or 0)):
+        name = table_name(kind, var, level)
+        write_table(os.path.join(save_path, name + ".txt"), sketch, bins)
+        if plot:
+            figure_name = var + ("" if level is None else f"lev_{level:02d}") + f"_{kind}.png"
+            plot_histogram(os.path.join(save_path, figure_name), sketch, var + ("" if level is None else f" level:{level:02d}"), bins)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="One-pass per-level distribution statistics of E3SM-MMF variables.")
+    parser.add_argument("--data-path", required=True, help="Directory with one subdirectory of mli/mlo files per month.")
+    parser.add_argument("--regexp", default="E3SM-MMF.mli.*.nc", help="Glob pattern of the input files in the month directories.")
+    parser.add_argument("--stride", type=int, default=1, help="Use every stride-th input file.")
+    parser.add_argument("--mli-vars", nargs="*", default=[], help="Input variables to summarise.")
+    parser.add_argument("--mlo-vars", nargs="*", default=[], help="Output variables to summarise.")
+    parser.add_argument("--tend-vars", nargs="*", default=[], help="Variables whose tendency (mlo - mli)/1200 is summarised.")
+    parser.add_argument("--save-path", default=".", help="Directory of the tables.")
+    parser.add_argument("--bins", type=int, default=100, help="Number of histogram bins.")
+    parser.add_argument("--relative-accuracy", type=float, default=1e-3, help="Relative accuracy of the quantiles and histogram.")
+    parser.add_argument("--num-workers", type=int, default=None, help="Number of worker processes (0 for none).")
+    parser.add_argument("--plot", action="store_true", help="Also save the histogram figures.")
+    args = parser.parse_args()
+
+    files = sorted(glob.glob(os.path.join(args.data_path, "*", args.regexp)))[::args.stride]
+    variables = {"mli": args.mli_vars, "mlo": args.mlo_vars, "tend": args.tend_vars}
+    sketches = sketch_dataset(files, variables, args.relative_accuracy, args.num_workers)
+    write_tables(sketches, args.save_path, args.bins, args.plot)
+
+
+if __name__ == "__main__":
+    main()
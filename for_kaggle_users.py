@@ -141,8 +141,7 @@ data.set_stride_sample(data_split = 'train', stride_sample = 7)
 data.set_filelist(data_split = 'train')
 
 # save numpy files of training data
-data_loader = data.load_ncdata_with_generator(data_split = 'train')
-npy_iterator = list(data_loader.as_numpy_iterator())
+npy_iterator = [data.load_ncfile(file) for file in data.get_filelist('train')]
 npy_input = np.concatenate([npy_iterator[x][0] for x in range(len(npy_iterator))])
 npy_output = np.concatenate([npy_iterator[x][1] for x in range(len(npy_iterator))])
 train_npy = np.concatenate([npy_input, npy_output], axis = 1)
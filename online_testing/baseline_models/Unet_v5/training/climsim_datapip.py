@@ -7,6 +7,7 @@
 from torch.utils.data import Dataset
 import numpy as np
 import torch
+from climsim_layout_indices import compile_input_indices, compile_target_indices
 
 class climsim_dataset(Dataset):
     def __init__(self, 
@@ -20,6 +21,8 @@ class climsim_dataset(Dataset):
                  strato_lev,
                  strato_lev_out,
                  qn_lbd,
+                 input_layout,
+                 target_layout,
                  decouple_cloud=False, 
                  aggressive_pruning=False,
                 #  strato_lev_qc=30,
@@ -28,7 +31,9 @@ class climsim_dataset(Dataset):
                  input_clip=False,
                  input_clip_rhonly=False,
                  qn_tscaled=False,
-                 qn_logtransform=False):
+                 qn_logtransform=False,
+                 return_raw=False,
+                 mmap_mode=None):
         """
         Args:
             input_paths (str): Path to the .npy file containing the inputs.
@@ -41,9 +46,13 @@ class climsim_dataset(Dataset):
             strato_lev (int): Number of levels in the stratosphere.
             qc_lbd (np.ndarray): Coefficients for the exponential transformation of qc.
             qi_lbd (np.ndarray): Coefficients for the exponential transformation of qi.
+            input_layout (FeatureLayout): Layout of the input vector (data_utils.input_layout).
+            target_layout (FeatureLayout): Layout of the target vector (data_utils.target_layout).
+            return_raw (bool): Whether to return the raw float32 rows and leave all transforms to ClimsimInputTransform.
+            mmap_mode (str): mmap_mode of np.load, e.g. 'r' to memory-map the files read-only and share them between DataLoader workers and ranks.
         """
-        self.inputs = np.load(input_paths)
-        self.targets = np.load(target_paths)
+        self.inputs = np.load(input_paths, mmap_mode=mmap_mode)
+        self.targets = np.load(target_paths, mmap_mode=mmap_mode)
         self.input_paths = input_paths
         self.target_paths = target_paths
         self.input_sub = input_sub
@@ -68,6 +77,23 @@ class climsim_dataset(Dataset):
 
         if self.strato_lev_qinput <self.strato_lev:
             raise ValueError('strato_lev_qinput should be greater than or equal to strato_lev, otherwise inconsistent with E3SM')
+        self.return_raw = return_raw
+        if self.return_raw and self.qn_tscaled:
+            raise ValueError('qn_tscaled is not supported with return_raw')
+
+        input_indices = compile_input_indices(input_layout, self.strato_lev, self.strato_lev_qinput, self.strato_lev_tinput)
+        target_indices = compile_target_indices(target_layout, self.strato_lev_out)
+        self.t_idx = input_indices['t']
+        self.qn_idx = input_indices['qn']
+        self.decouple_cloud_idx = input_indices['decouple_cloud']
+        self.aggressive_prune_idx = input_indices['aggressive_prune']
+        self.qinput_prune_idx = input_indices['qinput_prune']
+        self.tinput_prune_idx = input_indices['tinput_prune']
+        self.clip_rh_idx = input_indices['clip_rh']
+        self.clip_idx = input_indices['clip']
+        self.clip_lower = input_indices['clip_lower']
+        self.clip_upper = input_indices['clip_upper']
+        self.output_prune_idx = target_indices['output_prune']
 
     def t_scaled_weight(self, t):
         # Polynomial coefficients
@@ -91,15 +117,18 @@ class climsim_dataset(Dataset):
         return len(self.inputs)
 
     def __getitem__(self, idx):
-        x = self.inputs[idx]
-        y = self.targets[idx]
+        # copy the row, the transforms below work in place and must not modify the (possibly memory-mapped) dataset
+        x = np.array(self.inputs[idx])
+        y = np.array(self.targets[idx])
+        if self.return_raw:
+            return torch.tensor(x, dtype=torch.float32), torch.tensor(y, dtype=torch.float32)
 
         if self.qn_tscaled:
             # use temperature to generate weights for scaling qn
-            qn_scale_weight = self.t_scaled_weight(x[0:60])
+            qn_scale_weight = self.t_scaled_weight(x[self.t_idx])
 
         if not self.qn_logtransform:
-            x[120:180] = 1 - np.exp(-x[120:180] * self.qn_lbd)
+            x[self.qn_idx] = 1 - np.exp(-x[self.qn_idx] * self.qn_lbd)
         x = (x - self.input_sub) / self.input_div
 
         x[np.isnan(x)] = 0
@@ -107,55 +136,27 @@ class climsim_dataset(Dataset):
 
         y = y * self.out_scale
         if self.decouple_cloud:
-            x[120:180] = 0
-            x[60*14:60*15] =0
-            x[60*18:60*19] =0
+            x[self.decouple_cloud_idx] = 0
 
         if self.aggressive_pruning:
             # for profiles, only keep stratosphere temperature. prune all other profiles in stratosphere
-            x[60:60+self.strato_lev_qinput] = 0 # prune RH
-            x[120:120+self.strato_lev_qinput] = 0
-            # x[180:180+self.strato_lev] = 0 # should be liq_partition
-            x[240:240+self.strato_lev] = 0 # prune u
-            x[300:300+self.strato_lev] = 0 # prune v
-            x[360:360+self.strato_lev] = 0
-            x[420:420+self.strato_lev] = 0
-            x[480:480+self.strato_lev] = 0
-            x[540:540+self.strato_lev] = 0
-            x[600:600+self.strato_lev] = 0
-            x[660:660+self.strato_lev] = 0
-            x[720:720+self.strato_lev] = 0
-            x[780:780+self.strato_lev_qinput] = 0 # prune qv_phy
-            x[840:840+self.strato_lev_qinput] = 0 # prune qn_phy
-            x[900:900+self.strato_lev] = 0
-            x[960:960+self.strato_lev] = 0
-            x[1020:1020+self.strato_lev_qinput] = 0 # prune qv_phy
-            x[1080:1080+self.strato_lev_qinput] = 0 # prune qn_phy in previous time step
-            x[1140:1140+self.strato_lev] = 0
-            x[1395] = 0 #SNOWHICE
+            x[self.aggressive_prune_idx] = 0
         elif self.qinput_prune:
-            #raise NotImplementedError('should use aggressive_pruning! instead of qinput_prune!')
-            # x[:,60:60+self.strato_lev] = 0
-            x[120:120+self.strato_lev] = 0
-            # x[180:180+self.strato_lev] = 0
+            x[self.qinput_prune_idx] = 0
 
         if self.strato_lev_tinput >0:
-            x[0:self.strato_lev_tinput] = 0
+            x[self.tinput_prune_idx] = 0
         
         if self.input_clip:
             if self.input_clip_rhonly:
-                x[60:120] = np.clip(x[60:120], 0, 1.2)
+                x[self.clip_rh_idx] = np.clip(x[self.clip_rh_idx], 0, 1.2)
             else:
-                x[60:120] = np.clip(x[60:120], 0, 1.2) # for RH, clip to (0,1.2)
-                x[360:720] = np.clip(x[360:720], -0.5, 0.5) # for dyn forcing, clip to (-0.5,0.5)
-                x[720:1200] = np.clip(x[720:1200], -3, 3) # for phy tendencies  clip to (-3,3)
+                # RH clipped to (0,1.2), dyn forcing to (-0.5,0.5), phy tendencies to (-3,3)
+                x[self.clip_idx] = np.clip(x[self.clip_idx], self.clip_lower, self.clip_upper)
 
         
         if self.output_prune:
-            y[60:60+self.strato_lev_out] = 0
-            y[120:120+self.strato_lev_out] = 0
-            y[180:180+self.strato_lev_out] = 0
-            y[240:240+self.strato_lev_out] = 0
+            y[self.output_prune_idx] = 0
 
         if self.qn_tscaled:
             return torch.tensor(x, dtype=torch.float32), torch.tensor(y, dtype=torch.float32), torch.tensor(qn_scale_weight, dtype=torch.float32)
@@ -4,13 +4,21 @@
 # import torch
 
 #import xarray as xr
-from torch.utils.data import Dataset
+from torch.utils.data import Dataset, Sampler
 import numpy as np
 import torch
+from climsim_layout_indices import compile_input_indices, compile_target_indices
 import glob
 import h5py
+import json
+import os
+from collections import OrderedDict
 
 class climsim_dataset_h5(Dataset):
+    # names of the input and target datasets in the h5 files
+    input_key = 'data'
+    target_key = 'data'
+
     def __init__(self, 
                  parent_path, 
                  input_sub, 
@@ -21,6 +29,8 @@ class climsim_dataset_h5(Dataset):
                  strato_lev,
                  strato_lev_out,
                  qn_lbd,
+                 input_layout,
+                 target_layout,
                  decouple_cloud=False, 
                  aggressive_pruning=False,
                 #  strato_lev_qc=30,
@@ -29,7 +39,11 @@ class climsim_dataset_h5(Dataset):
                  input_clip=False,
                  input_clip_rhonly=False,
                  qn_tscaled=False,
-                 qn_logtransform=False):
+                 qn_logtransform=False,
+                 max_read_span=4,
+                 return_raw=False,
+                 max_open_files=8,
+                 manifest_path=None):
         """
         Args:
             parent_path (str): Path to the .zarr file containing the inputs and targets.
@@ -41,29 +55,28 @@ class climsim_dataset_h5(Dataset):
             strato_lev (int): Number of levels in the stratosphere.
             qc_lbd (np.ndarray): Coefficients for the exponential transformation of qc.
             qi_lbd (np.ndarray): Coefficients for the exponential transformation of qi.
+            input_layout (FeatureLayout): Layout of the input vector (data_utils.input_layout).
+            target_layout (FeatureLayout): Layout of the target vector (data_utils.target_layout).
+            return_raw (bool): Whether to return the raw float32 rows and leave all transforms to ClimsimInputTransform.
+            max_read_span (int): A batch read from a file is a single hyperslab if it spans at most max_read_span times the number of rows requested.
+            max_open_files (int): Number of h5 files kept open by every process that reads the dataset (see get_file).
+            manifest_path (str): Optional json file with the number of rows of every input file, written on the first use
+                so that later runs do not open every file to count its rows.
         """
         self.parent_path = parent_path
-        self.input_paths = glob.glob(f'{parent_path}/**/train_input.h5', recursive=True)
-        print('input paths:', self.input_paths)
-        if not self.input_paths:
-            raise FileNotFoundError("No 'train_input.h5' files found under the specified parent path.")
-        self.target_paths = [path.replace('train_input.h5', 'train_target.h5') for path in self.input_paths]
+        self.max_open_files = max_open_files
+        self.manifest_path = manifest_path
+        self.input_paths, self.target_paths = self.find_files(parent_path)
 
         # Initialize lists to hold the samples count per file
-        self.samples_per_file = []
-        for input_path in self.input_paths:
-            with h5py.File(input_path, 'r') as file:  # Open the file to read the number of samples
-                # Assuming dataset is named 'data', adjust if different
-                self.samples_per_file.append(file['data'].shape[0])
+        self.samples_per_file = self.count_samples()
                 
         self.cumulative_samples = np.cumsum([0] + self.samples_per_file)
         self.total_samples = self.cumulative_samples[-1]
 
-        self.input_files = {}
-        self.target_files = {}
-        for input_path, target_path in zip(self.input_paths, self.target_paths):
-            self.input_files[input_path] = h5py.File(input_path, 'r')
-            self.target_files[target_path] = h5py.File(target_path, 'r')
+        # files are opened lazily by get_file in the process that reads them, e.g. in every DataLoader worker
+        self._open_files = OrderedDict()
+        self._open_files_pid = None
 
         # for input_path, target_path in zip(self.input_paths, self.target_paths):
         #     # Lazily open zarr files and keep the reference
@@ -90,10 +103,96 @@ class climsim_dataset_h5(Dataset):
         self.input_clip_rhonly = input_clip_rhonly
         self.qn_tscaled = qn_tscaled
         self.qn_logtransform = qn_logtransform
+        # read a whole hyperslab for a batch if it spans at most this many times the number of rows requested
+        self.max_read_span = max_read_span
 
         if self.strato_lev_qinput <self.strato_lev:
             raise ValueError('strato_lev_qinput should be greater than or equal to strato_lev, otherwise inconsistent with E3SM')
+        self.return_raw = return_raw
+        if self.return_raw and self.qn_tscaled:
+            raise ValueError('qn_tscaled is not supported with return_raw')
+
+        input_indices = compile_input_indices(input_layout, self.strato_lev, self.strato_lev_qinput, self.strato_lev_tinput)
+        target_indices = compile_target_indices(target_layout, self.strato_lev_out)
+        self.t_idx = input_indices['t']
+        self.qn_idx = input_indices['qn']
+        self.decouple_cloud_idx = input_indices['decouple_cloud']
+        self.aggressive_prune_idx = input_indices['aggressive_prune']
+        self.qinput_prune_idx = input_indices['qinput_prune']
+        self.tinput_prune_idx = input_indices['tinput_prune']
+        self.clip_rh_idx = input_indices['clip_rh']
+        self.clip_idx = input_indices['clip']
+        self.clip_lower = input_indices['clip_lower']
+        self.clip_upper = input_indices['clip_upper']
+        self.output_prune_idx = target_indices['output_prune']
+
+
+    def find_files(self, parent_path):
+        """
+        Return the lists of input and target file paths under parent_path.
+        """
+        input_paths = glob.glob(f'{parent_path}/**/train_input.h5', recursive=True)
+        print('input paths:', input_paths)
+        if not input_paths:
+            raise FileNotFoundError("No 'train_input.h5' files found under the specified parent path.")
+        target_paths = [path.replace('train_input.h5', 'train_target.h5') for path in input_paths]
+        return input_paths, target_paths
+
+    def count_samples(self):
+        """
+        Return the number of samples in each input file. With manifest_path, the counts of the files whose size
+        and modification time did not change are read from the manifest, and the manifest is rewritten if any
+        file had to be opened.
+        """
+        manifest = {}
+        if self.manifest_path and os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)['files']
+        files = {}
+        for input_path in self.input_paths:
+            name = os.path.relpath(input_path, self.parent_path)
+            stat = os.stat(input_path)
+            entry = manifest.get(name)
+            if entry is None or entry['size'] != stat.st_size or entry.get('mtime_ns') != stat.st_mtime_ns:
+                with h5py.File(input_path, 'r') as file:  # Open the file to read the number of samples
+                    entry = {'num_rows': file[self.input_key].shape[0], 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+            files[name] = entry
+        if self.manifest_path and files != manifest:
+            # written to a temporary file first, so that ranks starting together never read a partial manifest
+            tmp_path = f'{self.manifest_path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump({'files': files}, f, indent=1)
+            os.replace(tmp_path, self.manifest_path)
+        return [files[os.path.relpath(input_path, self.parent_path)]['num_rows'] for input_path in self.input_paths]
 
+    def open_file(self, path):
+        return h5py.File(path, 'r')
+
+    def get_file(self, path):
+        """
+        Return the open h5 file of path. Files are opened on first use by the current process, so that no
+        handle is inherited by forked DataLoader workers, and at most max_open_files are kept open, closing
+        the least recently used one.
+        """
+        if self._open_files_pid != os.getpid():
+            # handles of the parent process are not reused after a fork
+            self._open_files = OrderedDict()
+            self._open_files_pid = os.getpid()
+        if path in self._open_files:
+            self._open_files.move_to_end(path)
+            return self._open_files[path]
+        file = self.open_file(path)
+        self._open_files[path] = file
+        if len(self._open_files) > self.max_open_files:
+            self._open_files.popitem(last=False)[1].close()
+        return file
+
+    def __getstate__(self):
+        # open h5 files can not be pickled (e.g. for spawned DataLoader workers), they are reopened by get_file
+        state = self.__dict__.copy()
+        state['_open_files'] = OrderedDict()
+        state['_open_files_pid'] = None
+        return state
 
     def __len__(self):
         return self.total_samples
@@ -121,33 +220,18 @@ class climsim_dataset_h5(Dataset):
         y = np.where(t > t_max, y_max, y)
         return y_max/y
 
-    def __getitem__(self, idx):
-        if idx < 0 or idx >= self.total_samples:
-            raise IndexError("Index out of bounds")
-        # Find which file the index falls into
-        # file_idx = np.searchsorted(self.cumulative_samples, idx+1) - 1
-        # local_idx = idx - self.cumulative_samples[file_idx]
-
-        # x = zarr.open(self.input_paths[file_idx], mode='r')[local_idx]
-        # y = zarr.open(self.target_paths[file_idx], mode='r')[local_idx]
-        file_idx, local_idx = self._find_file_and_index(idx)
-
-
-        # x = self.input_zarrs[self.input_paths[file_idx]][local_idx]
-        # y = self.target_zarrs[self.target_paths[file_idx]][local_idx]
-        # Open the HDF5 files and read the data for the given index
-        input_file = self.input_files[self.input_paths[file_idx]]
-        target_file = self.target_files[self.target_paths[file_idx]]
-        x = input_file['data'][local_idx]
-        y = target_file['data'][local_idx]
+    def transform(self, x, y):
+        """
+        Apply the input and target transforms to a single sample (features,) or a batch (batch, features).
+        Both arrays are modified in place where possible. Returns x, y and the qn scaling weight (None unless qn_tscaled).
+        """
+        qn_scale_weight = None
         if self.qn_tscaled:
             # use temperature to generate weights for scaling qn
-            qn_scale_weight = self.t_scaled_weight(x[0:60])
+            qn_scale_weight = self.t_scaled_weight(x[..., self.t_idx])
 
-        # x = np.load(self.input_paths,mmap_mode='r')[idx]
-        # y = np.load(self.target_paths,mmap_mode='r')[idx]
         if not self.qn_logtransform:
-            x[120:180] = 1 - np.exp(-x[120:180] * self.qn_lbd)
+            x[..., self.qn_idx] = 1 - np.exp(-x[..., self.qn_idx] * self.qn_lbd)
         # Avoid division by zero in input_div and set corresponding x to 0
         # input_div_nonzero = self.input_div != 0
         # x = np.where(input_div_nonzero, (x - self.input_sub) / self.input_div, 0)
@@ -158,57 +242,283 @@ class climsim_dataset_h5(Dataset):
 
         y = y * self.out_scale
         if self.decouple_cloud:
-            x[120:180] = 0
-            x[60*14:60*15] =0
-            x[60*18:60*19] =0
-        
+            x[..., self.decouple_cloud_idx] = 0
+
         if self.aggressive_pruning:
             # for profiles, only keep stratosphere temperature. prune all other profiles in stratosphere
-            x[60:60+self.strato_lev_qinput] = 0 # prune RH
-            x[120:120+self.strato_lev_qinput] = 0
-            # x[180:180+self.strato_lev] = 0 # should be liq_partition
-            x[240:240+self.strato_lev] = 0 # prune u
-            x[300:300+self.strato_lev] = 0 # prune v
-            x[360:360+self.strato_lev] = 0
-            x[420:420+self.strato_lev] = 0
-            x[480:480+self.strato_lev] = 0
-            x[540:540+self.strato_lev] = 0
-            x[600:600+self.strato_lev] = 0
-            x[660:660+self.strato_lev] = 0
-            x[720:720+self.strato_lev] = 0
-            x[780:780+self.strato_lev_qinput] = 0 # prune qv_phy
-            x[840:840+self.strato_lev_qinput] = 0 # prune qn_phy
-            x[900:900+self.strato_lev] = 0
-            x[960:960+self.strato_lev] = 0
-            x[1020:1020+self.strato_lev_qinput] = 0 # prune qv_phy
-            x[1080:1080+self.strato_lev_qinput] = 0 # prune qn_phy in previous time step
-            x[1140:1140+self.strato_lev] = 0
-            x[1395] = 0 #SNOWHICE
+            x[..., self.aggressive_prune_idx] = 0
         elif self.qinput_prune:
-            # raise NotImplementedError('should use aggressive_pruning! instead of qinput_prune!')
-            #x[:,60:60+self.strato_lev] = 0
-            x[120:120+self.strato_lev] = 0
-            # x[180:180+self.strato_lev] = 0
+            x[..., self.qinput_prune_idx] = 0
 
         if self.strato_lev_tinput >0:
-            x[0:self.strato_lev_tinput] = 0
+            x[..., self.tinput_prune_idx] = 0
         
         if self.input_clip:
             if self.input_clip_rhonly:
-                x[60:120] = np.clip(x[60:120], 0, 1.2)
+                x[..., self.clip_rh_idx] = np.clip(x[..., self.clip_rh_idx], 0, 1.2)
             else:
-                x[60:120] = np.clip(x[60:120], 0, 1.2) # for RH, clip to (0,1.2)
-                x[360:720] = np.clip(x[360:720], -0.5, 0.5) # for dyn forcing, clip to (-0.5,0.5)
-                x[720:1200] = np.clip(x[720:1200], -3, 3) # for phy tendencies  clip to (-3,3)
+                # RH clipped to (0,1.2), dyn forcing to (-0.5,0.5), phy tendencies to (-3,3)
+                x[..., self.clip_idx] = np.clip(x[..., self.clip_idx], self.clip_lower, self.clip_upper)
 
         
         if self.output_prune:
-            y[60:60+self.strato_lev_out] = 0
-            y[120:120+self.strato_lev_out] = 0
-            y[180:180+self.strato_lev_out] = 0
-            y[240:240+self.strato_lev_out] = 0
+            y[..., self.output_prune_idx] = 0
+
+        return x, y, qn_scale_weight
+
+    def _read_rows(self, dataset, local_idx):
+        """
+        Read the sorted rows local_idx of an h5py dataset with one hyperslab read when they are
+        close together, or one point selection otherwise.
+        """
+        start, stop = local_idx[0], local_idx[-1] + 1
+        if stop - start <= self.max_read_span * len(local_idx):
+            return dataset[start:stop][local_idx - start]
+        unique_idx, inverse = np.unique(local_idx, return_inverse=True)
+        return dataset[unique_idx][inverse]
+
+    def get_batch(self, indices):
+        """
+        Read and transform a batch of samples. The indices are sorted and grouped by file so that every
+        file is read once, and the transforms are applied to the whole (batch, features) array.
+        Results are identical to stacking __getitem__ over the indices, in the given order.
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        if indices.size == 0 or indices.min() < 0 or indices.max() >= self.total_samples:
+            raise IndexError("Index out of bounds")
+        order = np.argsort(indices, kind='stable')
+        sorted_idx = indices[order]
+        file_ids = np.searchsorted(self.cumulative_samples, sorted_idx, side='right') - 1
+        x_sorted = []
+        y_sorted = []
+        for file_idx in np.unique(file_ids):
+            start, stop = np.searchsorted(file_ids, [file_idx, file_idx + 1])
+            local_idx = sorted_idx[start:stop] - self.cumulative_samples[file_idx]
+            x_sorted.append(self._read_rows(self.get_file(self.input_paths[file_idx])[self.input_key], local_idx))
+            y_sorted.append(self._read_rows(self.get_file(self.target_paths[file_idx])[self.target_key], local_idx))
+        x_sorted = np.concatenate(x_sorted)
+        y_sorted = np.concatenate(y_sorted)
+        x = np.empty_like(x_sorted)
+        y = np.empty_like(y_sorted)
+        x[order] = x_sorted
+        y[order] = y_sorted
+
+        if self.return_raw:
+            return torch.tensor(x, dtype=torch.float32), torch.tensor(y, dtype=torch.float32)
+
+        x, y, qn_scale_weight = self.transform(x, y)
+        if self.qn_tscaled:
+            return torch.tensor(x, dtype=torch.float32), torch.tensor(y, dtype=torch.float32), torch.tensor(qn_scale_weight, dtype=torch.float32)
+        else:
+            return torch.tensor(x, dtype=torch.float32), torch.tensor(y, dtype=torch.float32)
+
+    def __getitem__(self, idx):
+        # a list or array of indices (e.g. from climsim_block_batch_sampler with batch_size=None in the DataLoader) returns a whole batch
+        if np.ndim(idx) > 0:
+            return self.get_batch(idx)
+        if idx < 0 or idx >= self.total_samples:
+            raise IndexError("Index out of bounds")
+        # Find which file the index falls into
+        # file_idx = np.searchsorted(self.cumulative_samples, idx+1) - 1
+        # local_idx = idx - self.cumulative_samples[file_idx]
+
+        # x = zarr.open(self.input_paths[file_idx], mode='r')[local_idx]
+        # y = zarr.open(self.target_paths[file_idx], mode='r')[local_idx]
+        file_idx, local_idx = self._find_file_and_index(idx)
+
+
+        # x = self.input_zarrs[self.input_paths[file_idx]][local_idx]
+        # y = self.target_zarrs[self.target_paths[file_idx]][local_idx]
+        # Open the HDF5 files and read the data for the given index
+        x = self.get_file(self.input_paths[file_idx])[self.input_key][local_idx]
+        y = self.get_file(self.target_paths[file_idx])[self.target_key][local_idx]
+
+        # x = np.load(self.input_paths,mmap_mode='r')[idx]
+        # y = np.load(self.target_paths,mmap_mode='r')[idx]
+        if self.return_raw:
+            return torch.tensor(x, dtype=torch.float32), torch.tensor(y, dtype=torch.float32)
+        x, y, qn_scale_weight = self.transform(x, y)
 
         if self.qn_tscaled:
             return torch.tensor(x, dtype=torch.float32), torch.tensor(y, dtype=torch.float32), torch.tensor(qn_scale_weight, dtype=torch.float32)
         else:
-            return torch.tensor(x, dtype=torch.float32), torch.tensor(y, dtype=torch.float32)
\ No newline at end of file
+            return torch.tensor(x, dtype=torch.float32), torch.tensor(y, dtype=torch.float32)
+
+
+class climsim_block_batch_sampler(Sampler):
+    """
+    Batch sampler for climsim_dataset_h5 that yields whole batches of indices, to be used with
+    DataLoader(dataset, batch_size=None, sampler=climsim_block_batch_sampler(...)) so that every batch is
+    read and transformed at once by climsim_dataset_h5.get_batch.
+
+    With contiguous=True every batch is a contiguous block of samples (one hyperslab read per file) and only
+    the order of the blocks is shuffled. With contiguous=False the samples are shuffled individually and
+    every batch is sorted before reading.
+    """
+    def __init__(self, 
+                 num_samples, 
+                 batch_size, 
+                 shuffle=True, 
+                 drop_last=True, 
+                 contiguous=True, 
+                 num_replicas=1, 
+                 rank=0, 
+                 seed=0):
+        """
+        Args:
+            num_samples (int): Number of samples in the dataset.
+            batch_size (int): Number of samples per batch.
+            shuffle (bool): Whether to shuffle every epoch.
+            drop_last (bool): Whether to drop the last incomplete batch.
+            contiguous (bool): Whether batches are contiguous blocks of samples.
+            num_replicas (int): Number of distributed processes.
+            rank (int): Rank of the current process.
+            seed (int): Random seed, combined with the epoch set by set_epoch.
+        """
+        self.num_samples = num_samples
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.contiguous = contiguous
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.seed = seed
+        self.epoch = 0
+        if drop_last:
+            num_batches = num_samples // batch_size
+        else:
+            num_batches = -(-num_samples // batch_size)
+        # every rank gets the same number of batches
+        self.num_batches = num_batches // num_replicas
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __len__(self):
+        return self.num_batches
+
+    def __iter__(self):
+        rng = np.random.default_rng(self.seed + self.epoch)
+        if self.shuffle and not self.contiguous:
+            samples = rng.permutation(self.num_samples)
+        else:
+            samples = np.arange(self.num_samples)
+        batches = [samples[i:i+self.batch_size] for i in range(0, self.num_samples, self.batch_size)]
+        if self.drop_last and len(batches) > 0 and len(batches[-1]) < self.batch_size:
+            batches = batches[:-1]
+        if self.shuffle:
+            batches = [batches[i] for i in rng.permutation(len(batches))]
+        batches = batches[self.rank:self.num_batches*self.num_replicas:self.num_replicas]
+        for batch in batches:
+            yield np.sort(batch).tolist()
+
+
+class climsim_file_batch_sampler(Sampler):
+    """
+    Batch sampler for climsim_dataset_h5 or climsim_dataset_shards that gives every process its own files.
+    The files, or ranges of at most range_size rows of a file, are dealt to num_replicas*num_workers groups, one per
+    DataLoader worker of every rank, balancing their number of samples. Every epoch the ranges are reshuffled before
+    they are dealt, and the samples of every group are shuffled in blocks of block_size consecutive rows and cut into
+    batches. The batches of the workers of a rank are yielded in turn, in the round-robin order in which the DataLoader
+    hands batches to its workers, so that every worker mostly reads from the files of its own group.
+    Batches are sorted and yielded whole, to be used with
+    DataLoader(dataset, batch_size=None, sampler=climsim_file_batch_sampler(...), num_workers=num_workers).
+    """
+    def __init__(self,
+                 samples_per_file,
+                 batch_size,
+                 num_workers=0,
+                 range_size=None,
+                 block_size=1,
+                 shuffle=True,
+                 drop_last=True,
+                 num_replicas=1,
+                 rank=0,
+                 seed=0):
+        """
+        Args:
+            samples_per_file (list): Number of samples in every file (climsim_dataset_h5.samples_per_file).
+            batch_size (int): Number of samples per batch.
+            num_workers (int): Number of workers of the DataLoader.
+            range_size (int): Maximum number of consecutive samples of a file dealt to one group, None for whole files.
+            block_size (int): Number of consecutive samples per block.
+            shuffle (bool): Whether to shuffle every epoch.
+            drop_last (bool): Whether to drop the last incomplete batch of every group.
+            num_replicas (int): Number of distributed processes.
+            rank (int): Rank of the current process.
+            seed (int): Random seed, combined with the epoch set by set_epoch.
+        """
+        self.samples_per_file = list(samples_per_file)
+        self.file_offsets = np.cumsum([0] + self.samples_per_file)
+        self.batch_size = batch_size
+        self.num_workers = max(num_workers, 1)
+        self.range_size = range_size
+        self.block_size = block_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.seed = seed
+        self.epoch = 0
+        self.ranges = []
+        for file_idx, num_samples in enumerate(self.samples_per_file):
+            file_range_size = range_size or max(num_samples, 1)
+            start = self.file_offsets[file_idx]
+            self.ranges.extend((start + i, start + min(i + file_range_size, num_samples)) for i in range(0, num_samples, file_range_size))
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def _groups(self):
+        """
+        Return the ranges of every group, group rank*num_workers + worker being read by that worker of that rank.
+        """
+        rng = np.random.default_rng(self.seed + self.epoch)
+        order = rng.permutation(len(self.ranges)) if self.shuffle else np.arange(len(self.ranges))
+        groups = [[] for _ in range(self.num_replicas*self.num_workers)]
+        group_samples = np.zeros(len(groups), dtype=np.int64)
+        for i in order:
+            group = int(np.argmin(group_samples))
+            start, stop = self.ranges[i]
+            groups[group].append((start, stop))
+            group_samples[group] += stop - start
+        return groups, group_samples
+
+    def _num_batches(self, group_samples):
+        # every rank gets the same number of batches
+        if self.drop_last:
+            group_batches = group_samples // self.batch_size
+        else:
+            group_batches = -(-group_samples // self.batch_size)
+        return int(group_batches.reshape(self.num_replicas, self.num_workers).sum(axis=1).min())
+
+    def __len__(self):
+        return self._num_batches(self._groups()[1])
+
+    def _group_batches(self, group, group_idx):
+        """
+        Return the batches of the samples of the ranges of one group.
+        """
+        blocks = [np.arange(start, stop)[i:i+self.block_size] for start, stop in group for i in range(0, stop - start, self.block_size)]
+        if self.shuffle:
+            rng = np.random.default_rng((self.seed + self.epoch, group_idx))
+            blocks = [blocks[i] for i in rng.permutation(len(blocks))]
+        samples = np.concatenate(blocks) if blocks else np.zeros(0, dtype=np.int64)
+        batches = [samples[i:i+self.batch_size] for i in range(0, len(samples), self.batch_size)]
+        if self.drop_last and len(batches) > 0 and len(batches[-1]) < self.batch_size:
+            batches = batches[:-1]
+        return batches
+
+    def __iter__(self):
+        groups, group_samples = self._groups()
+        num_batches = self._num_batches(group_samples)
+        first_group = self.rank*self.num_workers
+        worker_batches = [self._group_batches(groups[first_group + worker], first_group + worker) for worker in range(self.num_workers)]
+        batch_idx = 0
+        for i in range(max(len(batches) for batches in worker_batches)):
+            for batches in worker_batches:
+                if i < len(batches):
+                    if batch_idx >= num_batches:
+                        return
+                    yield np.sort(batches[i]).tolist()
+                    batch_idx += 1
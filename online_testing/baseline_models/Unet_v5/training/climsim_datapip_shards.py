@@ -0,0 +1,133 @@
+from torch.utils.data import Sampler
+import numpy as np
+import h5py
+import json
+import os
+from climsim_datapip_h5 import climsim_dataset_h5
+
+class climsim_dataset_shards(climsim_dataset_h5):
+    """
+    Dataset over the chunked HDF5 shards written by data_utils.save_as_shards. The shards are listed in
+    {data_split}_manifest.json under parent_path. All other arguments and the transforms are the same as for
+    climsim_dataset_h5, including batched reads with a list of indices.
+    Use climsim_shard_batch_sampler to read the shards in chunk-sized blocks.
+    """
+    input_key = 'input'
+    target_key = 'target'
+
+    def __init__(self, parent_path, *args, data_split='train', chunk_cache_mb=64, **kwargs):
+        """
+        Args:
+            parent_path (str): Directory with the shards and the manifest.
+            data_split (str): Data split of the manifest to read.
+            chunk_cache_mb (int): Size of the HDF5 chunk cache of every shard, in MB. Should hold at least one
+                chunk of inputs so that compressed chunks are only decompressed once per block.
+        """
+        self.data_split = data_split
+        self.chunk_cache_mb = chunk_cache_mb
+        super().__init__(parent_path, *args, **kwargs)
+
+    def find_files(self, parent_path):
+        with open(os.path.join(parent_path, f'{self.data_split}_manifest.json')) as f:
+            self.manifest = json.load(f)
+        shard_paths = [os.path.join(parent_path, shard['file']) for shard in self.manifest['shards']]
+        return shard_paths, shard_paths
+
+    def count_samples(self):
+        # the row counts are in the manifest, there is no need to open every shard
+        return [shard['num_rows'] for shard in self.manifest['shards']]
+
+    def open_file(self, path):
+        return h5py.File(path, 'r', rdcc_nbytes=self.chunk_cache_mb*1024**2, rdcc_nslots=10007)
+
+
+class climsim_shard_batch_sampler(Sampler):
+    """
+    Batch sampler over sharded data that keeps reads sequential but the epoch random.
+    Every epoch the shard order is shuffled (shard-shuffle). Consecutive shards are then grouped into windows
+    of shards_per_window shards, every shard is cut into blocks of block_size consecutive rows (ideally the
+    chunk size of the shards), and the blocks of a window are shuffled (block-shuffle) and concatenated
+    into batches. Every batch therefore reads batch_size/block_size whole chunks from at most
+    shards_per_window shards. Batches are sorted and yielded whole, to be used with
+    DataLoader(dataset, batch_size=None, sampler=climsim_shard_batch_sampler(...)).
+    """
+    def __init__(self,
+                 samples_per_shard,
+                 batch_size,
+                 block_size,
+                 shards_per_window=4,
+                 shuffle=True,
+                 drop_last=True,
+                 num_replicas=1,
+                 rank=0,
+                 seed=0):
+        """
+        Args:
+            samples_per_shard (list): Number of samples in every shard (climsim_dataset_shards.samples_per_file).
+            batch_size (int): Number of samples per batch.
+            block_size (int): Number of consecutive samples per block.
+            shards_per_window (int): Number of shards whose blocks are shuffled together.
+            shuffle (bool): Whether to shuffle every epoch.
+            drop_last (bool): Whether to drop the last incomplete batch.
+            num_replicas (int): Number of distributed processes.
+            rank (int): Rank of the current process.
+            seed (int): Random seed, combined with the epoch set by set_epoch.
+        """
+        self.samples_per_shard = list(samples_per_shard)
+        self.shard_offsets = np.cumsum([0] + self.samples_per_shard)
+        self.num_samples = int(self.shard_offsets[-1])
+        self.batch_size = batch_size
+        self.block_size = block_size
+        self.shards_per_window = shards_per_window
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.seed = seed
+        self.epoch = 0
+        if drop_last:
+            num_batches = self.num_samples // batch_size
+        else:
+            num_batches = -(-self.num_samples // batch_size)
+        # every rank gets the same number of batches
+        self.num_batches = num_batches // num_replicas
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __len__(self):
+        return self.num_batches
+
+    def _window_samples(self, rng):
+        """
+        Yield the sample indices of every window, in block-shuffled order.
+        """
+        num_shards = len(self.samples_per_shard)
+        shard_order = rng.permutation(num_shards) if self.shuffle else np.arange(num_shards)
+        for w in range(0, num_shards, self.shards_per_window):
+            blocks = []
+            for shard in shard_order[w:w+self.shards_per_window]:
+                start, stop = self.shard_offsets[shard], self.shard_offsets[shard+1]
+                blocks.extend(np.arange(start, stop)[i:i+self.block_size] for i in range(0, stop - start, self.block_size))
+            if self.shuffle:
+                blocks = [blocks[i] for i in rng.permutation(len(blocks))]
+            if blocks:
+                yield np.concatenate(blocks)
+
+    def __iter__(self):
+        rng = np.random.default_rng(self.seed + self.epoch)
+        batch_idx = 0
+        remainder = np.zeros(0, dtype=np.int64)
+        last_batch = self.num_batches * self.num_replicas
+        for samples in self._window_samples(rng):
+            samples = np.concatenate([remainder, samples])
+            num_full = len(samples) // self.batch_size
+            for b in range(num_full):
+                if batch_idx >= last_batch:
+                    return
+                if batch_idx % self.num_replicas == self.rank:
+                    yield np.sort(samples[b*self.batch_size:(b+1)*self.batch_size]).tolist()
+                batch_idx += 1
+            remainder = samples[num_full*self.batch_size:]
+        if len(remainder) > 0 and batch_idx < last_batch and batch_idx % self.num_replicas == self.rank:
+            yield np.sort(remainder).tolist()
@@ -0,0 +1,151 @@
+import torch
+import torch.nn as nn
+from climsim_layout_indices import compile_input_indices, compile_target_indices
+
+'''
+torch version of the input/target transforms of climsim_dataset and climsim_dataset_h5, applied to batched tensors
+on the device of the model. Used for training (datasets with return_raw=True) and inside the inference wrapper.
+'''
+
+class ClimsimInputTransform(nn.Module):
+    def __init__(self,
+                 input_sub,
+                 input_div,
+                 out_scale,
+                 qn_lbd,
+                 input_layout,
+                 target_layout,
+                 qinput_prune,
+                 output_prune,
+                 strato_lev,
+                 strato_lev_out,
+                 decouple_cloud=False,
+                 aggressive_pruning=False,
+                 strato_lev_qinput=-1,
+                 strato_lev_tinput=-1,
+                 input_clip=False,
+                 input_clip_rhonly=False,
+                 qn_logtransform=False):
+        """
+        Args:
+            input_sub (np.ndarray): Input data mean.
+            input_div (np.ndarray): Input data standard deviation.
+            out_scale (np.ndarray): Output data standard deviation.
+            qn_lbd (np.ndarray): Coefficients for the exponential transformation of qn.
+            input_layout (FeatureLayout): Layout of the input vector (data_utils.input_layout).
+            target_layout (FeatureLayout): Layout of the target vector (data_utils.target_layout).
+            qinput_prune (bool): Whether to prune the qn input in the stratosphere.
+            output_prune (bool): Whether to prune the output data.
+            strato_lev (int): Number of levels in the stratosphere.
+            strato_lev_out (int): Number of stratospheric levels pruned in the output.
+            The remaining arguments are the same as for climsim_dataset_h5.
+        """
+        super().__init__()
+        if strato_lev_qinput < 0:
+            strato_lev_qinput = strato_lev
+        if strato_lev_qinput < strato_lev:
+            raise ValueError('strato_lev_qinput should be greater than or equal to strato_lev, otherwise inconsistent with E3SM')
+        input_indices = compile_input_indices(input_layout, strato_lev, strato_lev_qinput, strato_lev_tinput)
+        target_indices = compile_target_indices(target_layout, strato_lev_out)
+
+        self.qn_exp_transform = not qn_logtransform
+        self.input_clip = input_clip
+        self.output_prune = output_prune
+
+        # every pruning step sets columns to 0, and 0 lies inside every clipping range, so they are merged into one index
+        prune_idx = [input_indices['tinput_prune']]
+        if decouple_cloud:
+            prune_idx.append(input_indices['decouple_cloud'])
+        if aggressive_pruning:
+            prune_idx.append(input_indices['aggressive_prune'])
+        elif qinput_prune:
+            prune_idx.append(input_indices['qinput_prune'])
+        prune_idx = sorted(set(int(i) for idx in prune_idx for i in idx))
+        if input_clip_rhonly:
+            clip_idx = input_indices['clip_rh']
+            clip_lower = [0.0] * len(clip_idx)
+            clip_upper = [1.2] * len(clip_idx)
+        else:
+            clip_idx = input_indices['clip']
+            clip_lower = input_indices['clip_lower']
+            clip_upper = input_indices['clip_upper']
+
+        self.register_buffer('input_sub', torch.as_tensor(input_sub, dtype=torch.float32))
+        self.register_buffer('input_div', torch.as_tensor(input_div, dtype=torch.float32))
+        self.register_buffer('out_scale', torch.as_tensor(out_scale, dtype=torch.float32))
+        self.register_buffer('qn_lbd', torch.as_tensor(qn_lbd, dtype=torch.float32))
+        self.register_buffer('qn_idx', torch.as_tensor(input_indices['qn'], dtype=torch.long))
+        self.register_buffer('prune_idx', torch.as_tensor(prune_idx, dtype=torch.long))
+        self.register_buffer('clip_idx', torch.as_tensor(clip_idx, dtype=torch.long))
+        self.register_buffer('clip_lower', torch.as_tensor(clip_lower, dtype=torch.float32))
+        self.register_buffer('clip_upper', torch.as_tensor(clip_upper, dtype=torch.float32))
+        self.register_buffer('output_prune_idx', torch.as_tensor(target_indices['output_prune'], dtype=torch.long))
+
+    @classmethod
+    def from_cfg(cls, cfg, input_sub, input_div, out_scale, qn_lbd, input_layout, target_layout):
+        '''
+        Build the transform from the hydra config of the training scripts.
+        '''
+        return cls(input_sub = input_sub,
+                   input_div = input_div,
+                   out_scale = out_scale,
+                   qn_lbd = qn_lbd,
+                   input_layout = input_layout,
+                   target_layout = target_layout,
+                   qinput_prune = cfg.qinput_prune,
+                   output_prune = cfg.output_prune,
+                   strato_lev = cfg.strato_lev,
+                   strato_lev_out = cfg.strato_lev_out,
+                   decouple_cloud = cfg.decouple_cloud,
+                   aggressive_pruning = cfg.aggressive_pruning,
+                   strato_lev_qinput = cfg.strato_lev_qinput,
+                   strato_lev_tinput = cfg.strato_lev_tinput,
+                   input_clip = cfg.input_clip,
+                   input_clip_rhonly = cfg.input_clip_rhonly,
+                   qn_logtransform = cfg.qn_logtransform)
+
+    @classmethod
+    def from_norm_bundle(cls, norm, **kwargs):
+        '''
+        Build the transform from a NormBundle (climsim_utils.norm_bundle), with the pruning and clipping options in kwargs.
+        '''
+        return cls(input_sub = norm.input_sub,
+                   input_div = norm.input_div,
+                   out_scale = norm.out_scale,
+                   qn_lbd = norm.qn_lbd,
+                   input_layout = norm.input_layout,
+                   target_layout = norm.target_layout,
+                   **kwargs)
+
+    def forward(self, x):
+        '''
+        Transform raw inputs of shape (batch, features) into normalized model inputs. x is not modified.
+        '''
+        if self.qn_exp_transform:
+            x = x.index_copy(-1, self.qn_idx, 1 - torch.exp(-x.index_select(-1, self.qn_idx) * self.qn_lbd))
+        x = (x - self.input_sub) / self.input_div
+        # make all inf and nan values 0
+        x = torch.nan_to_num(x, nan=0.0, posinf=0.0, neginf=0.0)
+        x = x.index_fill(-1, self.prune_idx, 0.0)
+        if self.input_clip:
+            x = x.index_copy(-1, self.clip_idx, torch.clamp(x.index_select(-1, self.clip_idx), self.clip_lower, self.clip_upper))
+        return x
+
+    @torch.jit.export
+    def transform_target(self, y):
+        '''
+        Scale raw targets of shape (batch, features) and prune the stratospheric output levels.
+        '''
+        y = y * self.out_scale
+        if self.output_prune:
+            y = y.index_fill(-1, self.output_prune_idx, 0.0)
+        return y
+
+    @torch.jit.export
+    def inverse_target(self, y):
+        '''
+        Convert scaled model outputs back to physical tendencies, pruning the stratospheric output levels.
+        '''
+        if self.output_prune:
+            y = y.index_fill(-1, self.output_prune_idx, 0.0)
+        return y / self.out_scale
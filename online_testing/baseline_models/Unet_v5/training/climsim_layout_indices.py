@@ -0,0 +1,66 @@
+import numpy as np
+
+'''
+index arrays used by the datapipes to transform the v5 inputs and targets, compiled once from the
+feature layouts of data_utils (data.input_layout and data.target_layout) instead of hard-coded offsets
+'''
+
+dyn_vars = ['state_t_dyn', 'state_q0_dyn', 'state_u_dyn',
+            'tm_state_t_dyn', 'tm_state_q0_dyn', 'tm_state_u_dyn']
+prvphy_vars = ['state_t_prvphy', 'state_q0001_prvphy', 'state_qn_prvphy', 'state_u_prvphy',
+               'tm_state_t_prvphy', 'tm_state_q0001_prvphy', 'tm_state_qn_prvphy', 'tm_state_u_prvphy']
+# profiles pruned above strato_lev_qinput (moisture) or strato_lev (everything else but temperature) under aggressive pruning
+moisture_prune_vars = ['state_rh', 'state_qn', 'state_q0001_prvphy', 'state_qn_prvphy',
+                       'tm_state_q0001_prvphy', 'tm_state_qn_prvphy']
+other_prune_vars = ['state_u', 'state_v', 'state_t_dyn', 'state_q0_dyn', 'state_u_dyn',
+                    'tm_state_t_dyn', 'tm_state_q0_dyn', 'tm_state_u_dyn',
+                    'state_t_prvphy', 'state_u_prvphy', 'tm_state_t_prvphy', 'tm_state_u_prvphy']
+decouple_cloud_vars = ['state_qn', 'state_qn_prvphy', 'tm_state_qn_prvphy']
+output_prune_vars = ['ptend_q0001', 'ptend_qn', 'ptend_u', 'ptend_v']
+
+def compile_input_indices(input_layout, strato_lev, strato_lev_qinput, strato_lev_tinput):
+    """
+    Compile the input column indices used by the v5 datapipes.
+
+    Parameters:
+    - input_layout (FeatureLayout): Layout of the input vector.
+    - strato_lev (int): Number of stratospheric levels pruned for non-moisture profiles.
+    - strato_lev_qinput (int): Number of stratospheric levels pruned for moisture profiles.
+    - strato_lev_tinput (int): Number of stratospheric levels pruned for temperature (<=0 for none).
+
+    Returns a dictionary of integer index arrays and the per-column clip bounds.
+    """
+    indices = {}
+    indices['t'] = input_layout.indices('state_t')
+    indices['qn'] = input_layout.indices('state_qn')
+    indices['decouple_cloud'] = input_layout.indices(decouple_cloud_vars)
+    indices['aggressive_prune'] = input_layout.indices([(var, slice(0, strato_lev_qinput)) for var in moisture_prune_vars] + \
+                                                       [(var, slice(0, strato_lev)) for var in other_prune_vars] + \
+                                                       ['cam_in_SNOWHICE'])
+    indices['qinput_prune'] = input_layout.indices(('state_qn', slice(0, strato_lev)))
+    tinput_levels = strato_lev_tinput if strato_lev_tinput is not None and strato_lev_tinput > 0 else 0
+    indices['tinput_prune'] = input_layout.indices(('state_t', slice(0, tinput_levels)))
+    indices['clip_rh'] = input_layout.indices('state_rh')
+    # rh is clipped to (0,1.2), dyn forcing to (-0.5,0.5) and phy tendencies to (-3,3)
+    clip_groups = [(['state_rh'], 0, 1.2), (dyn_vars, -0.5, 0.5), (prvphy_vars, -3, 3)]
+    indices['clip'] = input_layout.indices([var for group, _, _ in clip_groups for var in group])
+    clip_lower = np.empty(input_layout.feature_len)
+    clip_upper = np.empty(input_layout.feature_len)
+    for group, lower, upper in clip_groups:
+        clip_lower[input_layout.indices(group)] = lower
+        clip_upper[input_layout.indices(group)] = upper
+    indices['clip_lower'] = clip_lower[indices['clip']]
+    indices['clip_upper'] = clip_upper[indices['clip']]
+    return indices
+
+def compile_target_indices(target_layout, strato_lev_out):
+    """
+    Compile the target column indices used by the v5 datapipes.
+
+    Parameters:
+    - target_layout (FeatureLayout): Layout of the target vector.
+    - strato_lev_out (int): Number of stratospheric levels pruned for the output tendencies.
+
+    Returns a dictionary of integer index arrays.
+    """
+    return {'output_prune': target_layout.indices([(var, slice(0, strato_lev_out)) for var in output_prune_vars])}
@@ -1,10 +1,11 @@
 import torch
+from climsim_utils.pressure import calc_dp_torch
 
 '''
 a loss function that compares the column integrated mse tendencies between the model and the truth
 '''
 
-def loss_energy(pred, truth, ps, hyai, hybi, out_scale):
+def loss_energy(pred, truth, ps, hyai, hybi, out_scale, target_layout=None):
     """
     Compute the energy loss.
     
@@ -15,14 +16,8 @@ def loss_energy(pred, truth, ps, hyai, hybi, out_scale):
     - hyai (torch.Tensor): Coefficients for calculating pressure at layer interfaces for mass. Shape: (61).
     - hybi (torch.Tensor): Coefficients for calculating pressure at layer interfaces for mass. Shape: (61).
     - out_scale (float): Output scaling factor. shape: (368).
+    - target_layout (FeatureLayout): Layout of the target vector, used to locate ptend_t and ptend_q0001. Defaults to the first two profiles.
     """
-    #code for reference
-    # state_ps = np.reshape(state_ps, (-1, self.num_latlon))
-    # pressure_grid_p1 = np.array(self.grid_info['P0']*self.grid_info['hyai'])[:,np.newaxis,np.newaxis]
-    # pressure_grid_p2 = self.grid_info['hybi'].values[:, np.newaxis, np.newaxis] * state_ps[np.newaxis, :, :]
-    # self.pressure_grid_train = pressure_grid_p1 + pressure_grid_p2
-    # self.dp_train = self.pressure_grid_train[1:61,:,:] - self.pressure_grid_train[0:60,:,:]
-
     # convert out_scale to torch tensor if not
     if not torch.is_tensor(out_scale):
         out_scale = torch.tensor(out_scale, dtype=torch.float32)
@@ -38,17 +33,17 @@ def loss_energy(pred, truth, ps, hyai, hybi, out_scale):
     # L_S = L_V + L_I # Sublimation
     C_P = 1.00464e3 # Specific heat capacity of air at constant pressure
 
-    dt_pred = pred[:,0:60]/out_scale[0:60]
-    dt_truth = truth[:,0:60]/out_scale[0:60]
-    dq_pred = pred[:,60:120]/out_scale[60:120]
-    dq_truth = truth[:,60:120]/out_scale[60:120]
-
-    # calculate the pressure difference, make ps (batch_size, 1)
-    ps = ps.reshape(-1,1)
-    pressure_grid_p1 = 1e5 * hyai.reshape(1,-1) # (1, 61)
-    pressure_grid_p2 = hybi.reshape(1,-1) * ps # (batch_size, 61)
-    pressure_grid = pressure_grid_p1 + pressure_grid_p2 # (batch_size, 61)
-    dp = pressure_grid[:,1:] - pressure_grid[:,:-1] # (batch_size, 60)
+    if target_layout is None:
+        t_slice, q_slice = slice(0, 60), slice(60, 120)
+    else:
+        t_slice, q_slice = target_layout.slice('ptend_t'), target_layout.slice('ptend_q0001')
+    dt_pred = pred[:,t_slice]/out_scale[t_slice]
+    dt_truth = truth[:,t_slice]/out_scale[t_slice]
+    dq_pred = pred[:,q_slice]/out_scale[q_slice]
+    dq_truth = truth[:,q_slice]/out_scale[q_slice]
+
+    # calculate the pressure difference, same as data_utils.set_pressure_grid
+    dp = calc_dp_torch(ps.reshape(-1), hyai, hybi) # (batch_size, 60)
 
     # calculate the integrated tendency
     dt_integrated_pred = torch.sum(dt_pred * dp, dim=1) # (batch_size)
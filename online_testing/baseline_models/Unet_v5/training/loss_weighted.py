@@ -0,0 +1,93 @@
+import torch
+import torch.nn as nn
+
+'''
+weighted mse/mae/huber loss of the training scripts. The per-variable weights of the config (dt_weight, ..., d2d_weight)
+and the output pruning are folded into one per-column weight vector, built once from the target layout, so the loss is
+one expression of (pred - target) * weight instead of scaling slices of pred and target in place on every step
+'''
+
+# config weight of every target variable, the scalar targets use d2d_weight
+target_weight_names = {'ptend_t': 'dt_weight',
+                       'ptend_q0001': 'dq1_weight',
+                       'ptend_q0002': 'dq2_weight',
+                       'ptend_qn': 'dq2_weight',
+                       'ptend_q0003': 'dq3_weight',
+                       'ptend_u': 'du_weight',
+                       'ptend_v': 'dv_weight'}
+scalar_weight_name = 'd2d_weight'
+
+class WeightedLoss(nn.Module):
+    def __init__(self,
+                 target_layout,
+                 loss='mse',
+                 weights=None,
+                 output_prune_idx=None,
+                 huber_delta=1.0):
+        """
+        Args:
+            target_layout (FeatureLayout): Layout of the target vector (data_utils.target_layout).
+            loss (str): 'mse', 'mae' or 'huber' (nn.SmoothL1Loss with beta = huber_delta).
+            weights (dict): Config weights by name (e.g. {'dt_weight': 2.0}), missing weights are 1.0.
+            output_prune_idx (array): Pruned target columns (compile_target_indices(...)['output_prune']),
+                which get weight 0. Both the model output and the target are 0 there, so this does not change the loss.
+            huber_delta (float): Transition point between the quadratic and linear part of the huber loss.
+        """
+        super().__init__()
+        if loss not in ['mse', 'mae', 'huber']:
+            raise ValueError('Loss function not implemented')
+        weights = {} if weights is None else dict(weights)
+        self.loss = loss
+        self.huber_delta = huber_delta
+        self.var_names = list(target_layout.var_list)
+
+        column_weight = torch.ones(target_layout.feature_len)
+        # (features, variables) matrix that sums the per-column losses of every variable, divided by the number of columns
+        var_fraction = torch.zeros(target_layout.feature_len, len(self.var_names))
+        for i, var in enumerate(self.var_names):
+            idx = torch.as_tensor(target_layout.indices(var), dtype=torch.long)
+            column_weight[idx] = float(weights.get(target_weight_names.get(var, scalar_weight_name), 1.0))
+            var_fraction[idx, i] = 1.0 / target_layout.feature_len
+        if output_prune_idx is not None:
+            column_weight[torch.as_tensor(output_prune_idx, dtype=torch.long)] = 0.0
+        self.weighted = bool(torch.any(column_weight != 1.0))
+        self.register_buffer('column_weight', column_weight)
+        self.register_buffer('var_fraction', var_fraction)
+
+    @classmethod
+    def from_cfg(cls, cfg, target_layout, output_prune_idx=None):
+        '''
+        Build the loss from the hydra config of the training scripts.
+        '''
+        weights = {name: cfg[name] for name in set(target_weight_names.values()) | {scalar_weight_name} if name in cfg}
+        return cls(target_layout = target_layout,
+                   loss = cfg.loss,
+                   weights = weights,
+                   output_prune_idx = output_prune_idx if cfg.output_prune else None)
+
+    def forward(self, pred, target, return_partials=False):
+        '''
+        Loss of pred and target of shape (batch, features), averaged over all elements like nn.MSELoss, nn.L1Loss
+        and nn.SmoothL1Loss of the weighted pred and target. pred and target are not modified.
+        With return_partials, also returns the (variables,) contributions of every variable in var_names, which sum to the loss.
+        '''
+        error = pred - target
+        if self.weighted:
+            error = error * self.column_weight
+        if self.loss == 'mse':
+            error = error.square()
+        elif self.loss == 'mae':
+            error = error.abs()
+        else:
+            abs_error = error.abs()
+            error = torch.where(abs_error < self.huber_delta, 0.5 * error.square() / self.huber_delta, abs_error - 0.5 * self.huber_delta)
+        if not return_partials:
+            return error.mean()
+        partials = error.mean(dim=0) @ self.var_fraction
+        return partials.sum(), partials
+
+    def partials_dict(self, partials, prefix=''):
+        '''
+        Returns the partial losses of forward(..., return_partials=True) as a {prefix + variable: float} dictionary for logging.
+        '''
+        return {prefix + var: value for var, value in zip(self.var_names, partials.tolist())}
@@ -8,6 +8,8 @@ from dataclasses import dataclass
 import modulus
 from modulus.metrics.general.mse import mse
 from loss_energy import loss_energy
+from loss_weighted import WeightedLoss
+from climsim_utils.norm_bundle import NormBundle
 from modulus.utils import StaticCaptureTraining, StaticCaptureEvaluateNoGrad
 from omegaconf import DictConfig
 from modulus.launch.logging import (
@@ -19,7 +21,10 @@ from modulus.launch.logging import (
 )
 from climsim_utils.data_utils import *
 from climsim_datapip import climsim_dataset
-from climsim_datapip_h5 import climsim_dataset_h5
+from climsim_datapip_h5 import climsim_dataset_h5, climsim_block_batch_sampler, climsim_file_batch_sampler
+from climsim_input_transform import ClimsimInputTransform
+from climsim_layout_indices import compile_target_indices
+from climsim_datapip_shards import climsim_dataset_shards, climsim_shard_batch_sampler
 from climsim_unet import ClimsimUnet
 import climsim_unet as climsim_unet
 import hydra
@@ -34,49 +39,58 @@ def main(cfg: DictConfig) -> float:
     DistributedManager.initialize()
     dist = DistributedManager()
 
-    grid_path = cfg.climsim_path+'/grid_info/ClimSim_low-res_grid-info.nc'
     norm_path = cfg.climsim_path+'/preprocessing/normalizations/'
-    grid_info = xr.open_dataset(grid_path)
-    input_mean = xr.open_dataset(norm_path + cfg.input_mean)
-    input_max = xr.open_dataset(norm_path + cfg.input_max)
-    input_min = xr.open_dataset(norm_path + cfg.input_min)
-    output_scale = xr.open_dataset(norm_path + cfg.output_scale)
-    # qc_lbd = xr.open_dataset(norm_path + cfg.qc_lbd)
-    # qi_lbd = xr.open_dataset(norm_path + cfg.qi_lbd)
-
-    # lbd_qc = np.loadtxt(norm_path + cfg.qc_lbd, delimiter=',')
-    # lbd_qi = np.loadtxt(norm_path + cfg.qi_lbd, delimiter=',')
-
-    lbd_qn = np.loadtxt(norm_path + cfg.qn_lbd, delimiter=',')
-
-    data = data_utils(grid_info = grid_info, 
-                  input_mean = input_mean, 
-                  input_max = input_max, 
-                  input_min = input_min, 
-                  output_scale = output_scale)
-
-    # set variables to subset
-    if cfg.variable_subsets == 'v1': 
-        data.set_to_v1_vars()
-    elif cfg.variable_subsets == 'v1_dyn':
-        data.set_to_v1_dyn_vars()
-    elif cfg.variable_subsets == 'v2':
-        data.set_to_v2_vars()
-    elif cfg.variable_subsets == 'v2_dyn':
-        data.set_to_v2_dyn_vars()
-    elif cfg.variable_subsets == 'v3':
-        data.set_to_v3_vars()
-    elif cfg.variable_subsets == 'v4':
-        data.set_to_v4_vars()
-    elif cfg.variable_subsets == 'v5':
-        data.set_to_v5_vars()
+    if len(cfg.norm_bundle) > 0:
+        # compiled once with data_utils.save_norm_bundle (or python -m climsim_utils.norm_bundle)
+        norm = NormBundle.load(norm_path + cfg.norm_bundle)
+        if norm.variable_subset != cfg.variable_subsets:
+            raise ValueError(f'Normalization bundle is for variable subset {norm.variable_subset}, not {cfg.variable_subsets}')
     else:
-        raise ValueError('Unknown variable subset')
+        grid_path = cfg.climsim_path+'/grid_info/ClimSim_low-res_grid-info.nc'
+        grid_info = xr.open_dataset(grid_path)
+        input_mean = xr.open_dataset(norm_path + cfg.input_mean)
+        input_max = xr.open_dataset(norm_path + cfg.input_max)
+        input_min = xr.open_dataset(norm_path + cfg.input_min)
+        output_scale = xr.open_dataset(norm_path + cfg.output_scale)
+        # qc_lbd = xr.open_dataset(norm_path + cfg.qc_lbd)
+        # qi_lbd = xr.open_dataset(norm_path + cfg.qi_lbd)
+
+        # lbd_qc = np.loadtxt(norm_path + cfg.qc_lbd, delimiter=',')
+        # lbd_qi = np.loadtxt(norm_path + cfg.qi_lbd, delimiter=',')
+
+        lbd_qn = np.loadtxt(norm_path + cfg.qn_lbd, delimiter=',')
+
+        data = data_utils(grid_info = grid_info, 
+                      input_mean = input_mean, 
+                      input_max = input_max, 
+                      input_min = input_min, 
+                      output_scale = output_scale)
+
+        # set variables to subset
+        if cfg.variable_subsets == 'v1': 
+            data.set_to_v1_vars()
+        elif cfg.variable_subsets == 'v1_dyn':
+            data.set_to_v1_dyn_vars()
+        elif cfg.variable_subsets == 'v2':
+            data.set_to_v2_vars()
+        elif cfg.variable_subsets == 'v2_dyn':
+            data.set_to_v2_dyn_vars()
+        elif cfg.variable_subsets == 'v3':
+            data.set_to_v3_vars()
+        elif cfg.variable_subsets == 'v4':
+            data.set_to_v4_vars()
+        elif cfg.variable_subsets == 'v5':
+            data.set_to_v5_vars()
+        else:
+            raise ValueError('Unknown variable subset')
+        norm = NormBundle.from_data_utils(data, qn_lbd = lbd_qn, variable_subset = cfg.variable_subsets)
 
-    input_size = data.input_feature_len
-    output_size = data.target_feature_len
+    input_size = norm.input_layout.feature_len
+    output_size = norm.target_layout.feature_len
 
-    input_sub, input_div, out_scale = data.save_norm(write=False)
+    input_sub, input_div, out_scale = norm.input_sub, norm.input_div, norm.out_scale
+    lbd_qn = norm.qn_lbd
+    ps_index = norm.ps_index
 
 
     val_input_path = cfg.data_path + cfg.val_input
@@ -95,12 +109,17 @@ def main(cfg: DictConfig) -> float:
                                   strato_lev = cfg.strato_lev, 
                                   strato_lev_out = cfg.strato_lev_out, 
                                   qn_lbd = lbd_qn, 
+                                  input_layout = norm.input_layout, 
+                                  target_layout = norm.target_layout, 
                                   decouple_cloud = cfg.decouple_cloud, 
                                   aggressive_pruning = cfg.aggressive_pruning, 
                                   strato_lev_qinput = cfg.strato_lev_qinput, 
                                   strato_lev_tinput = cfg.strato_lev_tinput, 
                                   input_clip = cfg.input_clip, 
-                                  input_clip_rhonly = cfg.input_clip_rhonly)
+                                  input_clip_rhonly = cfg.input_clip_rhonly, 
+                                  qn_logtransform = cfg.qn_logtransform, 
+                                  return_raw = cfg.gpu_input_transform, 
+                                  mmap_mode = cfg.val_mmap_mode)
     #train_sampler = DistributedSampler(train_dataset) if dist.distributed else None
     val_sampler = DistributedSampler(val_dataset, shuffle=False) if dist.distributed else None
     val_loader = DataLoader(val_dataset, 
@@ -113,31 +132,73 @@ def main(cfg: DictConfig) -> float:
     #                                 input_sub, input_div, out_scale, cfg.qinput_prune, cfg.output_prune, \
     #                                     cfg.strato_lev, lbd_qc, lbd_qi, cfg.decouple_cloud, cfg.aggressive_pruning, \
     #                                         cfg.strato_lev_qc, cfg.strato_lev_qinput, cfg.strato_lev_tinput, cfg.input_clip, cfg.input_clip_rhonly)
-    train_dataset = climsim_dataset_h5(parent_path = cfg.data_path, 
-                                    input_sub = input_sub, 
-                                    input_div = input_div, 
-                                    out_scale = out_scale, 
-                                    qinput_prune = cfg.qinput_prune, 
-                                    output_prune = cfg.output_prune, 
-                                    strato_lev = cfg.strato_lev, 
-                                    strato_lev_out = cfg.strato_lev_out, 
-                                    qn_lbd = lbd_qn, 
-                                    decouple_cloud = cfg.decouple_cloud, 
-                                    aggressive_pruning = cfg.aggressive_pruning, 
-                                    strato_lev_qinput = cfg.strato_lev_qinput, 
-                                    strato_lev_tinput = cfg.strato_lev_tinput, 
-                                    input_clip = cfg.input_clip, 
-                                    input_clip_rhonly = cfg.input_clip_rhonly)
-
-    train_sampler = DistributedSampler(train_dataset) if dist.distributed else None
+    train_dataset_class = climsim_dataset_shards if cfg.shard_data else climsim_dataset_h5
+    train_dataset = train_dataset_class(parent_path = cfg.data_path, 
+                                        input_sub = input_sub, 
+                                        input_div = input_div, 
+                                        out_scale = out_scale, 
+                                        qinput_prune = cfg.qinput_prune, 
+                                        output_prune = cfg.output_prune, 
+                                        strato_lev = cfg.strato_lev, 
+                                        strato_lev_out = cfg.strato_lev_out, 
+                                        qn_lbd = lbd_qn, 
+                                        input_layout = norm.input_layout, 
+                                        target_layout = norm.target_layout, 
+                                        decouple_cloud = cfg.decouple_cloud, 
+                                        aggressive_pruning = cfg.aggressive_pruning, 
+                                        strato_lev_qinput = cfg.strato_lev_qinput, 
+                                        strato_lev_tinput = cfg.strato_lev_tinput, 
+                                        input_clip = cfg.input_clip, 
+                                        input_clip_rhonly = cfg.input_clip_rhonly, 
+                                        qn_logtransform = cfg.qn_logtransform, 
+                                        return_raw = cfg.gpu_input_transform, 
+                                        max_open_files = cfg.max_open_files, 
+                                        manifest_path = cfg.h5_manifest if cfg.h5_manifest else None)
+
+    if cfg.shard_data or cfg.block_batch_sampler or cfg.file_batch_sampler:
+        # whole batches are read and transformed at once by the dataset, so no automatic batching in the DataLoader
+        if cfg.file_batch_sampler:
+            train_sampler = climsim_file_batch_sampler(samples_per_file = train_dataset.samples_per_file, 
+                                                       batch_size = cfg.batch_size, 
+                                                       num_workers = cfg.num_workers, 
+                                                       range_size = cfg.file_range_size, 
+                                                       block_size = train_dataset.manifest['chunk_rows'] if cfg.shard_data else cfg.file_block_size, 
+                                                       shuffle = True, 
+                                                       drop_last = True, 
+                                                       num_replicas = dist.world_size, 
+                                                       rank = dist.rank)
+        elif cfg.shard_data:
+            train_sampler = climsim_shard_batch_sampler(samples_per_shard = train_dataset.samples_per_file, 
+                                                        batch_size = cfg.batch_size, 
+                                                        block_size = train_dataset.manifest['chunk_rows'], 
+                                                        shards_per_window = cfg.shards_per_window, 
+                                                        shuffle = True, 
+                                                        drop_last = True, 
+                                                        num_replicas = dist.world_size, 
+                                                        rank = dist.rank)
+        else:
+            train_sampler = climsim_block_batch_sampler(num_samples = len(train_dataset), 
+                                                        batch_size = cfg.batch_size, 
+                                                        shuffle = True, 
+                                                        drop_last = True, 
+                                                        contiguous = cfg.block_batch_contiguous, 
+                                                        num_replicas = dist.world_size, 
+                                                        rank = dist.rank)
+        train_loader = DataLoader(train_dataset, 
+                                    batch_size=None, 
+                                    sampler=train_sampler,
+                                    pin_memory=torch.cuda.is_available(),
+                                    num_workers=cfg.num_workers)
+    else:
+        train_sampler = DistributedSampler(train_dataset) if dist.distributed else None
     
-    train_loader = DataLoader(train_dataset, 
-                                batch_size=cfg.batch_size, 
-                                shuffle=False if dist.distributed else True,
-                                sampler=train_sampler,
-                                drop_last=True,
-                                pin_memory=torch.cuda.is_available(),
-                                num_workers=cfg.num_workers)
+        train_loader = DataLoader(train_dataset, 
+                                    batch_size=cfg.batch_size, 
+                                    shuffle=False if dist.distributed else True,
+                                    sampler=train_sampler,
+                                    drop_last=True,
+                                    pin_memory=torch.cuda.is_available(),
+                                    num_workers=cfg.num_workers)
 
     # create model
     device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
@@ -221,51 +282,9 @@ def main(cfg: DictConfig) -> float:
     else:
         raise ValueError('Scheduler not implemented')
     
-    # create loss function
-    if cfg.loss == 'mse':
-        loss_fn = mse
-        criterion = nn.MSELoss()
-    elif cfg.loss == 'mae':
-        loss_fn = nn.L1Loss()
-        criterion = nn.L1Loss()
-    elif cfg.loss == 'huber':
-        loss_fn = nn.SmoothL1Loss()
-        criterion = nn.SmoothL1Loss()
-    else:
-        raise ValueError('Loss function not implemented')
-    
-    def loss_weighted(pred, target):
-        if cfg.variable_subsets in ['v1','v1_dyn']:
-            raise ValueError('Weighted loss not implemented for v1/v1_dyn')
-        # dt_weight = 1.0
-        # dq1_weight = 1.0
-        # dq2_weight = 1.0
-        # dq3_weight = 1.0
-        # du_weight = 1.0
-        # dv_weight = 1.0
-        # d2d_weight = 1.0
-
-        # pred should be of shape (batch_size, 368)
-        # target should be of shape (batch_size, 368)
-        # 0-60: dt, 60-120 dq1, 120-180 dq2, 180-240 dq3, 240-300 du, 300-360 dv, 360-368 d2d
-        #only do the calculation if any of the weights are not 1.0
-        if cfg.dt_weight == 1.0 and cfg.dq1_weight == 1.0 and cfg.dq2_weight == 1.0 and cfg.dq3_weight == 1.0 and cfg.du_weight == 1.0 and cfg.dv_weight == 1.0 and cfg.d2d_weight == 1.0:
-            return criterion(pred, target)
-        pred[:,0:60] = pred[:,0:60] * cfg.dt_weight
-        pred[:,60:120] = pred[:,60:120] * cfg.dq1_weight
-        pred[:,120:180] = pred[:,120:180] * cfg.dq2_weight
-        pred[:,180:240] = pred[:,180:240] * cfg.dq3_weight
-        pred[:,240:300] = pred[:,240:300] * cfg.du_weight
-        pred[:,300:360] = pred[:,300:360] * cfg.dv_weight
-        pred[:,360:368] = pred[:,360:368] * cfg.d2d_weight
-        target[:,0:60] = target[:,0:60] * cfg.dt_weight
-        target[:,60:120] = target[:,60:120] * cfg.dq1_weight
-        target[:,120:180] = target[:,120:180] * cfg.dq2_weight
-        target[:,180:240] = target[:,180:240] * cfg.dq3_weight
-        target[:,240:300] = target[:,240:300] * cfg.du_weight
-        target[:,300:360] = target[:,300:360] * cfg.dv_weight
-        target[:,360:368] = target[:,360:368] * cfg.d2d_weight
-        return criterion(pred, target)
+    # create loss function, with the per-variable weights and the output pruning folded into one column weight vector
+    loss_weighted = WeightedLoss.from_cfg(cfg, norm.target_layout, 
+                                          compile_target_indices(norm.target_layout, cfg.strato_lev_out)['output_prune']).to(dist.device)
 
     
     # Initialize the console logger
@@ -318,14 +337,18 @@ def main(cfg: DictConfig) -> float:
         torch.distributed.barrier()
       
 
-    hyai = data.grid_info['hyai'].values
-    hybi = data.grid_info['hybi'].values
+    hyai = norm.hyai
+    hybi = norm.hybi
     hyai = torch.tensor(hyai, dtype=torch.float32).to(device)
     hybi = torch.tensor(hybi, dtype=torch.float32).to(device)
     # input_sub, input_div, out_scale = data.save_norm(write=False)
     input_sub_device = torch.tensor(input_sub, dtype=torch.float32).to(device)
     input_div_device = torch.tensor(input_div, dtype=torch.float32).to(device)
     out_scale_device = torch.tensor(out_scale, dtype=torch.float32).to(device)
+    if cfg.gpu_input_transform:
+        # the datasets return raw rows, normalization, pruning and clipping are done on the device
+        input_transform = ClimsimInputTransform.from_cfg(cfg, input_sub, input_div, out_scale, lbd_qn, 
+                                                         norm.input_layout, norm.target_layout).to(device)
 
     @StaticCaptureTraining(
         model=model,
@@ -337,8 +360,8 @@ def main(cfg: DictConfig) -> float:
         # loss = mse(predvar, outvar)
         output = model(data_input)
         if cfg.do_energy_loss:
-            ps_raw = data_input[:,1500]*input_div[1500]+input_sub[1500]
-            loss_energy_train = loss_energy(output, target, ps_raw, hyai, hybi, out_scale_device)*cfg.energy_loss_weight
+            ps_raw = data_input[:,ps_index]*input_div[ps_index]+input_sub[ps_index]
+            loss_energy_train = loss_energy(output, target, ps_raw, hyai, hybi, out_scale_device, norm.target_layout)*cfg.energy_loss_weight
             loss_orig = loss_weighted(output, target)
             loss = loss_orig + loss_energy_train
         else:
@@ -353,7 +376,7 @@ def main(cfg: DictConfig) -> float:
     logger0.info("Starting Training!")
     # Basic training block with tqdm for progress tracking
     for epoch in range(cfg.epochs):
-        if dist.distributed:
+        if dist.distributed or cfg.block_batch_sampler or cfg.shard_data or cfg.file_batch_sampler:
             train_sampler.set_epoch(epoch)
 
         with LaunchLogger("train", epoch=epoch, mini_batch_log_freq=10) as launchlog:
@@ -370,11 +393,13 @@ def main(cfg: DictConfig) -> float:
                 #     target[:,120:120+cfg.strato_lev] = 0
                 #     target[:,180:180+cfg.strato_lev] = 0
                 data_input, target = data_input.to(device), target.to(device)
+                if cfg.gpu_input_transform:
+                    data_input, target = input_transform(data_input), input_transform.transform_target(target)
                 #optimizer.zero_grad()
                 # output = model(data_input)
                 # if cfg.do_energy_loss:
-                #     ps_raw = data_input[:,1500]*input_div[1500]+input_sub[1500]
-                #     loss_energy_train = loss_energy(output, target, ps_raw, hyai, hybi, out_scale_device)*cfg.energy_loss_weight
+                #     ps_raw = data_input[:,ps_index]*input_div[ps_index]+input_sub[ps_index]
+                #     loss_energy_train = loss_energy(output, target, ps_raw, hyai, hybi, out_scale_device, norm.target_layout)*cfg.energy_loss_weight
                 #     loss_orig = loss_weighted(output, target)
                 #     loss = loss_orig + loss_energy_train
                 # else:
@@ -420,6 +445,8 @@ def main(cfg: DictConfig) -> float:
             if cfg.do_energy_loss:
                 val_energy_loss = 0.0
                 val_orig = 0.0
+            if cfg.log_loss_partials:
+                val_partials = torch.zeros(len(loss_weighted.var_names), device=device)
             num_samples_processed = 0
             val_loop = tqdm(val_loader, desc=f'Epoch {epoch+1}/1 [Validation]')
             current_step = 0
@@ -433,15 +460,22 @@ def main(cfg: DictConfig) -> float:
                 #     target[:,180:180+cfg.strato_lev] = 0
                 # Move data to the device
                 data_input, target = data_input.to(device), target.to(device)
+                if cfg.gpu_input_transform:
+                    data_input, target = input_transform(data_input), input_transform.transform_target(target)
 
                 output = eval_step_forward(model, data_input)
-                if cfg.do_energy_loss:
-                    ps_raw = data_input[:,1500]*input_div[1500]+input_sub[1500]
-                    loss_energy_train = loss_energy(output, target, ps_raw, hyai, hybi, out_scale_device)*cfg.energy_loss_weight
+                if cfg.log_loss_partials:
+                    # per-variable contributions to the loss, from the same reduction as the loss
+                    loss_orig, partials = loss_weighted(output, target, return_partials=True)
+                    val_partials = val_partials + partials * data_input.size(0)
+                else:
                     loss_orig = loss_weighted(output, target)
+                if cfg.do_energy_loss:
+                    ps_raw = data_input[:,ps_index]*input_div[ps_index]+input_sub[ps_index]
+                    loss_energy_train = loss_energy(output, target, ps_raw, hyai, hybi, out_scale_device, norm.target_layout)*cfg.energy_loss_weight
                     loss = loss_orig + loss_energy_train
                 else:
-                    loss = loss_weighted(output, target)
+                    loss = loss_orig
                 val_loss += loss.item() * data_input.size(0)
                 num_samples_processed += data_input.size(0)
 
@@ -463,12 +497,19 @@ def main(cfg: DictConfig) -> float:
                 current_val_loss_avg = torch.tensor(current_val_loss_avg, device=dist.device)
                 torch.distributed.all_reduce(current_val_loss_avg)
                 current_val_loss_avg = current_val_loss_avg.item() / dist.world_size
+            if cfg.log_loss_partials:
+                val_partials = val_partials / num_samples_processed
+                if dist.world_size > 1:
+                    torch.distributed.all_reduce(val_partials)
+                    val_partials = val_partials / dist.world_size
 
             if dist.rank == 0:
                 if cfg.do_energy_loss:
                     launchlog.log_epoch({"loss_valid": current_val_loss_avg, "loss_energy_valid": current_val_loss_avg_energy, "loss_orig_valid": current_val_loss_avg_orig})
                 else:
                     launchlog.log_epoch({"loss_valid": current_val_loss_avg})
+                if cfg.log_loss_partials:
+                    launchlog.log_epoch(loss_weighted.partials_dict(val_partials, prefix="loss_valid_"))
 
                 current_metric = current_val_loss_avg
                 # Save the top checkpoints
@@ -523,8 +564,9 @@ def main(cfg: DictConfig) -> float:
         scripted_model = scripted_model.eval()
         save_file_torch = os.path.join(save_path, 'model.pt')
         scripted_model.save(save_file_torch)
-        # save input and output normalizations
-        data.save_norm(save_path, True)
+        # save input and output normalizations, and the bundle for the inference wrappers
+        norm.save_norm(save_path)
+        norm.save(os.path.join(save_path, 'norm_bundle.npz'))
         logger0.info("saved input/output normalizations and model to: " + save_path)
 
         mdlus_directory = os.path.join(save_path, 'ckpt')
@@ -1,37 +1,41 @@
 import os
 import glob
+import multiprocessing as mp
+from collections import deque
 import xarray as xr
 import numpy as np
 
-def process_one_file(args):
+# variables added by add_input_features
+NEW_VARS = ['tm_state_t', 'tm_state_q0001', 'tm_state_q0002', 'tm_state_q0003', 'tm_state_u', 'tm_state_v',
+            'state_t_prvphy', 'state_q0001_prvphy', 'state_q0002_prvphy', 'state_q0003_prvphy', 'state_u_prvphy',
+            'tm_state_t_prvphy', 'tm_state_q0001_prvphy', 'tm_state_q0002_prvphy', 'tm_state_q0003_prvphy', 'tm_state_u_prvphy',
+            'state_t_dyn', 'state_q0_dyn', 'state_u_dyn', 'tm_state_t_dyn', 'tm_state_q0_dyn', 'tm_state_u_dyn',
+            'tm_state_ps', 'tm_pbuf_SOLIN', 'tm_pbuf_SHFLX', 'tm_pbuf_LHFLX', 'tm_pbuf_COSZRS']
+GRID_VARS = ['lat', 'lon', 'clat', 'slat', 'icol']
+# variables of the previous timesteps used by add_input_features
+PREV_INPUT_VARS = ['state_t', 'state_q0001', 'state_q0002', 'state_q0003', 'state_u', 'state_v',
+                   'state_ps', 'pbuf_SOLIN', 'pbuf_SHFLX', 'pbuf_LHFLX', 'pbuf_COSZRS']
+PREV_OUTPUT_VARS = ['state_t', 'state_q0001', 'state_q0002', 'state_q0003', 'state_u']
+
+def add_input_features(dsin, dsin_prev, dsin_prev2, dsout_prev, dsout_prev2, lat, lon):
     """
-    Process a single NetCDF file by updating its dataset with information from previous files.
-    
+    Add the features of the previous two timesteps (NEW_VARS) and the grid variables (GRID_VARS) to dsin.
+
     Args:
-        i: int
-            The index of the current file in the full file list.
-        nc_files_in: list of str
-            List of the full filenames.
+        dsin: xarray.Dataset
+            Input dataset of the current timestep, updated in place.
+        dsin_prev, dsin_prev2: xarray.Dataset
+            Input datasets of the previous and second previous timesteps.
+        dsout_prev, dsout_prev2: xarray.Dataset
+            Output datasets of the previous and second previous timesteps.
         lat: xarray.DataArray
             DataArray of latitude.
         lon: xarray.DataArray
             DataArray of longitude.
-        input_abbrev: str
-            The input file name abbreviation, the default input data should be 'mli'.
-        output_abbrev: str
-            The output file name abbreviation, the default output data should be 'mlo'.
-        input_abbrev_new: str
-            The abbreviation for the new input file name.
-    
+
     Returns:
-        None
+        dsin
     """
-    i, nc_files_in, lat, lon, input_abbrev, output_abbrev, input_abbrev_new = args
-    dsin = xr.open_dataset(nc_files_in[i])
-    dsin_prev = xr.open_dataset(nc_files_in[i-1])
-    dsin_prev2 = xr.open_dataset(nc_files_in[i-2])
-    dsout_prev = xr.open_dataset(nc_files_in[i-1].replace(input_abbrev, output_abbrev))
-    dsout_prev2 = xr.open_dataset(nc_files_in[i-2].replace(input_abbrev, output_abbrev))
     dsin['tm_state_t'] = dsin_prev['state_t']
     dsin['tm_state_q0001'] = dsin_prev['state_q0001']
     dsin['tm_state_q0002'] = dsin_prev['state_q0002']
@@ -77,7 +81,115 @@ def process_one_file(args):
     dsin['slat'] = slat
     dsin['icol'] = icol
 
+    return dsin
+
+def process_one_file(args):
+    """
+    Process a single NetCDF file by updating its dataset with information from previous files.
+    
+    Args:
+        i: int
+            The index of the current file in the full file list.
+        nc_files_in: list of str
+            List of the full filenames.
+        lat: xarray.DataArray
+            DataArray of latitude.
+        lon: xarray.DataArray
+            DataArray of longitude.
+        input_abbrev: str
+            The input file name abbreviation, the default input data should be 'mli'.
+        output_abbrev: str
+            The output file name abbreviation, the default output data should be 'mlo'.
+        input_abbrev_new: str
+            The abbreviation for the new input file name.
+    
+    Returns:
+        None
+    """
+    i, nc_files_in, lat, lon, input_abbrev, output_abbrev, input_abbrev_new = args
+    dsin = xr.open_dataset(nc_files_in[i])
+    dsin_prev = xr.open_dataset(nc_files_in[i-1])
+    dsin_prev2 = xr.open_dataset(nc_files_in[i-2])
+    dsout_prev = xr.open_dataset(nc_files_in[i-1].replace(input_abbrev, output_abbrev))
+    dsout_prev2 = xr.open_dataset(nc_files_in[i-2].replace(input_abbrev, output_abbrev))
+    add_input_features(dsin, dsin_prev, dsin_prev2, dsout_prev, dsout_prev2, lat, lon)
+
     new_file_path = nc_files_in[i].replace(input_abbrev, input_abbrev_new)
     dsin.to_netcdf(new_file_path)
 
-    return None
\ No newline at end of file
+    return None
+
+def load_vars(path, var_names = None):
+    """
+    Read var_names (all variables if None) of a NetCDF file into memory and close the file.
+    """
+    with xr.open_dataset(path) as ds:
+        if var_names is not None:
+            ds = ds[var_names]
+        return ds.load()
+
+def process_file_range(args):
+    """
+    Process the files start to stop-1 of the file list in time order, the same as process_one_file for each of them.
+    The input and output variables needed from the previous two timesteps are kept in a rolling cache, so every
+    mli and mlo file is read once instead of up to five times. The range is preceded by a two-step overlap
+    (files start-2 and start-1) that is read but not written.
+
+    Args:
+        start, stop: int
+            Range of indices of the files to process, start must be at least 2.
+        nc_files_in, lat, lon, input_abbrev, output_abbrev, input_abbrev_new:
+            The same as for process_one_file.
+        sidecar: bool
+            If True, only NEW_VARS and GRID_VARS are written to the new files, which then complement the
+            original input files instead of replacing them.
+
+    Returns:
+        None
+    """
+    start, stop, nc_files_in, lat, lon, input_abbrev, output_abbrev, input_abbrev_new, sidecar = args
+    assert start >= 2, 'The first two files have no previous timesteps.'
+    # (input, output) of timesteps i-2 and i-1
+    history = deque(maxlen = 2)
+    for j in [start - 2, start - 1]:
+        history.append((load_vars(nc_files_in[j], PREV_INPUT_VARS),
+                        load_vars(nc_files_in[j].replace(input_abbrev, output_abbrev), PREV_OUTPUT_VARS)))
+    for i in range(start, stop):
+        dsin = load_vars(nc_files_in[i], PREV_INPUT_VARS if sidecar else None)
+        (dsin_prev2, dsout_prev2), (dsin_prev, dsout_prev) = history
+        if i + 1 < stop:
+            history.append((dsin[PREV_INPUT_VARS],
+                            load_vars(nc_files_in[i].replace(input_abbrev, output_abbrev), PREV_OUTPUT_VARS)))
+        add_input_features(dsin, dsin_prev, dsin_prev2, dsout_prev, dsout_prev2, lat, lon)
+        if sidecar:
+            dsin = dsin[NEW_VARS + GRID_VARS]
+        dsin.to_netcdf(nc_files_in[i].replace(input_abbrev, input_abbrev_new))
+
+    return None
+
+def split_timeline(stop, num_chunks, start = 2):
+    """
+    Split the file indices start to stop-1 into at most num_chunks contiguous (start, stop) ranges of similar length.
+    """
+    bounds = np.linspace(start, stop, num_chunks + 1).round().astype(int)
+    return [(int(a), int(b)) for a, b in zip(bounds[:-1], bounds[1:]) if b > a]
+
+def expand_files(nc_files_in, lat, lon, input_abbrev = 'mli', output_abbrev = 'mlo', input_abbrev_new = 'mlexpand',
+                 num_processes = None, sidecar = False, start = 2, stop = None):
+    """
+    Create the expanded input files of nc_files_in[start:stop] (which must be sorted in time) with process_file_range,
+    one contiguous range of the timeline per process.
+
+    Returns:
+        None
+    """
+    stop = len(nc_files_in) if stop is None else stop
+    num_processes = mp.cpu_count() if num_processes is None else num_processes
+    args_for_processing = [(a, b, nc_files_in, lat, lon, input_abbrev, output_abbrev, input_abbrev_new, sidecar)
+                           for a, b in split_timeline(stop, num_processes, start)]
+    if num_processes == 1:
+        for args in args_for_processing:
+            process_file_range(args)
+    else:
+        with mp.Pool(num_processes) as pool:
+            pool.map(process_file_range, args_for_processing)
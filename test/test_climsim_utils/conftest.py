@@ -0,0 +1,14 @@
+"""
+Fixtures for testing climsim_utils on small synthetic E3SM-MMF style input/output files
+"""
+
+import pytest
+
+from synthetic_data import write_synthetic_files
+
+
+@pytest.fixture(scope="session")
+def synthetic_data_path(tmp_path_factory) -> str:
+    data_path = tmp_path_factory.mktemp("e3sm_mmf")
+    write_synthetic_files(data_path)
+    return str(data_path) + "/"
@@ -0,0 +1,121 @@
+"""
+Helpers for testing climsim_utils on small synthetic E3SM-MMF style input/output files
+"""
+
+from pathlib import Path
+import numpy as np
+import xarray as xr
+
+from climsim_utils.data_utils import data_utils
+
+BASE_DIR = Path(__file__).resolve().parents[2]
+GRID_PATH = BASE_DIR / "grid_info" / "ClimSim_low-res_grid-info.nc"
+NORM_PATH = BASE_DIR / "preprocessing" / "normalizations"
+
+NUM_LEV = 60
+NUM_COL = 384
+
+PROFILE_INPUTS = [
+    "state_t", "state_q0001", "state_q0002", "state_q0003", "state_u", "state_v", "state_pmid",
+    "pbuf_ozone", "pbuf_CH4", "pbuf_N2O",
+    "state_t_dyn", "state_q0_dyn", "state_u_dyn",
+    "tm_state_t_dyn", "tm_state_q0_dyn", "tm_state_u_dyn",
+    "state_t_prvphy", "state_q0001_prvphy", "state_q0002_prvphy", "state_q0003_prvphy", "state_u_prvphy",
+    "tm_state_t_prvphy", "tm_state_q0001_prvphy", "tm_state_q0002_prvphy", "tm_state_q0003_prvphy",
+    "tm_state_u_prvphy",
+]
+SCALAR_INPUTS = [
+    "state_ps", "pbuf_SOLIN", "pbuf_LHFLX", "pbuf_SHFLX", "pbuf_TAUX", "pbuf_TAUY", "pbuf_COSZRS",
+    "cam_in_ALDIF", "cam_in_ALDIR", "cam_in_ASDIF", "cam_in_ASDIR", "cam_in_LWUP", "cam_in_ICEFRAC",
+    "cam_in_LANDFRAC", "cam_in_OCNFRAC", "cam_in_SNOWHICE", "cam_in_SNOWHLAND",
+    "tm_state_ps", "tm_pbuf_SOLIN", "tm_pbuf_LHFLX", "tm_pbuf_SHFLX", "tm_pbuf_COSZRS", "clat", "slat",
+]
+PROFILE_OUTPUTS = ["state_t", "state_q0001", "state_q0002", "state_q0003", "state_u", "state_v"]
+SCALAR_OUTPUTS = [
+    "cam_out_NETSW", "cam_out_FLWDS", "cam_out_PRECSC", "cam_out_PRECC",
+    "cam_out_SOLS", "cam_out_SOLL", "cam_out_SOLSD", "cam_out_SOLLD",
+]
+FILE_DATES = ["0001-02-01-00000", "0001-02-01-01200", "0001-02-01-02400", "0001-02-01-03600", "0001-03-01-00000"]
+
+
+def _profile(rng, name):
+    if name == "state_t":
+        return rng.uniform(180.0, 310.0, (NUM_LEV, NUM_COL))
+    if name == "state_pmid":
+        return np.linspace(10.0, 1.0e5, NUM_LEV)[:, None] * rng.uniform(0.9, 1.0, (1, NUM_COL))
+    if "q000" in name and "prvphy" not in name and "dyn" not in name:
+        return rng.uniform(0.0, 1.0e-3, (NUM_LEV, NUM_COL))
+    return rng.normal(0.0, 1.0, (NUM_LEV, NUM_COL))
+
+
+def _scalar(rng, name):
+    if "state_ps" in name:
+        return rng.uniform(5.0e4, 1.03e5, NUM_COL)
+    return rng.uniform(0.0, 1.0, NUM_COL)
+
+
+def write_synthetic_files(data_path: Path, dates=FILE_DATES, seed: int = 0):
+    """
+    Write pairs of synthetic mli/mlo files under data_path/<yyyy-mm>/ and return the sorted mli paths.
+    """
+    rng = np.random.default_rng(seed)
+    grid_info = xr.open_dataset(GRID_PATH)
+    mli_files = []
+    for date in dates:
+        month_dir = data_path / date[:7]
+        month_dir.mkdir(parents=True, exist_ok=True)
+        ds_in = xr.Dataset()
+        ds_in["lat"] = (("ncol",), grid_info["lat"].values)
+        ds_in["lon"] = (("ncol",), grid_info["lon"].values)
+        for name in PROFILE_INPUTS:
+            ds_in[name] = (("lev", "ncol"), _profile(rng, name))
+        for name in SCALAR_INPUTS:
+            ds_in[name] = (("ncol",), _scalar(rng, name))
+        ds_out = xr.Dataset()
+        for name in PROFILE_OUTPUTS:
+            ds_out[name] = (("lev", "ncol"), ds_in[name].values + rng.normal(0.0, 1.0e-3, (NUM_LEV, NUM_COL)) * ds_in[name].values)
+        for name in SCALAR_OUTPUTS:
+            ds_out[name] = (("ncol",), _scalar(rng, name))
+        mli_file = month_dir / f"E3SM-MMF.mli.{date}.nc"
+        ds_in.to_netcdf(mli_file, engine="netcdf4")
+        ds_out.to_netcdf(month_dir / f"E3SM-MMF.mlo.{date}.nc", engine="netcdf4")
+        mli_files.append(str(mli_file))
+    return sorted(mli_files)
+
+
+def open_norm_datasets(version: str = "v1"):
+    """
+    Open the repository (input_mean, input_max, input_min, output_scale) normalization files of a variable subset.
+    """
+    if version == "v5":
+        input_names = ["input_mean_v5_pervar.nc", "input_max_v5_pervar.nc", "input_min_v5_pervar.nc"]
+        output_name = "output_scale_std_lowerthred_v5.nc"
+    elif version == "v4":
+        input_names = ["input_mean_v4_pervar.nc", "input_max_v4_pervar.nc", "input_min_v4_pervar.nc"]
+        output_name = "output_scale.nc"
+    else:
+        input_names = ["input_mean.nc", "input_max.nc", "input_min.nc"]
+        output_name = "output_scale.nc"
+    return tuple(xr.open_dataset(NORM_PATH / "inputs" / name) for name in input_names) + \
+        (xr.open_dataset(NORM_PATH / "outputs" / output_name),)
+
+
+def build_data_utils(version: str = "v1", data_path: str = None, **kwargs) -> data_utils:
+    """
+    Build a data_utils object with the repository grid and normalization files for a variable subset.
+    """
+    grid_info = xr.open_dataset(GRID_PATH)
+    input_mean, input_max, input_min, output_scale = open_norm_datasets(version)
+    kwargs.setdefault("ml_backend", "pytorch")
+    data = data_utils(
+        grid_info=grid_info,
+        input_mean=input_mean,
+        input_max=input_max,
+        input_min=input_min,
+        output_scale=output_scale,
+        **kwargs,
+    )
+    getattr(data, f"set_to_{version}_vars")()
+    if data_path is not None:
+        data.data_path = data_path
+    return data
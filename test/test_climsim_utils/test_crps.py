@@ -0,0 +1,77 @@
+"""
+Testing the ensemble weighting data_utils.output_weighting_CRPS and the chunked data_utils.calc_CRPS
+"""
+
+import numpy as np
+import pytest
+
+from synthetic_data import build_data_utils, NUM_COL
+
+NUM_TIMESTEPS = 5
+NUM_CRPS = 6
+
+
+def _reference_crps(samplepreds, target):
+    # CRPS over the full time x grid x ... x member array at once
+    num_crps = samplepreds.shape[-1]
+    mae = np.mean(np.abs(samplepreds - target[..., np.newaxis]), axis=(0, -1))
+    samplepreds = np.sort(samplepreds, axis=-1)
+    diff = samplepreds[..., 1:] - samplepreds[..., :-1]
+    count = np.arange(1, num_crps) * np.arange(num_crps - 1, 0, -1)
+    spread = (diff * count).sum(axis=-1).mean(axis=0)
+    return (mae - spread / (num_crps * (num_crps - 1))).mean(axis=0)
+
+
+def _data_with_ensemble(version):
+    data = build_data_utils(version)
+    rng = np.random.default_rng(0)
+    data.input_scoring = rng.uniform(0.0, 1.0, (NUM_TIMESTEPS * NUM_COL, data.input_feature_len))
+    data.set_pressure_grid("scoring")
+    target = rng.normal(size=(NUM_TIMESTEPS * NUM_COL, data.target_feature_len))
+    samplepreds = target[..., np.newaxis] + rng.normal(size=(NUM_TIMESTEPS * NUM_COL, data.target_feature_len, NUM_CRPS))
+    return data, target, samplepreds
+
+
+@pytest.mark.parametrize("version", ["v1", "v5"])
+def test_weighting_matches_each_member(version):
+    data, _, samplepreds = _data_with_ensemble(version)
+    weighted = data.output_weighting_CRPS(samplepreds, "scoring")
+    for member in range(NUM_CRPS):
+        expected = data.output_weighting(np.ascontiguousarray(samplepreds[..., member]), "scoring")
+        for var in data.target_vars:
+            np.testing.assert_allclose(weighted[var][..., member], expected[var], rtol=1e-12)
+    assert weighted["ptend_t"].shape == (NUM_TIMESTEPS, NUM_COL, 60, NUM_CRPS)
+
+    in_place = samplepreds.copy()
+    weighted_in_place = data.output_weighting_CRPS(in_place, "scoring", in_place=True)
+    assert np.shares_memory(weighted_in_place["ptend_t"], in_place)
+    for var in data.target_vars:
+        np.testing.assert_array_equal(weighted_in_place[var], weighted[var])
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 24])
+def test_chunked_crps_matches_reference(chunk_size):
+    data, target, samplepreds = _data_with_ensemble("v1")
+    samplepreds_weighted = data.output_weighting_CRPS(samplepreds, "scoring")
+    target_weighted = data.output_weighting(target, "scoring")
+    for var in ["ptend_t", "cam_out_PRECC"]:
+        expected = _reference_crps(samplepreds_weighted[var], target_weighted[var])
+        result = data.calc_CRPS(samplepreds_weighted[var], target_weighted[var], chunk_size=chunk_size)
+        np.testing.assert_allclose(result, expected, rtol=1e-10)
+
+
+def test_crps_in_metrics_df():
+    data, target, samplepreds = _data_with_ensemble("v1")
+    data.model_names = ["ensemble"]
+    data.metrics_names = ["MAE", "CRPS"]
+    data.target_scoring = target
+    data.preds_scoring = {"ensemble": samplepreds.mean(axis=-1)}
+    data.samplepreds_scoring = {"ensemble": samplepreds}
+    data.reweight_target("scoring")
+    data.reweight_preds("scoring")
+    data.reweight_samplepreds("scoring")
+    data.create_metrics_df("scoring")
+    df_var = data.metrics_var_scoring["ensemble"]
+    expected = np.mean(_reference_crps(data.samplepreds_weighted_scoring["ensemble"]["ptend_q0001"],
+                                       data.target_weighted_scoring["ptend_q0001"]))
+    np.testing.assert_allclose(df_var.loc["ptend_q0001", "CRPS"], expected, rtol=1e-10)
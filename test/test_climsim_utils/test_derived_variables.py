@@ -0,0 +1,79 @@
+"""
+Testing the derived-variable registry behind data_utils.get_xrdata and data_utils.read_ncvars
+"""
+
+from pathlib import Path
+
+import numpy as np
+import pytest
+import xarray as xr
+
+from climsim_utils import derived_variables
+from climsim_utils.derived_variables import DERIVED_VARIABLES, derived_variable, eliq, eice
+
+from synthetic_data import build_data_utils, NUM_COL
+
+
+def eice_reference(T):
+    # the piecewise fit evaluated on every temperature and combined with the masks
+    a_ice = np.array([0.252751365e-14, 0.146898966e-11, 0.385852041e-9,
+                      0.602588177e-7, 0.615021634e-5, 0.420895665e-3,
+                      0.188439774e-1, 0.503160820, 6.11147274])
+    c_ice = np.array([273.15, 185, -100, 0.00763685, 0.000151069, 7.48215e-07])
+    T0 = 273.16
+    return (T > c_ice[0]) * eliq(T) + \
+        (T <= c_ice[0]) * (T > c_ice[1]) * 100 * np.polyval(a_ice, T - T0) + \
+        (T <= c_ice[1]) * 100 * (c_ice[3] + np.maximum(c_ice[2], T - T0) *
+                                 (c_ice[4] + np.maximum(c_ice[2], T - T0) * c_ice[5]))
+
+
+@pytest.mark.parametrize("dtype", [np.float32, np.float64])
+def test_eice_matches_reference(dtype):
+    T = np.concatenate([np.linspace(150.0, 320.0, 1001), [185.0, 273.15, np.nan]]).astype(dtype)
+    np.testing.assert_array_equal(eice(T), eice_reference(T))
+
+
+def test_derived_inputs_match_reference(synthetic_data_path):
+    data = build_data_utils("v5", synthetic_data_path)
+    file = sorted(Path(synthetic_data_path).glob("*/*.mli.*.nc"))[0]
+    file_vars = ["state_rh", "liq_partition", "icol", "state_qn", "state_qn_prvphy", "tm_state_qn_prvphy"]
+    ds = data.get_xrdata(str(file), file_vars)
+    arrays = data.read_ncvars(str(file), file_vars)
+
+    with xr.open_dataset(file) as raw:
+        tair = raw["state_t"].values
+        omega = np.maximum(0, np.minimum(1, (tair - 253.16) / (273.16 - 253.16)))
+        esat = omega * eliq(tair) + (1 - omega) * eice_reference(tair)
+        expected = {
+            "state_rh": raw["state_q0001"].values / ((287 * esat) / (461 * raw["state_pmid"].values)),
+            "liq_partition": omega,
+            "icol": np.arange(1, NUM_COL + 1, dtype=raw["lat"].dtype),
+            "state_qn": raw["state_q0002"].values + raw["state_q0003"].values,
+            "state_qn_prvphy": raw["state_q0002_prvphy"].values + raw["state_q0003_prvphy"].values,
+            "tm_state_qn_prvphy": raw["tm_state_q0002_prvphy"].values + raw["tm_state_q0003_prvphy"].values,
+        }
+    for var in file_vars:
+        np.testing.assert_array_equal(ds[var].values, expected[var])
+        np.testing.assert_array_equal(arrays[var], expected[var])
+    assert ds["state_rh"].dims == ("lev", "ncol") and ds["icol"].dims == ("ncol",)
+
+
+def test_registered_variable_reaches_both_readers(synthetic_data_path, monkeypatch):
+    monkeypatch.setattr(derived_variables, "DERIVED_VARIABLES", dict(DERIVED_VARIABLES))
+    calls = []
+
+    @derived_variable("state_qt", ["state_q0001", "state_qn"])
+    def state_qt(state_q0001, state_qn):
+        calls.append(1)
+        return state_q0001 + state_qn
+
+    assert "state_qt" not in DERIVED_VARIABLES
+    monkeypatch.setattr("climsim_utils.nc_io.DERIVED_VARIABLES", derived_variables.DERIVED_VARIABLES)
+    data = build_data_utils("v1", synthetic_data_path)
+    file = str(sorted(Path(synthetic_data_path).glob("*/*.mli.*.nc"))[0])
+    ds = data.get_xrdata(file, ["state_qt", "state_qn"])
+    arrays = data.read_ncvars(file, ["state_qt", "state_qn"])
+    np.testing.assert_array_equal(ds["state_qt"].values, arrays["state_qt"])
+    np.testing.assert_array_equal(arrays["state_qt"], arrays["state_q0001"] + arrays["state_qn"])
+    # one evaluation per file and reader
+    assert len(calls) == 2
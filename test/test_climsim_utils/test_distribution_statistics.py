@@ -0,0 +1,79 @@
+"""
+Testing the one-pass distribution statistics of dataset_statistics/code/distribution_statistics.py against numpy
+"""
+
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+import xarray as xr
+
+from synthetic_data import BASE_DIR, NUM_LEV
+
+sys.path.insert(0, str(BASE_DIR / "dataset_statistics" / "code"))
+import distribution_statistics  # noqa: E402
+
+DistributionSketch = distribution_statistics.DistributionSketch
+
+
+def _check_sketch(sketch, x, relative_accuracy):
+    x = x[~np.isnan(x)]
+    deviation = x - x.mean()
+    assert sketch.count == x.size
+    np.testing.assert_allclose(sketch.mean, x.mean(), rtol=1e-10, atol=1e-12 * np.abs(x).max())
+    np.testing.assert_allclose(sketch.std, x.std(), rtol=1e-10)
+    np.testing.assert_allclose(sketch.skewness, np.mean(deviation**3) / x.std()**3, rtol=1e-8, atol=1e-10)
+    np.testing.assert_allclose(sketch.kurtosis, np.mean(deviation**4) / x.var()**2 - 3, rtol=1e-8)
+    assert sketch.min == x.min() and sketch.max == x.max()
+    # every quantile of the sketch lies within relative_accuracy of a value between the neighbouring order statistics
+    x_sorted = np.sort(x)
+    for q in [0.01, 0.25, 0.5, 0.75, 0.99]:
+        rank = q * (x.size - 1)
+        low, high = x_sorted[int(np.floor(rank))], x_sorted[int(np.ceil(rank))]
+        value = sketch.quantile(q)
+        tolerance = relative_accuracy * max(abs(low), abs(high))
+        assert low - tolerance <= value <= high + tolerance
+
+
+def test_sketch_matches_numpy():
+    rng = np.random.default_rng(0)
+    x = np.concatenate([rng.normal(-2.0, 3.0, 5000), rng.lognormal(0.0, 2.0, 3000), np.zeros(500), [np.nan] * 7])
+    rng.shuffle(x)
+    sketch = DistributionSketch(1e-3)
+    for chunk in np.array_split(x[:6000], 7):
+        sketch.update(chunk)
+    sketch.merge(DistributionSketch(1e-3).update(x[6000:])).merge(DistributionSketch(1e-3))
+    assert sketch.num_nan == 7 and sketch.num_zero == 500
+    _check_sketch(sketch, x, 1e-3)
+
+    hist, edges = sketch.histogram(100)
+    expected_hist, expected_edges = np.histogram(x[~np.isnan(x)], bins=100)
+    np.testing.assert_allclose(edges, expected_edges)
+    assert hist.sum() == expected_hist.sum()
+    assert np.abs(hist - expected_hist).sum() <= 0.01 * x.size
+
+
+@pytest.mark.parametrize("num_workers", [0, 2])
+def test_dataset_tables(synthetic_data_path, tmp_path, num_workers):
+    files = sorted(str(file) for file in Path(synthetic_data_path).glob("*/E3SM-MMF.mli.*.nc"))
+    variables = {"mli": ["state_t", "cam_in_ALDIF"], "mlo": ["cam_out_PRECC"], "tend": ["state_q0001"]}
+    sketches = distribution_statistics.sketch_dataset(files, variables, num_workers=num_workers, files_per_task=2)
+    assert len(sketches) == 2 * NUM_LEV + 2
+
+    mli = [xr.open_dataset(file) for file in files]
+    mlo = [xr.open_dataset(file.replace(".mli.", ".mlo.")) for file in files]
+    state_t = np.concatenate([ds["state_t"].values[9] for ds in mli])
+    tendency = np.concatenate([(ds_out["state_q0001"].values[0] - ds_in["state_q0001"].values[0]) / 1200
+                               for ds_in, ds_out in zip(mli, mlo)])
+    precc = np.concatenate([ds["cam_out_PRECC"].values for ds in mlo])
+    _check_sketch(sketches[("mli", "state_t", 10)], state_t, 1e-3)
+    _check_sketch(sketches[("tend", "state_q0001", 1)], tendency, 1e-3)
+    _check_sketch(sketches[("mlo", "cam_out_PRECC", None)], precc, 1e-3)
+
+    distribution_statistics.write_tables(sketches, str(tmp_path))
+    assert (tmp_path / "mli_state_tlev_60.txt").exists() and (tmp_path / "mli_cam_in_ALDIF.txt").exists()
+    lines = (tmp_path / "mli_state_tlev_10.txt").read_text().splitlines()
+    assert [line.split(":")[0] for line in lines[:8]] == ["Standard Deviation", "Skewness", "Kurtosis", "Median",
+                                                          "Mean", "Deciles", "Minimum", "Maximum"]
+    np.testing.assert_allclose(float(lines[4].split(": ")[1]), state_t.mean(), rtol=1e-12)
@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+from climsim_utils.feature_layout import FeatureLayout
+
+from synthetic_data import build_data_utils
+
+
+@pytest.mark.parametrize(
+    "version, input_len, target_len, ps_index",
+    [
+        ("v1", 124, 128, 120),
+        ("v2", 557, 368, 360),
+        # state_rh comes before state_ps, so not the 360 of v2
+        ("v2_rh", 557, 368, 540),
+        ("v4", 1525, 368, 1500),
+        ("v5", 1405, 308, 1380),
+    ],
+)
+def test_layout_matches_hardcoded_offsets(version, input_len, target_len, ps_index):
+    data = build_data_utils(version)
+    assert data.input_feature_len == input_len
+    assert data.target_feature_len == target_len
+    assert data.ps_index == ps_index
+    assert len(data.input_layout) == input_len
+    assert len(data.target_layout) == target_len
+
+
+def test_v5_offsets():
+    data = build_data_utils("v5")
+    layout = data.input_layout
+    assert layout.slice("state_qn") == slice(120, 180)
+    assert layout.index("state_qn_prvphy") == 60 * 14
+    assert layout.index("tm_state_qn_prvphy") == 60 * 18
+    assert layout.index("cam_in_SNOWHICE") == 1395
+    assert data.target_layout.slice("ptend_u") == slice(180, 240)
+
+
+def test_indices_gather_scatter():
+    layout = FeatureLayout(["a", "b", "c"], {"a": 4, "b": 1, "c": 3})
+    assert layout.feature_len == 8
+    assert layout.profile_vars == ["a", "c"]
+    assert layout.scalar_vars == ["b"]
+    np.testing.assert_array_equal(layout.indices([("c", slice(0, 2)), "b", ("a", [3, 1])]), [1, 3, 4, 5, 6])
+    np.testing.assert_array_equal(layout.indices(("a", slice(0, 0))), [])
+
+    x = np.arange(16.0).reshape(2, 8)
+    np.testing.assert_array_equal(layout.gather(x, "b"), x[:, [4]])
+    layout.scatter(x, ("c", 2), -1.0)
+    assert (x[:, 7] == -1.0).all()
+
+    split = layout.split(x)
+    assert split["a"].shape == (2, 4)
+    assert split["b"].shape == (2,)
+    np.testing.assert_array_equal(layout.per_variable({"b": 2.0, "c": [1.0, 2.0, 3.0]}), [1, 1, 1, 1, 2, 1, 2, 3])
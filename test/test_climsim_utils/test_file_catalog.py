@@ -0,0 +1,61 @@
+"""
+Testing the SQLite file catalog behind data_utils.set_filelist
+"""
+
+import os
+import shutil
+import pytest
+
+from climsim_utils.file_catalog import FileCatalog
+
+from synthetic_data import build_data_utils
+
+REGEXPS = [["E3SM-MMF.mli.0001-0[23]-*-*.nc"], ["E3SM-MMF.mli.0001-02-01-0*.nc", "E3SM-MMF.mli.0001-03-*.nc"], ["*.mli.*.nc"]]
+
+
+@pytest.mark.parametrize("regexps", REGEXPS)
+@pytest.mark.parametrize("start_idx, end_idx, stride", [(0, -1, 1), (0, None, 1), (1, None, 2), (-3, None, 1), (None, None, -2), (4, 1, 1)])
+def test_catalog_matches_glob(synthetic_data_path, tmp_path, regexps, start_idx, end_idx, stride):
+    data = build_data_utils("v1", synthetic_data_path)
+    data.set_regexps("val", regexps)
+    data.set_stride_sample("val", stride)
+    data.set_filelist("val", start_idx, end_idx)
+    expected = data.get_filelist("val")
+
+    data.set_file_catalog(str(tmp_path / "catalog.sqlite"))
+    data.set_filelist("val", start_idx, end_idx)
+    assert data.get_filelist("val") == expected
+
+
+def test_dates_pairs_and_refresh(synthetic_data_path, tmp_path):
+    data_path = tmp_path / "data"
+    shutil.copytree(synthetic_data_path, data_path)
+    catalog = FileCatalog(str(tmp_path / "catalog.sqlite"), str(data_path) + "/")
+    assert catalog.refresh() == 2
+    assert len(catalog) == 5
+    assert catalog.query(start_date="0001-02-01-01200", end_date="0001-02-01-03600") == [
+        "0001-02/E3SM-MMF.mli.0001-02-01-01200.nc", "0001-02/E3SM-MMF.mli.0001-02-01-02400.nc", "0001-02/E3SM-MMF.mli.0001-02-01-03600.nc"]
+    assert catalog.query(start_date="0001-03", end_date="0001-03", outputs=True) == [
+        ("0001-03/E3SM-MMF.mli.0001-03-01-00000.nc", "0001-03/E3SM-MMF.mlo.0001-03-01-00000.nc")]
+
+    # nothing changed, nothing is rescanned
+    assert catalog.refresh() == 0
+    os.remove(data_path / "0001-03" / "E3SM-MMF.mlo.0001-03-01-00000.nc")
+    shutil.rmtree(data_path / "0001-02")
+    assert catalog.refresh() == 1
+    assert catalog.query() == ["0001-03/E3SM-MMF.mli.0001-03-01-00000.nc"]
+    assert catalog.query(paired_only=True) == []
+    catalog.close()
+
+    # the catalog persists across sessions
+    reopened = FileCatalog(str(tmp_path / "catalog.sqlite"), str(data_path) + "/")
+    assert reopened.refresh() == 0
+    assert len(reopened) == 1
+
+
+def test_dates_need_catalog(synthetic_data_path):
+    data = build_data_utils("v1", synthetic_data_path)
+    data.set_regexps("train", ["*.nc"])
+    data.set_stride_sample("train", 1)
+    with pytest.raises(AssertionError):
+        data.set_filelist("train", start_date="0001-02")
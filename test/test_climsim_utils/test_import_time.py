@@ -0,0 +1,53 @@
+"""
+Testing that importing data_utils and creating a data_utils object does not import the ml backends, h5py or matplotlib
+"""
+
+import json
+import pickle
+import subprocess
+import sys
+
+from synthetic_data import BASE_DIR, build_data_utils
+
+# peak RSS is measured in a fresh interpreter; importing tensorflow alone adds several hundred MB and seconds
+IMPORT_SCRIPT = """
+import json, resource, sys, time
+start = time.perf_counter()
+import climsim_utils.data_utils
+import_time = time.perf_counter() - start
+sys.path.insert(0, {test_dir!r})
+from synthetic_data import build_data_utils
+data = build_data_utils("v5", ml_backend={ml_backend!r})
+# ru_maxrss survives exec, so on linux the high-water mark of this process image is read from /proc
+try:
+    with open("/proc/self/status") as f:
+        max_rss_mb = [int(line.split()[1]) for line in f if line.startswith("VmHWM")][0] / 1024
+except OSError:
+    max_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+print(json.dumps({{"import_time": import_time,
+                   "max_rss_mb": max_rss_mb,
+                   "modules": [m for m in ["tensorflow", "torch", "matplotlib", "h5py"] if m in sys.modules]}}))
+"""
+
+
+def _measure_import(ml_backend):
+    script = IMPORT_SCRIPT.format(test_dir=str(BASE_DIR / "test" / "test_climsim_utils"), ml_backend=ml_backend)
+    result = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True, cwd=BASE_DIR)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def test_import_is_lightweight():
+    for ml_backend in ["tensorflow", "pytorch"]:
+        measured = _measure_import(ml_backend)
+        assert measured["modules"] == []
+        assert measured["import_time"] < 3.0
+        assert measured["max_rss_mb"] < 350
+
+
+def test_backend_imported_on_use():
+    data = build_data_utils("v1", ml_backend="pytorch")
+    assert data.successful_backend_import and data.tf is None
+    import torch
+    assert data.torch is torch
+    restored = pickle.loads(pickle.dumps(data))
+    assert restored.torch is torch and restored.input_layout.feature_len == data.input_layout.feature_len
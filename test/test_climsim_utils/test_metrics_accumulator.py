@@ -0,0 +1,59 @@
+"""
+Testing the chunked metrics of data_utils.create_metrics_df_streaming against create_metrics_df
+"""
+
+import numpy as np
+import pytest
+
+from climsim_utils.metrics_accumulator import MetricsAccumulator
+
+from synthetic_data import build_data_utils, NUM_COL
+
+NUM_TIMESTEPS = 7
+
+
+def _set_split(data, split, seed=0):
+    rng = np.random.default_rng(seed)
+    num_rows = NUM_TIMESTEPS * NUM_COL
+    setattr(data, f"input_{split}", rng.uniform(0.0, 1.0, (num_rows, data.input_feature_len)))
+    target = rng.normal(size=(num_rows, data.target_feature_len))
+    setattr(data, f"target_{split}", target)
+    data.model_names = ["a", "b"]
+    setattr(data, f"preds_{split}", {"a": target + rng.normal(scale=0.1, size=target.shape),
+                                     "b": target + rng.normal(scale=0.5, size=target.shape) + 0.1})
+    data.metrics_names = ["MAE", "RMSE", "R2", "bias"]
+
+
+@pytest.mark.parametrize("version, chunk_size", [("v1", 3), ("v2", 2), ("v2", NUM_TIMESTEPS)])
+def test_streaming_matches_create_metrics_df(version, chunk_size):
+    data = build_data_utils(version)
+    _set_split(data, "val")
+    data.set_pressure_grid("val")
+    data.reweight_target("val")
+    data.reweight_preds("val")
+    data.create_metrics_df("val")
+    expected_var = {name: df.copy() for name, df in data.metrics_var_val.items()}
+    expected_idx = {name: df.copy() for name, df in data.metrics_idx_val.items()}
+
+    data.create_metrics_df_streaming("val", chunk_size=chunk_size)
+    for model_name in data.model_names:
+        np.testing.assert_allclose(data.metrics_var_val[model_name].to_numpy(float), expected_var[model_name].to_numpy(float), rtol=1e-9)
+        np.testing.assert_allclose(data.metrics_idx_val[model_name].to_numpy(float), expected_idx[model_name].to_numpy(float), rtol=1e-9)
+
+
+def test_merge_matches_single_pass():
+    var_lens = {"a": 4, "b": 1}
+    rng = np.random.default_rng(1)
+    target = rng.normal(3.0, 1.0, (10, 6, 5))
+    pred = target + rng.normal(size=target.shape)
+
+    whole = MetricsAccumulator(["a", "b"], var_lens, 6).update(pred, target)
+    merged = MetricsAccumulator(["a", "b"], var_lens, 6).update(pred[:3], target[:3])
+    merged.merge(MetricsAccumulator(["a", "b"], var_lens, 6).update(pred[3:], target[3:]))
+    assert merged.num_timesteps == 10
+    for metric_name in MetricsAccumulator.metric_names:
+        np.testing.assert_allclose(merged.metric(metric_name, avg_grid=False), whole.metric(metric_name, avg_grid=False))
+    r2 = 1 - ((pred - target)**2).sum(axis=0) / ((target - target.mean(axis=0))**2).sum(axis=0)
+    np.testing.assert_allclose(whole.metric("R2"), r2.mean(axis=0))
+    with pytest.raises(ValueError):
+        whole.metric("CRPS")
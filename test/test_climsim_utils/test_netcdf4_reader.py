@@ -0,0 +1,29 @@
+"""
+Testing that the netCDF4 reader of data_utils reproduces the xarray reader
+"""
+
+import numpy as np
+import pytest
+
+from synthetic_data import build_data_utils
+
+
+@pytest.mark.parametrize("version", ["v1", "v2", "v2_rh", "v5"])
+@pytest.mark.parametrize("normalize", [True, False])
+def test_netcdf4_reader_matches_xarray_reader(synthetic_data_path, version, normalize):
+    norm_version = "v1" if version in ["v1", "v2"] else "v5"
+    data_xr = build_data_utils(norm_version, synthetic_data_path, normalize=normalize)
+    data_nc = build_data_utils(norm_version, synthetic_data_path, normalize=normalize, nc_reader="netcdf4")
+    getattr(data_xr, f"set_to_{version}_vars")()
+    getattr(data_nc, f"set_to_{version}_vars")()
+    data_xr.set_regexps("train", ["E3SM-MMF.mli.*.nc"])
+    data_xr.set_stride_sample("train", 1)
+    data_xr.set_filelist("train", end_idx=None)
+
+    for file in data_xr.get_filelist("train")[:2]:
+        expected_input, expected_target = data_xr.load_ncfile(file)
+        npy_input, npy_target = data_nc.load_ncfile(file)
+        assert npy_input.shape == (data_nc.num_latlon, data_nc.input_feature_len)
+        assert npy_target.shape == (data_nc.num_latlon, data_nc.target_feature_len)
+        np.testing.assert_array_equal(npy_input, expected_input)
+        np.testing.assert_array_equal(npy_target, expected_target)
@@ -0,0 +1,55 @@
+"""
+Testing that a NormBundle round-trips the norms and layouts of data_utils.save_norm without copies
+"""
+
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+from climsim_utils.norm_bundle import NormBundle, NORM_BUNDLE_VERSION
+
+from synthetic_data import BASE_DIR, NORM_PATH, build_data_utils
+
+
+@pytest.mark.parametrize("version", ["v2", "v5"])
+def test_bundle_matches_save_norm(tmp_path, version):
+    data = build_data_utils(version)
+    qn_lbd = np.loadtxt(NORM_PATH / "inputs" / "qn_exp_lambda_large.txt", delimiter=",")
+    data.save_norm_bundle(tmp_path / "norm.npz", qn_lbd=qn_lbd, variable_subset=version)
+    bundle = NormBundle.load(tmp_path / "norm.npz")
+
+    input_sub, input_div, out_scale = data.save_norm(write=False)
+    assert isinstance(bundle.input_sub, np.memmap)
+    np.testing.assert_array_equal(bundle.input_sub, input_sub)
+    np.testing.assert_array_equal(bundle.input_div, input_div)
+    np.testing.assert_array_equal(bundle.out_scale, out_scale)
+    np.testing.assert_array_equal(bundle.qn_lbd, qn_lbd)
+    np.testing.assert_array_equal(bundle.hyai, data.grid_info["hyai"].values)
+    np.testing.assert_array_equal(bundle.area_wgt, data.area_wgt)
+    assert bundle.variable_subset == version and bundle.ps_index == data.ps_index
+    for layout, expected in [(bundle.input_layout, data.input_layout), (bundle.target_layout, data.target_layout)]:
+        assert layout.var_list == expected.var_list and layout.offsets == expected.offsets
+
+    # the memory maps are copy-on-write, so writes do not change the file
+    bundle.input_sub[:] = 0.0
+    np.testing.assert_array_equal(NormBundle.load(tmp_path / "norm.npz", mmap=False).input_sub, input_sub)
+
+
+def test_version_check_and_cli(tmp_path):
+    data = build_data_utils("v5")
+    data.save_norm_bundle(tmp_path / "norm.npz", variable_subset="v5")
+    assert NormBundle.load(tmp_path / "norm.npz").qn_lbd is None
+    arrays = dict(np.load(tmp_path / "norm.npz"))
+    arrays["version"] = np.array(NORM_BUNDLE_VERSION + 1)
+    np.savez(tmp_path / "future.npz", **arrays)
+    with pytest.raises(ValueError):
+        NormBundle.load(tmp_path / "future.npz")
+
+    subprocess.run([sys.executable, "-m", "climsim_utils.norm_bundle", "--climsim-path", str(BASE_DIR),
+                    "--variable-subset", "v5", "--output", str(tmp_path / "cli")], check=True, cwd=BASE_DIR)
+    # the bundle is written at the given path, without an added .npz suffix
+    bundle = NormBundle.load(tmp_path / "cli")
+    np.testing.assert_array_equal(bundle.out_scale, data.save_norm(write=False)[2])
+    assert bundle.qn_lbd.shape == (60,)
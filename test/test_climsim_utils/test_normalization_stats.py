@@ -0,0 +1,91 @@
+"""
+Testing the streaming normalization statistics of data_utils.compute_norm_stats against in-memory statistics
+"""
+
+import numpy as np
+import pytest
+import xarray as xr
+
+from climsim_utils.data_utils import data_utils
+from climsim_utils.normalization_stats import RunningStats, OUTPUT_STD_THRESHOLDS
+
+from synthetic_data import build_data_utils, GRID_PATH
+
+
+def test_running_stats_merge():
+    rng = np.random.default_rng(0)
+    x = rng.normal(3.0, 2.0, size=(1000, 7))
+    stats = RunningStats(7)
+    for chunk in np.array_split(x[:600], 5):
+        stats.update(chunk)
+    other = RunningStats(7).update(x[600:])
+    stats.merge(other).merge(RunningStats(7))
+    assert stats.count == 1000
+    np.testing.assert_allclose(stats.mean, x.mean(axis=0), rtol=1e-12)
+    np.testing.assert_allclose(stats.std, x.std(axis=0), rtol=1e-12)
+    np.testing.assert_array_equal(stats.min, x.min(axis=0))
+    np.testing.assert_array_equal(stats.max, x.max(axis=0))
+
+
+@pytest.mark.parametrize("num_workers", [0, 2])
+def test_matches_in_memory_statistics(synthetic_data_path, tmp_path, num_workers):
+    data = build_data_utils("v2", synthetic_data_path)
+    data.set_regexps("train", ["E3SM-MMF.mli.0001-0[23]-*-*.nc"])
+    data.set_stride_sample("train", 1)
+    data.set_filelist("train", end_idx=None)
+    stats = data.compute_norm_stats("train", num_workers=num_workers)
+
+    files = data.get_filelist("train")
+    x = np.concatenate([data.get_input_array(file) for file in files])
+    y = np.concatenate([data.get_target_array(file) for file in files])
+    assert stats.input.count == x.shape[0]
+    # the means of the zero-mean inputs cancel, so they are compared relative to the magnitude of the inputs
+    assert np.all(np.abs(stats.input.mean - x.mean(axis=0)) <= 1e-12 * np.abs(x).max(axis=0))
+    np.testing.assert_allclose(stats.target.std, y.std(axis=0), rtol=1e-10)
+
+    # output scale with the lower thresholds of output_scaling.ipynb, including the derived ptend_qn
+    output_scale = stats.output_scale("lowerthred_v5")
+    yq = y[:, data.target_layout.slice("ptend_q0002")] + y[:, data.target_layout.slice("ptend_q0003")]
+    np.testing.assert_allclose(output_scale["ptend_qn"].values, 1. / np.maximum(yq.std(axis=0), 3e-10), rtol=1e-10)
+    np.testing.assert_allclose(output_scale["ptend_u"].values,
+                               1. / np.maximum(y[:, data.target_layout.slice("ptend_u")].std(axis=0), OUTPUT_STD_THRESHOLDS["lowerthred_v5"]["ptend_u"]), rtol=1e-10)
+    np.testing.assert_allclose(output_scale["cam_out_PRECC"].values, 1. / y[:, data.target_layout.index("cam_out_PRECC")].std(), rtol=1e-10)
+
+    # exponential lambdas of cloud_exponential_transformation.ipynb
+    qc = np.concatenate([data.read_ncvars(file, ["state_q0002"])["state_q0002"].T for file in files])
+    expected = np.array([1. / qc[:, i][qc[:, i] > 1e-7].mean() for i in range(qc.shape[1])])
+    np.testing.assert_allclose(stats.exp_lambdas()["qc"], expected, rtol=1e-10)
+
+    stats.write(str(tmp_path), input_suffix="_test", output_suffix="_std_test")
+    input_mean = xr.open_dataset(tmp_path / "inputs" / "input_mean_test.nc")
+    input_max = xr.open_dataset(tmp_path / "inputs" / "input_max_test.nc")
+    input_min = xr.open_dataset(tmp_path / "inputs" / "input_min_test.nc")
+    written_scale = xr.open_dataset(tmp_path / "outputs" / "output_scale_std_test.nc")
+    assert float(input_mean["state_q0002"][0]) == 0.0 and float(input_max["state_q0002"][0]) == 1.0
+    np.testing.assert_allclose(input_max["state_t"].values, x[:, data.input_layout.slice("state_t")].max(axis=0))
+    lambdas = np.loadtxt(tmp_path / "inputs" / "qn_exp_lambda_large.txt", delimiter=",")
+    assert lambdas.shape == (60,)
+
+    # the written files can be used to normalize the split
+    normalized = data_utils(grid_info=xr.open_dataset(GRID_PATH), input_mean=input_mean, input_max=input_max,
+                            input_min=input_min, output_scale=written_scale, ml_backend="pytorch")
+    normalized.set_to_v2_vars()
+    input_sub, input_div, out_scale = normalized.save_norm()
+    assert np.all(np.isfinite(input_sub)) and np.all(input_div > 0) and np.all(np.isfinite(out_scale))
+
+
+def test_prvphy_inputs_scaled_with_nopenalty_std(synthetic_data_path, tmp_path):
+    data = build_data_utils("v5", synthetic_data_path)
+    data.set_regexps("train", ["E3SM-MMF.mli.0001-02-*-*.nc"])
+    data.set_stride_sample("train", 1)
+    data.set_filelist("train", end_idx=None)
+    stats = data.compute_norm_stats("train", num_workers=0)
+    stats.write(str(tmp_path), input_suffix="_test", output_suffix="_std_test", thresholds="lowerthred_v5")
+
+    # as input_scaling.ipynb, independent of the thresholds of the written output_scale
+    input_max = xr.open_dataset(tmp_path / "inputs" / "input_max_test.nc")
+    nopenalty = stats.output_scale("nopenalty")
+    for var in ["state_u_prvphy", "tm_state_u_prvphy", "state_q0001_prvphy"]:
+        target_var = var.replace("tm_", "").replace("state_", "ptend_").replace("_prvphy", "")
+        np.testing.assert_allclose(input_max[var].values, 1. / nopenalty[target_var].values, rtol=1e-12)
+    assert not np.allclose(input_max["state_u_prvphy"].values, 1. / stats.output_scale("lowerthred_v5")["ptend_u"].values)
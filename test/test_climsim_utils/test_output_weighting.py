@@ -0,0 +1,75 @@
+"""
+Testing data_utils.output_weighting against a per-variable reference of the weighting
+"""
+
+import numpy as np
+import pytest
+
+from synthetic_data import build_data_utils, NUM_COL
+
+NUM_TIMESTEPS = 3
+
+
+def _reference_weighting(data, output, dp):
+    # per-variable version of the four transformations, with the wind speed of the scaled outputs
+    num_timesteps = output.shape[0] // NUM_COL
+    split = {var: output[:, data.target_layout.slice(var)].reshape((num_timesteps, NUM_COL, -1)).squeeze(-1)
+             if data.var_lens[var] == 1 else output[:, data.target_layout.slice(var)].reshape((num_timesteps, NUM_COL, -1))
+             for var in data.target_vars}
+    weighted = {}
+    for var, values in split.items():
+        if data.normalize:
+            values = values / data.output_scale[var].values
+        if data.var_lens[var] > 1:
+            values = values * dp / data.grav
+            area = data.area_wgt[np.newaxis, :, np.newaxis]
+        else:
+            area = data.area_wgt[np.newaxis, :]
+        values = values * area
+        if var in ["ptend_u", "ptend_v"]:
+            values = values * np.sqrt(split["ptend_u"]**2 + split["ptend_v"]**2)
+        else:
+            values = values * data.target_energy_conv[var]
+        weighted[var] = values
+    return weighted
+
+
+def _data_with_split(version):
+    data = build_data_utils(version)
+    rng = np.random.default_rng(0)
+    data.input_scoring = rng.uniform(0.0, 1.0, (NUM_TIMESTEPS * NUM_COL, data.input_feature_len))
+    data.set_pressure_grid("scoring")
+    output = rng.normal(size=(NUM_TIMESTEPS * NUM_COL, data.target_feature_len))
+    return data, output
+
+
+@pytest.mark.parametrize("version", ["v1", "v2", "v4", "v5"])
+def test_matches_reference(version):
+    data, output = _data_with_split(version)
+    energy_conv = dict(data.target_energy_conv)
+    expected = _reference_weighting(data, output, data.dp_scoring.astype(np.float64))
+    weighted = data.output_weighting(output, "scoring")
+    assert list(weighted) == data.target_vars
+    for var in data.target_vars:
+        assert weighted[var].shape == expected[var].shape
+        np.testing.assert_allclose(weighted[var], expected[var], rtol=1e-12)
+    # no state is left behind on the object
+    assert data.target_energy_conv == energy_conv
+
+    weights = data.output_weighting(output, "scoring", just_weights=True)
+    assert weights.shape == output.shape
+    flat = np.concatenate([weighted[var].reshape((output.shape[0], -1)) for var in data.target_vars], axis=1)
+    np.testing.assert_allclose(weights * output, flat, rtol=1e-12)
+
+
+def test_in_place_float32():
+    data, output = _data_with_split("v5")
+    expected = data.output_weighting(output.astype(np.float32), "scoring")
+    output = output.astype(np.float32)
+    weighted = data.output_weighting(output, "scoring", in_place=True)
+    assert np.shares_memory(weighted["ptend_qn"], output)
+    assert output.dtype == np.float32
+    for var in data.target_vars:
+        np.testing.assert_allclose(weighted[var], expected[var], rtol=1e-5)
+    with pytest.raises(AssertionError):
+        data.output_weighting(output[:, ::2], "scoring", in_place=True)
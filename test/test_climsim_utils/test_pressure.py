@@ -0,0 +1,63 @@
+"""
+Testing the dp kernels and cache of climsim_utils.pressure
+"""
+
+import numpy as np
+import pytest
+
+from climsim_utils import pressure
+
+from synthetic_data import build_data_utils, NUM_COL
+
+
+def _interface_dp(ps, hyai, hybi, p0=1e5):
+    # pressure at all interfaces, then differenced
+    pressure_grid = p0 * hyai[:, np.newaxis] + hybi[:, np.newaxis] * ps.reshape(-1)[np.newaxis, :]
+    return (pressure_grid[1:] - pressure_grid[:-1]).T.reshape(ps.shape + (len(hyai) - 1,))
+
+
+def test_dp_matches_interface_pressure():
+    data = build_data_utils("v1")
+    hyai, hybi = data.grid_info["hyai"].values, data.grid_info["hybi"].values
+    ps = np.random.default_rng(0).uniform(5.0e4, 1.03e5, (4, NUM_COL))
+    dp = pressure.calc_dp(ps, hyai, hybi)
+    assert dp.dtype == np.float32 and dp.shape == (4, NUM_COL, 60)
+    np.testing.assert_allclose(dp, _interface_dp(ps, hyai, hybi), rtol=1e-5)
+    np.testing.assert_allclose(pressure.calc_dp(ps, hyai, hybi, dtype=np.float64), _interface_dp(ps, hyai, hybi), rtol=1e-10)
+    np.testing.assert_allclose(pressure.calc_pressure(ps, hyai, hybi, dtype=np.float64)[..., -1], ps)
+
+
+def test_torch_kernel():
+    torch = pytest.importorskip("torch")
+    data = build_data_utils("v1")
+    hyai, hybi = data.grid_info["hyai"].values, data.grid_info["hybi"].values
+    ps = np.random.default_rng(0).uniform(5.0e4, 1.03e5, 32)
+    dp = pressure.calc_dp_torch(torch.tensor(ps, dtype=torch.float32), torch.tensor(hyai), hybi)
+    assert dp.dtype == torch.float32 and dp.shape == (32, 60)
+    np.testing.assert_allclose(dp.numpy(), pressure.calc_dp(ps, hyai, hybi), rtol=1e-5)
+
+
+def test_set_pressure_grid_cache(tmp_path):
+    data = build_data_utils("v1")
+    data.input_val = np.random.default_rng(0).uniform(0.0, 1.0, (3 * NUM_COL, data.input_feature_len))
+    data.pressure_cache = pressure.PressureCache(str(tmp_path))
+    data.set_pressure_grid("val")
+    dp = data.dp_val
+    assert dp.dtype == np.float32 and dp.shape == (3, NUM_COL, 60)
+    data.set_pressure_grid("val")
+    assert data.dp_val is dp
+    assert len(list(tmp_path.glob("dp_val_*.npy"))) == 1
+
+    # a new run reads the saved dp
+    rerun = build_data_utils("v1")
+    rerun.input_val = data.input_val
+    rerun.pressure_cache = pressure.PressureCache(str(tmp_path))
+    rerun.set_pressure_grid("val")
+    assert isinstance(rerun.dp_val, np.memmap)
+    np.testing.assert_array_equal(rerun.dp_val, dp)
+
+    # new data for the split replaces the cached dp
+    data.input_val = data.input_val[:NUM_COL]
+    data.set_pressure_grid("val")
+    assert data.dp_val.shape == (1, NUM_COL, 60)
+    assert len(data.pressure_cache.cache) == 1
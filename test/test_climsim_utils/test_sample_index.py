@@ -0,0 +1,56 @@
+"""
+Testing the compact sample index saved by data_utils.save_latlontime_dict
+"""
+
+import numpy as np
+import pytest
+
+from climsim_utils.sample_index import SampleIndex
+
+from synthetic_data import build_data_utils, NUM_COL, FILE_DATES
+
+
+def legacy_latlontime(data, filelist, num_samples):
+    # the dictionary formerly pickled as <split>_indextolatlontime.pkl
+    dates = [file.split(".mli.")[-1][:-len(".nc")] for file in filelist]
+    repeat_dates = [date for date in dates for _ in range(data.num_latlon)]
+    lat, lon = data.grid_info["lat"].values, data.grid_info["lon"].values
+    return {i: [(lat[i % data.num_latlon], lon[i % data.num_latlon]), repeat_dates[i]] for i in range(num_samples)}
+
+
+def test_matches_legacy_dictionary(synthetic_data_path, tmp_path):
+    data = build_data_utils("v1", synthetic_data_path)
+    data.set_regexps("train", ["E3SM-MMF.mli.0001-0[23]-*-*.nc"])
+    data.set_stride_sample("train", 2)
+    data.set_filelist("train", end_idx=None)
+    filelist = data.get_filelist("train")
+    num_samples = len(filelist) * NUM_COL
+
+    data.save_latlontime_dict("train", str(tmp_path) + "/", num_samples)
+    index = SampleIndex.load(tmp_path / "train_sample_index.npz")
+    assert len(index) == num_samples
+    assert index.to_dict() == legacy_latlontime(data, filelist, num_samples)
+
+    idx = np.array([0, NUM_COL - 1, NUM_COL, num_samples - 1, -1])
+    np.testing.assert_array_equal(index.file(idx), [0, 0, 1, 2, 2])
+    np.testing.assert_array_equal(index.column(idx), [0, NUM_COL - 1, 0, NUM_COL - 1, NUM_COL - 1])
+    np.testing.assert_array_equal(index.date(idx), [FILE_DATES[0], FILE_DATES[0], FILE_DATES[2], FILE_DATES[4], FILE_DATES[4]])
+    np.testing.assert_array_equal(index.lat(idx), data.grid_info["lat"].values[index.column(idx)])
+    np.testing.assert_array_equal(index.sample(index.file(idx[:4]), index.column(idx[:4])), idx[:4])
+    with pytest.raises(IndexError):
+        index.lat(num_samples)
+
+
+def test_subset_of_columns():
+    lat = np.linspace(-90, 90, 6)
+    lon = np.linspace(0, 300, 6)
+    index = SampleIndex(["0001-02-01-00000", "0001-02-01-01200"], [1, 2, 4], lat, lon, num_samples=5)
+    idx = np.arange(5)
+    np.testing.assert_array_equal(index.column(idx), [1, 2, 4, 1, 2])
+    np.testing.assert_array_equal(index.lon(idx), lon[[1, 2, 4, 1, 2]])
+    np.testing.assert_array_equal(index.date(idx), ["0001-02-01-00000"] * 3 + ["0001-02-01-01200"] * 2)
+    assert index.sample(1, 2) == 4
+    with pytest.raises(KeyError):
+        index.sample(0, 3)
+    with pytest.raises(IndexError):
+        index.sample(1, 4)
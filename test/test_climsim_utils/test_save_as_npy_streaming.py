@@ -0,0 +1,33 @@
+"""
+Testing the streaming, process-pool conversion mode of data_utils.save_as_npy
+"""
+
+import os
+import h5py
+import numpy as np
+import pytest
+
+from synthetic_data import build_data_utils
+
+
+@pytest.mark.parametrize("num_workers", [0, 2])
+def test_streaming_matches_in_memory_conversion(synthetic_data_path, tmp_path, num_workers):
+    data = build_data_utils("v2", synthetic_data_path, save_h5=True)
+    data.set_regexps("train", ["E3SM-MMF.mli.0001-0[23]-*-*.nc"])
+    data.set_stride_sample("train", 1)
+    data.set_filelist("train", end_idx=None)
+    num_files = len(data.get_filelist("train"))
+
+    in_memory_path = str(tmp_path / "in_memory")
+    streaming_path = str(tmp_path / "streaming")
+    data.save_as_npy("train", save_path=in_memory_path)
+    data.save_as_npy("train", save_path=streaming_path, streaming=True, num_workers=num_workers, max_files_in_flight=2)
+
+    for option, feature_len in [("input", data.input_feature_len), ("target", data.target_feature_len)]:
+        expected = np.load(os.path.join(in_memory_path, f"train_{option}.npy"))
+        streamed = np.load(os.path.join(streaming_path, f"train_{option}.npy"))
+        assert streamed.dtype == np.float32
+        assert streamed.shape == (num_files * data.num_latlon, feature_len)
+        np.testing.assert_array_equal(streamed, expected)
+        with h5py.File(os.path.join(streaming_path, f"train_{option}.h5"), "r") as hdf:
+            np.testing.assert_array_equal(hdf["data"][:], expected)
@@ -0,0 +1,44 @@
+"""
+Testing the chunked HDF5 shard writer data_utils.save_as_shards
+"""
+
+import json
+import os
+import h5py
+import numpy as np
+import pytest
+
+from synthetic_data import build_data_utils
+
+
+@pytest.mark.parametrize("num_workers, compression", [(0, None), (2, "gzip")])
+def test_shards_match_in_memory_conversion(synthetic_data_path, tmp_path, num_workers, compression):
+    data = build_data_utils("v2", synthetic_data_path)
+    data.set_regexps("train", ["E3SM-MMF.mli.0001-0[23]-*-*.nc"])
+    data.set_stride_sample("train", 1)
+    data.set_filelist("train", end_idx=None)
+    num_samples = len(data.get_filelist("train")) * data.num_latlon
+
+    in_memory_path = str(tmp_path / "in_memory")
+    shard_path = str(tmp_path / "shards")
+    data.save_as_npy("train", save_path=in_memory_path)
+    # shards of 1000 rows, so the rows of some files straddle two shards
+    manifest = data.save_as_shards("train", save_path=shard_path, shard_size=1000, chunk_rows=128,
+                                   compression=compression, num_workers=num_workers, max_files_in_flight=2)
+
+    with open(os.path.join(shard_path, "train_manifest.json")) as f:
+        assert json.load(f) == manifest
+    assert manifest["num_samples"] == num_samples
+    assert [shard["num_rows"] for shard in manifest["shards"]] == [1000] * (num_samples // 1000) + [num_samples % 1000]
+    assert manifest["input_feature_len"] == data.input_feature_len
+    assert manifest["input_vars"] == data.input_vars
+
+    for option in ["input", "target"]:
+        expected = np.load(os.path.join(in_memory_path, f"train_{option}.npy"))
+        shards = []
+        for shard in manifest["shards"]:
+            with h5py.File(os.path.join(shard_path, shard["file"]), "r") as hdf:
+                assert hdf[option].chunks == (128, expected.shape[1])
+                assert hdf[option].compression == compression
+                shards.append(hdf[option][:])
+        np.testing.assert_array_equal(np.concatenate(shards), expected)
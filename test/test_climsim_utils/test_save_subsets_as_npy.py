@@ -0,0 +1,65 @@
+"""
+Testing the one-pass multi-subset export data_utils.save_subsets_as_npy
+"""
+
+import os
+import numpy as np
+import pytest
+
+from synthetic_data import build_data_utils, open_norm_datasets
+
+
+def _train_data(version, synthetic_data_path, normalize):
+    data = build_data_utils(version, synthetic_data_path, normalize=normalize, nc_reader="netcdf4")
+    data.set_regexps("train", ["E3SM-MMF.mli.0001-0[23]-*-*.nc"])
+    data.set_stride_sample("train", 1)
+    data.set_filelist("train", end_idx=None)
+    return data
+
+
+@pytest.mark.parametrize("norm_version, subsets, normalize, num_workers", [
+    ("v1", ["v1", "v2", "v2_rh", "v4", "v5"], False, 0),
+    ("v5", ["v5"], True, 2),
+])
+def test_subsets_match_separate_exports(synthetic_data_path, tmp_path, norm_version, subsets, normalize, num_workers):
+    data = _train_data(norm_version, synthetic_data_path, normalize)
+    input_vars = data.input_vars
+
+    reads = []
+    if num_workers == 0:
+        read_ncvars = data.read_ncvars
+        data.read_ncvars = lambda file, file_vars: reads.append(file) or read_ncvars(file, file_vars)
+    data.save_subsets_as_npy("train", subsets, save_path=str(tmp_path / "one_pass"), num_workers=num_workers)
+    if num_workers == 0:
+        del data.read_ncvars
+        # one read of every input and output file
+        assert len(reads) == 2 * len(data.get_filelist("train")) == len(set(reads))
+    # the current subset is unchanged
+    assert data.input_vars == input_vars
+
+    for subset in subsets:
+        getattr(data, f"set_to_{subset}_vars")()
+        separate_path = str(tmp_path / "separate" / subset)
+        data.save_as_npy_streaming("train", save_path=separate_path, num_workers=0)
+        for option in ["input", "target"]:
+            expected = np.load(os.path.join(separate_path, f"train_{option}.npy"))
+            result = np.load(str(tmp_path / "one_pass" / subset / f"train_{option}.npy"))
+            np.testing.assert_array_equal(result, expected)
+
+
+def test_normalized_subsets_use_their_own_norms(synthetic_data_path, tmp_path):
+    data = _train_data("v5", synthetic_data_path, True)
+    with pytest.raises(AssertionError):
+        data.get_subset_specs(["v2", "v5"])
+    subsets = {"v2": open_norm_datasets("v2"), "v5": open_norm_datasets("v5")}
+    data.save_subsets_as_npy("train", subsets, save_path=str(tmp_path / "one_pass"), num_workers=0)
+
+    for subset in subsets:
+        # a normal export of the subset, with its own normalization files
+        separate = _train_data(subset, synthetic_data_path, True)
+        separate_path = str(tmp_path / "separate" / subset)
+        separate.save_as_npy("train", save_path=separate_path)
+        for option in ["input", "target"]:
+            expected = np.load(os.path.join(separate_path, f"train_{option}.npy"))
+            result = np.load(str(tmp_path / "one_pass" / subset / f"train_{option}.npy"))
+            np.testing.assert_array_equal(result, expected)
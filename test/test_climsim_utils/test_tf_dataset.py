@@ -0,0 +1,51 @@
+"""
+Testing that the tf.data pipeline of load_ncdata_with_generator yields the float32 rows of every file exactly once
+"""
+
+import numpy as np
+import pytest
+
+tf = pytest.importorskip("tensorflow")
+
+from synthetic_data import build_data_utils, NUM_COL
+
+
+def _train_data(synthetic_data_path):
+    data = build_data_utils("v2", synthetic_data_path, ml_backend="tensorflow")
+    data.set_regexps("train", ["E3SM-MMF.mli.0001-0[23]-*-*.nc"])
+    data.set_stride_sample("train", 1)
+    data.set_filelist("train", end_idx=None)
+    rows = [data.load_ncfile_float32(file) for file in data.get_filelist("train")]
+    return data, np.concatenate([row[0] for row in rows]), np.concatenate([row[1] for row in rows])
+
+
+def _sorted_rows(x):
+    return x[np.lexsort(x.T[::-1])]
+
+
+def test_rows_in_file_order(synthetic_data_path):
+    data, expected_input, expected_target = _train_data(synthetic_data_path)
+    dataset = data.load_ncdata_with_generator("train")
+    assert dataset.element_spec[0].shape == (data.input_feature_len,)
+    assert dataset.element_spec[0].dtype == tf.float32
+    x, y = next(iter(dataset.batch(len(expected_input)).as_numpy_iterator()))
+    np.testing.assert_array_equal(x, expected_input)
+    np.testing.assert_array_equal(y, expected_target)
+
+    files = list(data.load_ncdata_with_generator("train", unbatch=False).as_numpy_iterator())
+    assert len(files) == len(data.get_filelist("train")) and files[0][0].shape == (NUM_COL, data.input_feature_len)
+
+
+def test_shuffle_and_cache(synthetic_data_path, tmp_path):
+    data, expected_input, expected_target = _train_data(synthetic_data_path)
+    expected = _sorted_rows(np.concatenate([expected_input, expected_target], axis=1))
+    dataset = data.load_ncdata_with_generator("train", shuffle=True, shuffle_buffer_size=500, seed=1,
+                                              cache=str(tmp_path / "train_cache"))
+    epochs = []
+    for _ in range(2):
+        x, y = next(iter(dataset.batch(len(expected_input)).as_numpy_iterator()))
+        np.testing.assert_array_equal(_sorted_rows(np.concatenate([x, y], axis=1)), expected)
+        epochs.append(x)
+    assert not np.array_equal(epochs[0], expected_input)
+    assert not np.array_equal(epochs[0], epochs[1])
+    assert list(tmp_path.glob("train_cache*"))
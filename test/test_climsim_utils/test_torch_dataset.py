@@ -0,0 +1,90 @@
+"""
+Testing that the PyTorch netCDF dataset of load_ncdata_with_generator reads every sample exactly once across workers and ranks
+"""
+
+import numpy as np
+import pytest
+import torch
+
+from climsim_utils.torch_dataset import NetCDFIterableDataset
+
+from synthetic_data import build_data_utils, NUM_COL
+
+
+def _train_data(synthetic_data_path):
+    data = build_data_utils("v2", synthetic_data_path, ml_backend="pytorch")
+    data.set_regexps("train", ["E3SM-MMF.mli.0001-0[23]-*-*.nc"])
+    data.set_stride_sample("train", 1)
+    data.set_filelist("train", end_idx=None)
+    rows = [data.load_ncfile(file) for file in data.get_filelist("train")]
+    expected_input = np.float32(np.concatenate([row[0] for row in rows]))
+    expected_input[~np.isfinite(expected_input)] = 0
+    return data, expected_input, np.float32(np.concatenate([row[1] for row in rows]))
+
+
+def _sorted_rows(x):
+    return x[np.lexsort(x.T[::-1])]
+
+
+@pytest.mark.parametrize("num_workers, world_size", [(0, 1), (2, 1), (2, 2)])
+def test_files_partitioned_between_workers_and_ranks(synthetic_data_path, num_workers, world_size):
+    data, expected_input, expected_target = _train_data(synthetic_data_path)
+    inputs, targets = [], []
+    for rank in range(world_size):
+        dataset = data.load_ncdata_with_generator("train", shuffle=True, seed=3)
+        dataset.rank, dataset.world_size = rank, world_size
+        dataset.set_epoch(1)
+        for x, y in torch.utils.data.DataLoader(dataset, batch_size=None, num_workers=num_workers):
+            assert x.dtype == torch.float32 and x.shape == (NUM_COL, data.input_feature_len)
+            inputs.append(x.numpy())
+            targets.append(y.numpy())
+    # the 5 files are padded to a multiple of world_size by repeating files
+    assert len(inputs) == -(-len(data.get_filelist("train")) // world_size) * world_size
+    np.testing.assert_array_equal(np.unique(np.concatenate(inputs), axis=0), np.unique(expected_input, axis=0))
+    np.testing.assert_array_equal(np.unique(np.concatenate(targets), axis=0), np.unique(expected_target, axis=0))
+
+
+@pytest.mark.parametrize("drop_last", [False, True])
+def test_ranks_read_the_same_number_of_files(drop_last):
+    filelist = [f"file_{i}.nc" for i in range(7)]
+    for world_size in [2, 3]:
+        for epoch in range(3):
+            rank_files = []
+            for rank in range(world_size):
+                dataset = NetCDFIterableDataset(None, filelist, shuffle=True, rank=rank, world_size=world_size,
+                                                drop_last=drop_last)
+                dataset.set_epoch(epoch)
+                rank_files.append(dataset.worker_files())
+            num_files = len(filelist) // world_size if drop_last else -(-len(filelist) // world_size)
+            assert all(len(files) == num_files for files in rank_files)
+            read = set(sum(rank_files, []))
+            assert read <= set(filelist)
+            if not drop_last:
+                assert read == set(filelist)
+
+
+def test_shuffle_buffer_yields_every_row_once(synthetic_data_path):
+    data, expected_input, expected_target = _train_data(synthetic_data_path)
+    dataset = data.load_ncdata_with_generator("train", shuffle_buffer_size=500, prefetch_files=1)
+    loader = torch.utils.data.DataLoader(dataset, batch_size=128, num_workers=2)
+    batches = list(loader)
+    x = torch.cat([batch[0] for batch in batches]).numpy()
+    y = torch.cat([batch[1] for batch in batches]).numpy()
+    assert x.shape == expected_input.shape
+    # rows are mixed across files
+    assert not np.array_equal(x[:NUM_COL], expected_input[:NUM_COL])
+    np.testing.assert_array_equal(_sorted_rows(np.concatenate([x, y], axis=1)),
+                                  _sorted_rows(np.concatenate([expected_input, expected_target], axis=1)))
+
+
+def test_numpy_iterator_and_early_stop(synthetic_data_path):
+    data, _, _ = _train_data(synthetic_data_path)
+    dataset = data.load_ncdata_with_generator("train", prefetch_files=1)
+    for (npy_input, npy_target), file in zip(dataset.as_numpy_iterator(), data.get_filelist("train")):
+        expected_input, expected_target = data.load_ncfile(file)
+        np.testing.assert_array_equal(npy_input, expected_input)
+        np.testing.assert_array_equal(npy_target, expected_target)
+    # stopping after the first file does not hang the prefetching thread
+    iterator = iter(dataset)
+    next(iterator)
+    iterator.close()
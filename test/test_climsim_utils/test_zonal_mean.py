@@ -0,0 +1,50 @@
+"""
+Testing the latitude-band averaging operator ZonalMean and its use in data_utils.reshape_daily
+"""
+
+import numpy as np
+import pytest
+
+from climsim_utils.zonal_mean import ZonalMean
+
+from synthetic_data import build_data_utils, NUM_COL, NUM_LEV
+
+
+def test_unique_latitudes_match_loop(synthetic_data_path):
+    data = build_data_utils("v1", synthetic_data_path)
+    lat = data.grid_info["lat"].values
+    x = np.random.default_rng(0).normal(size=(3, NUM_COL, NUM_LEV))
+    expected = np.stack([x[:, lat == band_lat, :].mean(axis=1) for band_lat in data.lats], axis=1)
+    np.testing.assert_allclose(data.zonal_mean(x, axis=1), expected, rtol=1e-12, atol=1e-14)
+    np.testing.assert_allclose(data.zonal_mean(x[0], axis=0), expected[0], rtol=1e-12, atol=1e-14)
+    for band in range(len(data.lats)):
+        np.testing.assert_array_equal(np.sort(data.zonal_mean.band_columns(band)), np.flatnonzero(lat == data.lats[band]))
+
+
+@pytest.mark.parametrize("bins", [np.arange(-90, 91, 10), np.arange(-60, 91, 1)])
+def test_area_weighted_bins_match_loop(synthetic_data_path, bins):
+    data = build_data_utils("v1", synthetic_data_path)
+    lat = data.grid_info["lat"].values
+    area = data.grid_info["area"].values
+    x = np.random.default_rng(1).normal(size=(NUM_COL, NUM_LEV, 2))
+    band = np.digitize(lat, bins) - 1
+    expected = np.stack([np.average(x[band == i], axis=0, weights=area[band == i]) if np.any(band == i)
+                         else np.full((NUM_LEV, 2), np.nan) for i in range(len(bins) - 1)])
+    zonal_mean = data.get_zonal_mean(area_weighted=True, bins=bins)
+    np.testing.assert_allclose(zonal_mean(x, axis=0), expected, rtol=1e-12, atol=1e-14)
+    np.testing.assert_array_equal(zonal_mean.lats, (bins[:-1] + bins[1:]) / 2)
+
+
+def test_reshape_daily_matches_loop(synthetic_data_path):
+    data = build_data_utils("v1", synthetic_data_path)
+    output = np.random.default_rng(2).normal(size=(24 * NUM_COL, data.target_feature_len))
+    ptend_t_daily_long, ptend_q0001_daily_long = data.reshape_daily(output)
+    for var, result in [("ptend_t", ptend_t_daily_long), ("ptend_q0001", ptend_q0001_daily_long)]:
+        daily = output[:, data.target_layout.slice(var)].reshape(2, 12, NUM_COL, NUM_LEV).mean(axis=1)
+        expected = np.array([daily[:, indices, :].mean(axis=1) for indices in data.lat_indices_list])
+        np.testing.assert_allclose(result, expected, rtol=1e-12, atol=1e-14)
+
+
+def test_empty_band_is_nan():
+    zonal_mean = ZonalMean([-45.0, 45.0, 50.0, 95.0], weights=[1.0, 1.0, 3.0, 1.0], bins=[-90, 0, 30, 90])
+    np.testing.assert_array_equal(zonal_mean(np.array([[1.0, 2.0, 4.0, 100.0]])), [[1.0, np.nan, 3.5]])
@@ -0,0 +1,77 @@
+"""
+Testing the rolling-window feature expansion of climsim_adding_input against process_one_file
+"""
+
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+import xarray as xr
+
+BASE_DIR = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(BASE_DIR / "online_testing" / "data_preparation" / "expand_feature"))
+
+import climsim_adding_input
+from climsim_adding_input import (NEW_VARS, GRID_VARS, PREV_INPUT_VARS, PREV_OUTPUT_VARS,
+                                  expand_files, process_one_file, split_timeline)
+
+NUM_FILES = 7
+
+
+@pytest.fixture
+def nc_files(tmp_path):
+    grid_info = xr.open_dataset(BASE_DIR / "grid_info" / "ClimSim_low-res_grid-info.nc")
+    rng = np.random.default_rng(0)
+    files = []
+    for k in range(NUM_FILES):
+        ds_in = xr.Dataset({"lat": grid_info["lat"], "lon": grid_info["lon"]})
+        ds_out = xr.Dataset()
+        for var in PREV_INPUT_VARS + ["pbuf_ozone"]:
+            dims = ("lev", "ncol") if var.startswith("state_") and var != "state_ps" or var == "pbuf_ozone" else ("ncol",)
+            ds_in[var] = (dims, rng.normal(size=(4, 384) if len(dims) == 2 else 384))
+        for var in PREV_OUTPUT_VARS:
+            ds_out[var] = (("lev", "ncol"), rng.normal(size=(4, 384)))
+        # files of two months, so the timeline crosses a directory
+        month_dir = tmp_path / f"0001-0{2 + k // 4}"
+        month_dir.mkdir(exist_ok=True)
+        path = month_dir / f"E3SM-MMF.mli.0001-0{2 + k // 4}-01-{1200 * k:05d}.nc"
+        ds_in.to_netcdf(path)
+        ds_out.to_netcdf(str(path).replace("mli", "mlo"))
+        files.append(str(path))
+    return sorted(files), grid_info["lat"], grid_info["lon"]
+
+
+def test_split_timeline():
+    assert split_timeline(10, 3) == [(2, 5), (5, 7), (7, 10)]
+    assert split_timeline(4, 8) == [(2, 3), (3, 4)]
+
+
+@pytest.mark.parametrize("num_processes", [1, 2])
+def test_rolling_window_matches_process_one_file(nc_files, monkeypatch, num_processes):
+    files, lat, lon = nc_files
+    for i in range(2, NUM_FILES):
+        process_one_file((i, files, lat, lon, "mli", "mlo", "mlexpand"))
+
+    reads = []
+    load_vars = climsim_adding_input.load_vars
+    monkeypatch.setattr(climsim_adding_input, "load_vars", lambda path, var_names=None: reads.append(path) or load_vars(path, var_names))
+    expand_files(files, lat, lon, input_abbrev_new="mlrolling", num_processes=num_processes)
+    if num_processes == 1:
+        # every file is read once, apart from the last output file that no later timestep needs
+        assert len(reads) == 2 * NUM_FILES - 1 and len(set(reads)) == len(reads)
+
+    for path in files[2:]:
+        with xr.open_dataset(path.replace("mli", "mlexpand")) as expected, xr.open_dataset(path.replace("mli", "mlrolling")) as result:
+            xr.testing.assert_identical(result, expected)
+    assert not Path(files[1].replace("mli", "mlrolling")).exists()
+
+
+def test_sidecar(nc_files):
+    files, lat, lon = nc_files
+    expand_files(files, lat, lon, input_abbrev_new="mlside", num_processes=1, sidecar=True, start=3, stop=5)
+    process_one_file((4, files, lat, lon, "mli", "mlo", "mlexpand"))
+    assert not Path(files[2].replace("mli", "mlside")).exists()
+    with xr.open_dataset(files[4].replace("mli", "mlside")) as sidecar, xr.open_dataset(files[4].replace("mli", "mlexpand")) as expected:
+        assert set(sidecar.data_vars) == set(NEW_VARS + GRID_VARS)
+        xr.testing.assert_identical(sidecar, expected[NEW_VARS + GRID_VARS])
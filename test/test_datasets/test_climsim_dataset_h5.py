@@ -0,0 +1,227 @@
+"""
+Testing script for the batched reading path of the Unet_v5 h5 dataset
+"""
+
+import pickle
+import sys
+from pathlib import Path
+
+import h5py
+import numpy as np
+import pytest
+import torch
+import xarray as xr
+
+from climsim_utils.data_utils import data_utils
+from climsim_utils.norm_bundle import NormBundle
+
+BASE_DIR = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(BASE_DIR / "online_testing" / "baseline_models" / "Unet_v5" / "training"))
+
+import climsim_datapip_h5
+from climsim_datapip_h5 import climsim_dataset_h5, climsim_block_batch_sampler, climsim_file_batch_sampler
+from climsim_input_transform import ClimsimInputTransform
+from climsim_datapip import climsim_dataset
+
+
+def _v5_data_utils():
+    norm_path = BASE_DIR / "preprocessing" / "normalizations"
+    data = data_utils(
+        grid_info=xr.open_dataset(BASE_DIR / "grid_info" / "ClimSim_low-res_grid-info.nc"),
+        input_mean=xr.open_dataset(norm_path / "inputs" / "input_mean_v5_pervar.nc"),
+        input_max=xr.open_dataset(norm_path / "inputs" / "input_max_v5_pervar.nc"),
+        input_min=xr.open_dataset(norm_path / "inputs" / "input_min_v5_pervar.nc"),
+        output_scale=xr.open_dataset(norm_path / "outputs" / "output_scale_std_lowerthred_v5.nc"),
+        ml_backend="pytorch",
+    )
+    data.set_to_v5_vars()
+    return data
+
+
+@pytest.fixture(scope="module")
+def h5_dataset_path(tmp_path_factory):
+    parent_path = tmp_path_factory.mktemp("h5_dataset")
+    rng = np.random.default_rng(0)
+    for i, num_samples in enumerate([50, 37]):
+        file_dir = parent_path / f"part{i}"
+        file_dir.mkdir()
+        with h5py.File(file_dir / "train_input.h5", "w") as f:
+            f.create_dataset("data", data=rng.uniform(0, 2, size=(num_samples, 1405)).astype(np.float32))
+        with h5py.File(file_dir / "train_target.h5", "w") as f:
+            f.create_dataset("data", data=rng.normal(size=(num_samples, 308)).astype(np.float32))
+    return parent_path
+
+
+def _dataset_options(data, **options):
+    input_sub, input_div, out_scale = data.save_norm(write=False)
+    defaults = dict(
+        input_sub=input_sub,
+        input_div=input_div,
+        out_scale=out_scale,
+        qinput_prune=True,
+        output_prune=True,
+        strato_lev=15,
+        strato_lev_out=12,
+        qn_lbd=np.linspace(1e5, 1e7, 60),
+        input_layout=data.input_layout,
+        target_layout=data.target_layout,
+        strato_lev_qinput=-1,
+    )
+    return {**defaults, **options}
+
+
+def _build_dataset(h5_dataset_path, data, **options):
+    options = _dataset_options(data, **options)
+    return climsim_dataset_h5(parent_path=str(h5_dataset_path), **options), options
+
+
+@pytest.mark.parametrize(
+    "options",
+    [
+        dict(aggressive_pruning=True, decouple_cloud=True, input_clip=True, strato_lev_tinput=5, qn_tscaled=True),
+        dict(input_clip=True, input_clip_rhonly=True, strato_lev_tinput=-1),
+    ],
+)
+def test_batch_matches_per_sample(h5_dataset_path, options):
+    dataset, _ = _build_dataset(h5_dataset_path, _v5_data_utils(), **options)
+    assert len(dataset) == 87
+    # a contiguous block read as hyperslabs, and an unsorted batch with a duplicate and far away indices
+    for indices in [list(range(45, 60)), [52, 3, 49, 50, 4, 4, 86, 10]]:
+        batch = dataset[indices]
+        for b, values in enumerate(batch):
+            expected = torch.stack([dataset[i][b] for i in indices])
+            assert torch.equal(values, expected)
+
+
+def test_block_batch_sampler():
+    sampler = climsim_block_batch_sampler(103, 10, shuffle=True, drop_last=True, num_replicas=2, rank=0)
+    other = climsim_block_batch_sampler(103, 10, shuffle=True, drop_last=True, num_replicas=2, rank=1)
+    batches = list(sampler)
+    assert len(batches) == len(sampler) == 5
+    assert all(np.diff(batch).tolist() == [1] * 9 for batch in batches)
+    seen = np.concatenate(batches + list(other))
+    assert len(np.unique(seen)) == 100
+
+    shuffled = climsim_block_batch_sampler(103, 10, contiguous=False, drop_last=False)
+    batches = list(shuffled)
+    assert len(batches) == 11
+    assert sorted(np.concatenate(batches).tolist()) == list(range(103))
+    shuffled.set_epoch(1)
+    assert list(shuffled) != batches
+
+
+def test_lazy_file_handles_and_manifest(h5_dataset_path, tmp_path, monkeypatch):
+    data = _v5_data_utils()
+    manifest_path = str(tmp_path / "manifest.json")
+    dataset, options = _build_dataset(h5_dataset_path, data, strato_lev_tinput=-1, max_open_files=1,
+                                      manifest_path=manifest_path)
+    assert dataset._open_files == {}
+    expected = dataset[[0, 60]]
+    assert len(dataset._open_files) == 1
+    restored = pickle.loads(pickle.dumps(dataset))
+    assert restored._open_files == {}
+    for value, expected_value in zip(restored[[0, 60]], expected):
+        assert torch.equal(value, expected_value)
+
+    # the row counts are read from the manifest without opening the files
+    def no_open(*args, **kwargs):
+        raise AssertionError("h5 file opened")
+    with monkeypatch.context() as m:
+        m.setattr(climsim_datapip_h5.h5py, "File", no_open)
+        cached = climsim_dataset_h5(parent_path=str(h5_dataset_path), **options)
+    assert cached.samples_per_file == dataset.samples_per_file
+
+    # a file rewritten with another number of rows but the same size is counted again
+    regenerated = tmp_path / "regenerated"
+    (regenerated / "part0").mkdir(parents=True)
+    for name, num_rows in [("train_input.h5", 20), ("train_target.h5", 20)]:
+        with h5py.File(regenerated / "part0" / name, "w") as f:
+            f.create_dataset("data", shape=(num_rows, 4), dtype=np.float32)
+    options["manifest_path"] = str(tmp_path / "regenerated.json")
+    assert climsim_dataset_h5(parent_path=str(regenerated), **options).samples_per_file == [20]
+    size = (regenerated / "part0" / "train_input.h5").stat().st_size
+    with h5py.File(regenerated / "part0" / "train_input.h5", "w") as f:
+        f.create_dataset("data", shape=(10, 8), dtype=np.float32)
+    assert (regenerated / "part0" / "train_input.h5").stat().st_size == size
+    assert climsim_dataset_h5(parent_path=str(regenerated), **options).samples_per_file == [10]
+
+
+def test_file_batch_sampler(h5_dataset_path):
+    samples_per_file = [48] * 8
+    offsets = np.cumsum([0] + samples_per_file)
+    ranks = [climsim_file_batch_sampler(samples_per_file, 8, num_workers=2, num_replicas=2, rank=rank) for rank in range(2)]
+    rank_batches = [list(sampler) for sampler in ranks]
+    assert len(rank_batches[0]) == len(rank_batches[1]) == len(ranks[0])
+    worker_files = []
+    for batches in rank_batches:
+        # batches alternate between the workers, and every worker reads its own files
+        for worker in range(2):
+            files = np.searchsorted(offsets, np.concatenate(batches[worker::2]), side="right") - 1
+            worker_files.append(set(files.tolist()))
+    assert sum(len(files) for files in worker_files) == len(set.union(*worker_files)) == len(samples_per_file)
+    assert not set(np.concatenate(rank_batches[0])) & set(np.concatenate(rank_batches[1]))
+    ranks[0].set_epoch(1)
+    assert list(ranks[0]) != rank_batches[0]
+
+    # a single file is split into ranges, and all its samples are read once
+    sampler = climsim_file_batch_sampler([100], 10, num_workers=2, range_size=25, block_size=5, drop_last=False)
+    assert sorted(np.concatenate(list(sampler)).tolist()) == list(range(100))
+
+    dataset, _ = _build_dataset(h5_dataset_path, _v5_data_utils(), strato_lev_tinput=-1)
+    sampler = climsim_file_batch_sampler(dataset.samples_per_file, 16, num_workers=2, drop_last=False)
+    loader = torch.utils.data.DataLoader(dataset, batch_size=None, sampler=sampler, num_workers=2)
+    for batch, indices in zip(loader, sampler):
+        assert torch.equal(batch[0], dataset[indices][0])
+
+
+@pytest.mark.parametrize(
+    "options",
+    [
+        dict(aggressive_pruning=True, decouple_cloud=True, input_clip=True, strato_lev_tinput=5),
+        dict(input_clip=True, input_clip_rhonly=True, strato_lev_tinput=-1),
+        dict(qinput_prune=False, strato_lev_tinput=-1, qn_logtransform=True),
+    ],
+)
+def test_input_transform_matches_dataset(h5_dataset_path, options):
+    data = _v5_data_utils()
+    dataset, dataset_options = _build_dataset(h5_dataset_path, data, **options)
+    raw_dataset, _ = _build_dataset(h5_dataset_path, data, return_raw=True, **options)
+    transform = ClimsimInputTransform(**dataset_options)
+    scripted = torch.jit.script(transform)
+
+    indices = list(range(40, 60))
+    x, y = dataset[indices]
+    x_raw, y_raw = raw_dataset[indices]
+    for module in (transform, scripted):
+        torch.testing.assert_close(module(x_raw), x, rtol=1e-5, atol=1e-5)
+        torch.testing.assert_close(module.transform_target(y_raw), y)
+    y_inverse = transform.inverse_target(transform.transform_target(y_raw))
+    torch.testing.assert_close(y_inverse[:, 60:72], torch.zeros(20, 12))
+    torch.testing.assert_close(y_inverse[:, 72:120], y_raw[:, 72:120])
+
+
+def test_input_transform_from_norm_bundle(tmp_path):
+    data = _v5_data_utils()
+    qn_lbd = np.linspace(1e5, 1e7, 60)
+    data.save_norm_bundle(tmp_path / "norm.npz", qn_lbd=qn_lbd, variable_subset="v5")
+    options = dict(qinput_prune=True, output_prune=True, strato_lev=15, strato_lev_out=12, input_clip=True)
+    transform = ClimsimInputTransform.from_norm_bundle(NormBundle.load(tmp_path / "norm.npz"), **options)
+    expected = ClimsimInputTransform(**{**_dataset_options(data, qn_lbd=qn_lbd), **options})
+    for name, buffer in expected.named_buffers():
+        assert torch.equal(getattr(transform, name), buffer)
+
+
+def test_npy_dataset_mmap(tmp_path):
+    data = _v5_data_utils()
+    rng = np.random.default_rng(2)
+    np.save(tmp_path / "val_input.npy", rng.uniform(0, 2, size=(10, 1405)).astype(np.float32))
+    np.save(tmp_path / "val_target.npy", rng.normal(size=(10, 308)).astype(np.float32))
+    options = _dataset_options(data, input_clip=True, strato_lev_tinput=-1)
+    paths = dict(input_paths=str(tmp_path / "val_input.npy"), target_paths=str(tmp_path / "val_target.npy"))
+    in_memory = climsim_dataset(**paths, **options)
+    mapped = climsim_dataset(**paths, mmap_mode="r", **options)
+    assert isinstance(mapped.inputs, np.memmap)
+    # rows are transformed on a copy, so reading a row twice gives the same result
+    for i in [0, 7, 0]:
+        for value, expected in zip(mapped[i], in_memory[i]):
+            assert torch.equal(value, expected)
@@ -0,0 +1,81 @@
+"""
+Testing script for the sharded dataset and the shard batch sampler of the Unet_v5 training
+"""
+
+import json
+import sys
+from pathlib import Path
+
+import h5py
+import numpy as np
+import pytest
+import torch
+
+BASE_DIR = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(BASE_DIR / "online_testing" / "baseline_models" / "Unet_v5" / "training"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from climsim_datapip_shards import climsim_dataset_shards, climsim_shard_batch_sampler
+from test_climsim_dataset_h5 import _v5_data_utils, _build_dataset
+
+SHARD_ROWS = [64, 64, 40]
+
+
+@pytest.fixture(scope="module")
+def shard_path(tmp_path_factory):
+    parent_path = tmp_path_factory.mktemp("shards")
+    rng = np.random.default_rng(1)
+    inputs = rng.uniform(0, 2, size=(sum(SHARD_ROWS), 1405)).astype(np.float32)
+    targets = rng.normal(size=(sum(SHARD_ROWS), 308)).astype(np.float32)
+    shards = []
+    start = 0
+    for k, num_rows in enumerate(SHARD_ROWS):
+        shard_file = f"train_shard_{k:05d}.h5"
+        with h5py.File(parent_path / shard_file, "w") as f:
+            f.create_dataset("input", data=inputs[start:start + num_rows], chunks=(16, 1405), compression="gzip")
+            f.create_dataset("target", data=targets[start:start + num_rows], chunks=(16, 308), compression="gzip")
+        shards.append({"file": shard_file, "num_rows": num_rows})
+        start += num_rows
+    with open(parent_path / "train_manifest.json", "w") as f:
+        json.dump({"chunk_rows": 16, "shards": shards}, f)
+    # the same rows as a single train_input.h5/train_target.h5 pair
+    h5_path = parent_path / "h5"
+    h5_path.mkdir()
+    with h5py.File(h5_path / "train_input.h5", "w") as f:
+        f.create_dataset("data", data=inputs)
+    with h5py.File(h5_path / "train_target.h5", "w") as f:
+        f.create_dataset("data", data=targets)
+    return parent_path
+
+
+def test_shards_match_h5_dataset(shard_path):
+    data = _v5_data_utils()
+    h5_dataset, options = _build_dataset(shard_path / "h5", data, input_clip=True, strato_lev_tinput=-1)
+    dataset = climsim_dataset_shards(parent_path=str(shard_path), **options)
+    assert len(dataset) == len(h5_dataset) == sum(SHARD_ROWS)
+    for i in [0, 63, 64, 167]:
+        for value, expected in zip(dataset[i], h5_dataset[i]):
+            assert torch.equal(value, expected)
+    indices = list(range(56, 80)) + [3, 150]
+    for value, expected in zip(dataset[indices], h5_dataset[indices]):
+        assert torch.equal(value, expected)
+
+
+def test_shard_batch_sampler():
+    sampler = climsim_shard_batch_sampler(SHARD_ROWS, batch_size=32, block_size=16, shards_per_window=2, drop_last=False)
+    batches = list(sampler)
+    assert len(batches) == len(sampler) == 6
+    assert sorted(np.concatenate(batches).tolist()) == list(range(sum(SHARD_ROWS)))
+    # batches are made of whole blocks, apart from the partial last block of a shard
+    offsets = np.cumsum([0] + SHARD_ROWS)
+    for batch in batches[:-1]:
+        shard = np.searchsorted(offsets, batch, side="right") - 1
+        block = (np.array(batch) - offsets[shard]) // 16
+        assert len(set(zip(shard, block))) <= 3
+    sampler.set_epoch(1)
+    assert list(sampler) != batches
+
+    ranks = [climsim_shard_batch_sampler(SHARD_ROWS, 32, 16, num_replicas=2, rank=rank) for rank in range(2)]
+    rank_batches = [list(r) for r in ranks]
+    assert len(rank_batches[0]) == len(rank_batches[1]) == len(ranks[0]) == 2
+    assert not set(np.concatenate(rank_batches[0])) & set(np.concatenate(rank_batches[1]))
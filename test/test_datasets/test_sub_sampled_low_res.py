@@ -7,6 +7,7 @@ import data_preparation
 from omegaconf import OmegaConf, DictConfig
 from pathlib import Path
 import os
+import numpy as np
 
 def test_sub_sampled_low_res_dataset_initialization(sub_sampled_low_res_config_path: str = "../../config/dataset/sub_sampled_low_res.yaml"):
     base_dir = Path(__file__).resolve().parents[1]
@@ -80,3 +81,27 @@ def test_sub_sampled_low_res_dataset_initialization_val(sub_sampled_low_res_conf
         config = OmegaConf.load(f)
 
     assert len(dataset) == config.dataset_testing_fractions.unit_test
+
+
+def test_sub_sampled_low_res_dataset_mmap():
+    base_dir = Path(__file__).resolve().parents[1]
+    data_path = os.path.join(base_dir, "unit_test_sets", "sub_sampled_low_res/")
+    dataset_cfg: DictConfig = OmegaConf.create({
+        'dataset_name': 'subsampled_low_res',
+        'data_path': data_path,
+        'mmap_mode': 'r',
+        'dataset_testing_fractions': {
+            'quick': 0.01,
+            'reduced': 0.1,
+            'full': 1.0
+        }
+    })
+    dataset = data_preparation.SubSampledLowResDataset('train', 'reduced', dataset_cfg)
+    in_memory = np.load(os.path.join(data_path, "train_input.npy"))
+
+    # subsetting keeps the memory map instead of reading the data
+    assert isinstance(dataset.input, np.memmap)
+    assert len(dataset) == int(0.1 * len(in_memory))
+    x, y = dataset[5]
+    assert x.flags.writeable and not isinstance(x, np.memmap)
+    np.testing.assert_array_equal(x, in_memory[5])
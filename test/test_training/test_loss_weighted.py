@@ -0,0 +1,85 @@
+"""
+Testing the weighted loss of the Unet_v5 training script against the in-place slice weighting it replaces
+"""
+
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+import torch
+import torch.nn as nn
+import xarray as xr
+
+from climsim_utils.data_utils import data_utils
+
+BASE_DIR = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(BASE_DIR / "online_testing" / "baseline_models" / "Unet_v5" / "training"))
+
+from loss_weighted import WeightedLoss
+from climsim_layout_indices import compile_target_indices
+
+WEIGHTS = {"dt_weight": 2.0, "dq1_weight": 0.5, "dq2_weight": 3.0, "dq3_weight": 1.5,
+           "du_weight": 0.25, "dv_weight": 4.0, "d2d_weight": 0.1}
+
+
+def _target_layout(version):
+    norm_path = BASE_DIR / "preprocessing" / "normalizations"
+    data = data_utils(
+        grid_info=xr.open_dataset(BASE_DIR / "grid_info" / "ClimSim_low-res_grid-info.nc"),
+        input_mean=xr.open_dataset(norm_path / "inputs" / "input_mean_v5_pervar.nc"),
+        input_max=xr.open_dataset(norm_path / "inputs" / "input_max_v5_pervar.nc"),
+        input_min=xr.open_dataset(norm_path / "inputs" / "input_min_v5_pervar.nc"),
+        output_scale=xr.open_dataset(norm_path / "outputs" / "output_scale_std_lowerthred_v5.nc"),
+        ml_backend="pytorch",
+    )
+    getattr(data, f"set_to_{version}_vars")()
+    return data.target_layout
+
+
+def _reference_loss(criterion, pred, target):
+    # the 368-column v2 weighting of train_unet_h5loader.py
+    pred, target = pred.clone(), target.clone()
+    names = ["dt_weight", "dq1_weight", "dq2_weight", "dq3_weight", "du_weight", "dv_weight"]
+    for i, name in enumerate(names):
+        pred[:, 60 * i:60 * (i + 1)] *= WEIGHTS[name]
+        target[:, 60 * i:60 * (i + 1)] *= WEIGHTS[name]
+    pred[:, 360:368] *= WEIGHTS["d2d_weight"]
+    target[:, 360:368] *= WEIGHTS["d2d_weight"]
+    return criterion(pred, target)
+
+
+@pytest.mark.parametrize("loss, criterion", [("mse", nn.MSELoss()), ("mae", nn.L1Loss()), ("huber", nn.SmoothL1Loss())])
+def test_matches_inplace_weighting(loss, criterion):
+    layout = _target_layout("v2")
+    torch.manual_seed(0)
+    pred = torch.randn(16, layout.feature_len) * 2
+    target = torch.randn(16, layout.feature_len) * 2
+    pred_copy = pred.clone()
+    loss_fn = WeightedLoss(layout, loss=loss, weights=WEIGHTS)
+    value, partials = loss_fn(pred, target, return_partials=True)
+    torch.testing.assert_close(value, _reference_loss(criterion, pred, target))
+    torch.testing.assert_close(loss_fn(pred, target), value)
+    torch.testing.assert_close(partials.sum(), value)
+    assert torch.equal(pred, pred_copy)
+
+    partials = loss_fn.partials_dict(partials, prefix="loss_")
+    ptend_t = layout.slice("ptend_t")
+    expected = criterion(pred[:, ptend_t] * 2.0, target[:, ptend_t] * 2.0) * 60 / layout.feature_len
+    np.testing.assert_allclose(partials["loss_ptend_t"], expected.item(), rtol=1e-5)
+
+
+def test_output_prune_and_unweighted():
+    layout = _target_layout("v5")
+    prune_idx = compile_target_indices(layout, 15)["output_prune"]
+    pred = torch.randn(8, layout.feature_len)
+    target = torch.randn(8, layout.feature_len)
+    pred[:, prune_idx] = 0.0
+    target[:, prune_idx] = 0.0
+    loss_fn = WeightedLoss(layout, weights={"du_weight": 1.0}, output_prune_idx=prune_idx)
+    assert loss_fn.weighted
+    torch.testing.assert_close(loss_fn(pred, target), nn.MSELoss()(pred, target))
+    # ptend_qn of v5 is weighted with dq2_weight
+    loss_fn = WeightedLoss(layout, weights={"dq2_weight": 2.0})
+    assert torch.all(loss_fn.column_weight[layout.slice("ptend_qn")] == 2.0)
+    assert not WeightedLoss(layout).weighted